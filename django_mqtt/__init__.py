@@ -3,3 +3,5 @@ __author__ = "Victor Torre"
 __contact__ = "web.ehooo@gmail.com"
 __homepage__ = "https://github.com/ehooo/django_mqtt"
 __license__ = "http://www.gnu.org/licenses/old-licenses/gpl-2.0.html"
+
+default_app_config = 'django_mqtt.apps.DjangoMqttConfig'
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class DjangoMqttConfig(AppConfig):
     name = 'django_mqtt'
+
+    def ready(self):
+        from django_mqtt import receivers
+        receivers.connect()
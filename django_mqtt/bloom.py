@@ -0,0 +1,175 @@
+"""
+Bloom filters of the usernames, topic names and client id names that exist, to reject the unknown ones without
+queries, and a short lived cache of the names that pass the filter but are not found.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+
+from django_mqtt.cache import LRUCache
+from django_mqtt.models import (
+    CHANGE_ALL,
+    CHANGE_CLIENTID,
+    CHANGE_TOPIC,
+    CHANGE_USER,
+    ACLChange,
+    ClientId,
+    PolicyVersion,
+    Topic
+)
+
+# Names not found by kind, see KnownNames.missed
+negative_cache = LRUCache('MQTT_NEGATIVE_CACHE_SIZE', 'MQTT_NEGATIVE_CACHE_TIMEOUT', timeout=5, name='negative')
+# Min capacity of KnownNames filters, the names added later fit until it is built again
+MIN_CAPACITY = 1000
+
+
+class BloomFilter(object):
+    """
+    Set of strings without false negatives, the false positives are bounded by error_rate up to capacity strings.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity = max(capacity, 1)
+        self.size = max(64, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def get_positions(self, value):
+        if isinstance(value, str):
+            value = value.encode()
+        digest = hashlib.blake2b(value, digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + index * second) % self.size for index in range(self.hashes)]
+
+    def add(self, value):
+        for position in self.get_positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self.get_positions(value))
+
+
+class KnownNames(object):
+    """
+    Bloom filter of the names of kind loaded from the database if MQTT_BLOOM_FILTER is set. When PolicyVersion
+    changes, checked at most every MQTT_ACL_POLICY_POLL seconds, the names of the objects changed since then are added
+    from the ACLChange entries, it is built again only if any of them was deleted or the log could not be followed.
+    The names saved in this process are added at once.
+    """
+
+    def __init__(self, kind, model, load):
+        """
+        :param kind: key prefix in negative_cache
+        :param model: ACLChange.model of the objects
+        :param load: function(pks=None) that returns the names by pk, only the ones of pks if they are given
+        """
+        self.kind = kind
+        self.model = model
+        self.load = load
+        self.reset()
+
+    def reset(self):
+        self._filter = None
+        self._version = None
+        self._checked = 0
+        self._seq = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def build(self):
+        with transaction.atomic():
+            seq = ACLChange.get_last_seq()
+            names = self.load()
+        bloom = BloomFilter(max(len(names) * 2, MIN_CAPACITY), getattr(settings, 'MQTT_BLOOM_FILTER_ERROR_RATE', 0.001))
+        for name in names.values():
+            bloom.add(name)
+        self._seq, self._count = seq, len(names)
+        return bloom
+
+    def update(self, bloom):
+        """
+        Add to bloom the names of the objects changed after the last ACLChange entry applied
+        :return: False if it must be built again, there are not entries, any object was deleted, the log could not be
+        read by ACLChange.get_since or bloom is full
+        """
+        changes = ACLChange.get_since(self._seq, limit=getattr(settings, 'MQTT_ACL_POLICY_DELTA_LIMIT', 1000))
+        if not changes or any(model == CHANGE_ALL for seq, model, object_id in changes):
+            return False
+        pks = {object_id for seq, model, object_id in changes if model == self.model}
+        names = self.load(pks) if pks else {}
+        if len(names) < len(pks) or self._count + len(names) > bloom.capacity:
+            return False
+        for name in names.values():
+            bloom.add(name)
+        self._seq, self._count = changes[-1][0], self._count + len(names)
+        return True
+
+    def get_filter(self):
+        bloom = self._filter
+        now = time.monotonic()
+        if bloom is not None and now - self._checked < getattr(settings, 'MQTT_ACL_POLICY_POLL', 1):
+            return bloom
+        with self._lock:
+            bloom = self._filter
+            version = PolicyVersion.get_version()
+            if bloom is None or (version != self._version and not self.update(bloom)):
+                bloom = self.build()
+            self._filter, self._version, self._checked = bloom, version, now
+        return bloom
+
+    def may_exist(self, name):
+        """
+        :return: False if name is not in the database for sure, always True without MQTT_BLOOM_FILTER
+        :rtype: bool
+        """
+        if not getattr(settings, 'MQTT_BLOOM_FILTER', False):
+            return True
+        if name is None or negative_cache.get((self.kind, name), False):
+            return False
+        return name in self.get_filter()
+
+    def missed(self, name):
+        """
+        Cache that name passed the filter but it is not in the database, for MQTT_NEGATIVE_CACHE_TIMEOUT seconds
+        """
+        if name is not None:
+            negative_cache.set((self.kind, name), True)
+
+    def add(self, name):
+        with self._lock:
+            if self._filter is not None:
+                self._filter.add(name)
+        negative_cache.delete((self.kind, name))
+
+
+def load_names(queryset, field, pks=None):
+    if pks is not None:
+        queryset = queryset.filter(pk__in=pks)
+    return dict(queryset.values_list('pk', field))
+
+
+def load_usernames(pks=None):
+    user_model = get_user_model()
+    return load_names(user_model.objects.all(), user_model.USERNAME_FIELD, pks)
+
+
+known_usernames = KnownNames('user', CHANGE_USER, load_usernames)
+known_topics = KnownNames('topic', CHANGE_TOPIC, lambda pks=None: load_names(Topic.objects.all(), 'name', pks))
+known_clientids = KnownNames('clientid', CHANGE_CLIENTID,
+                             lambda pks=None: load_names(ClientId.objects.all(), 'name', pks))
+
+
+@receiver(setting_changed)
+def reset_known_names(setting, **kwargs):
+    if setting == 'MQTT_BLOOM_FILTER' or setting == 'MQTT_BLOOM_FILTER_ERROR_RATE':
+        for known in (known_usernames, known_topics, known_clientids):
+            known.reset()
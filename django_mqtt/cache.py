@@ -0,0 +1,219 @@
+import asyncio
+import threading
+import time
+import weakref
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+_caches = weakref.WeakSet()
+_flights = weakref.WeakSet()
+# Default of LRUCache.get to know that a key is not cached when the cached value could be None
+NOT_CACHED = object()
+
+
+class LRUCache(object):
+    """
+    Process local mapping bounded to the max_size most recently used keys, the keys expire after timeout seconds.
+    max_size and timeout are read from the settings size_setting and timeout_setting, max_size 0 disables the cache
+    and timeout None keeps the keys until they are invalidated.
+    name labels its counters on the metrics, size_setting by default.
+    user_key(key) is the pk of the user whose data is cached in key, or None if it does not depend on any user. The
+    caches without user_key are cleared by any user change, see clear_users.
+    """
+
+    def __init__(self, size_setting, timeout_setting, size=0, timeout=60, name=None, user_key=None):
+        self.name = name or size_setting
+        self.user_key = user_key
+        self.size_setting = size_setting
+        self.timeout_setting = timeout_setting
+        self.default_size = size
+        self.default_timeout = timeout
+        self.max_size = size
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.configure()
+        _caches.add(self)
+
+    def configure(self):
+        self.max_size = getattr(settings, self.size_setting, self.default_size) or 0
+        self.timeout = getattr(settings, self.timeout_setting, self.default_timeout)
+        self.clear()
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        if not self.enabled:
+            return default
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if not self.enabled:
+            return
+        expires = None
+        if self.timeout is not None:
+            expires = time.monotonic() + self.timeout
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def discard(self, predicate):
+        """
+        Delete all the keys where predicate(key) is True
+        """
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class Flight(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Coalesce the concurrent calls with the same key, the first one computes the value and the others wait for it.
+    calls counts all the calls and coalesced the ones served by the computation of other call.
+    """
+
+    def __init__(self, name=None):
+        self.name = name or 'default'
+        self.calls = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._futures = {}
+        self._lock = threading.Lock()
+        _flights.add(self)
+
+    def do(self, key, function, *args, **kwargs):
+        """
+        :return: function(*args, **kwargs) computed by this thread or by other thread that called it with key
+        """
+        with self._lock:
+            self.calls += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = function(*args, **kwargs)
+        except Exception as error:
+            flight.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.event.set()
+        return flight.value
+
+    async def ado(self, key, function, *args, **kwargs):
+        """
+        :return: await function(*args, **kwargs) computed by this task or by other task of the event loop that
+        called it with key
+        """
+        key = (asyncio.get_running_loop(), key)
+        with self._lock:
+            self.calls += 1
+            future = self._futures.get(key)
+            if future is not None:
+                self.coalesced += 1
+        if future is not None:
+            return await asyncio.shield(future)
+        future = self._futures[key] = asyncio.get_running_loop().create_future()
+        try:
+            value = await function(*args, **kwargs)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as error:
+            future.set_exception(error)
+            future.exception()  # Retrieved, the waiters raise it again
+            raise
+        else:
+            future.set_result(value)
+        finally:
+            del self._futures[key]
+        return value
+
+
+def get_caches():
+    return list(_caches)
+
+
+def get_flights():
+    return list(_flights)
+
+
+def clear_caches():
+    for cache in list(_caches):
+        cache.clear()
+
+
+def no_user(key):
+    """
+    user_key of the caches that do not depend on the users
+    """
+    return None
+
+
+def clear_users(users):
+    """
+    Discard the keys of the users from the caches with user_key, the caches without it are cleared
+    :param users: pk set of the changed users
+    """
+    for cache in list(_caches):
+        if cache.user_key is None:
+            cache.clear()
+        else:
+            cache.discard(lambda key: cache.user_key(key) in users)
+
+
+@receiver(setting_changed)
+def reload_settings(setting, **kwargs):
+    for cache in list(_caches):
+        if setting in (cache.size_setting, cache.timeout_setting):
+            cache.configure()
+        elif setting.startswith('MQTT_'):
+            cache.clear()
@@ -0,0 +1,54 @@
+import hashlib
+import hmac
+import os
+
+from django.utils.crypto import constant_time_compare
+
+from django_mqtt.cache import LRUCache, no_user
+
+# Successful password verifications, the keys are HMAC of the credentials and the values keep only an HMAC of
+# the password hash verified, so a changed password is not accepted from the cache.
+credentials_cache = LRUCache('MQTT_CREDENTIALS_CACHE_SIZE', 'MQTT_CREDENTIALS_CACHE_TIMEOUT', timeout=60,
+                             name='credentials', user_key=no_user)
+
+# Random by process, the digests are useless out of it
+_secret = os.urandom(32)
+
+
+def get_digest(*values):
+    """
+    :return: HMAC-SHA256 of the values with the process secret
+    :rtype: str
+    """
+    message = '\x00'.join('' if value is None else str(value) for value in values)
+    return hmac.new(_secret, message.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def get_credentials_key(scope, identifier, password):
+    """
+    :param scope: kind of credentials, like 'user' or 'acl'
+    :param identifier: username, pk...
+    :param password: raw password
+    """
+    return scope, get_digest(scope, identifier, password)
+
+
+def get_verified(key):
+    """
+    :return: (pk, hash digest) cached for key or None
+    """
+    return credentials_cache.get(key)
+
+
+def is_verified(verified, pk, encoded):
+    """
+    :param verified: from get_verified
+    :param pk: pk of the object with the password
+    :param encoded: current password hash of the object
+    :return: If verified is the verification of the current password of the object
+    """
+    return verified is not None and verified[0] == pk and constant_time_compare(verified[1], get_digest(encoded))
+
+
+def set_verified(key, pk, encoded):
+    credentials_cache.set(key, (pk, get_digest(encoded)))
@@ -0,0 +1,91 @@
+import functools
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.contrib.auth.hashers import UNUSABLE_PASSWORD_PREFIX, UNUSABLE_PASSWORD_SUFFIX_LENGTH, PBKDF2PasswordHasher
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.crypto import get_random_string
+from django.utils.module_loading import import_string
+
+
+class MQTTPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2 with few iterations, for the machine secrets checked on each CONNECT, not for human passwords
+    """
+    algorithm = 'mqtt_pbkdf2_sha256'
+    iterations = 1000
+
+
+@functools.lru_cache()
+def get_hashers():
+    """
+    :return: The hashers of MQTT_ACL_PASSWORD_HASHERS, or the ones of PASSWORD_HASHERS if it is not set.
+    The first one is used for the new passwords.
+    """
+    paths = getattr(settings, 'MQTT_ACL_PASSWORD_HASHERS', None)
+    if not paths:
+        return hashers.get_hashers()
+    return [import_string(path)() for path in paths]
+
+
+def get_hasher(algorithm='default'):
+    hasher_list = get_hashers()
+    if algorithm == 'default':
+        return hasher_list[0]
+    for hasher in hasher_list:
+        if hasher.algorithm == algorithm:
+            return hasher
+    raise ValueError('Unknown password hashing algorithm %r. Did you specify it in the MQTT_ACL_PASSWORD_HASHERS '
+                     'setting?' % algorithm)
+
+
+def identify_hasher(encoded):
+    """
+    Same as django.contrib.auth.hashers.identify_hasher with the ACL hashers
+    """
+    if (len(encoded) == 32 and '$' not in encoded) or (len(encoded) == 37 and encoded.startswith('md5$$')):
+        algorithm = 'unsalted_md5'
+    elif len(encoded) == 46 and encoded.startswith('sha1$$'):
+        algorithm = 'unsalted_sha1'
+    else:
+        algorithm = encoded.split('$', 1)[0]
+    return get_hasher(algorithm)
+
+
+def make_password(password, salt=None):
+    """
+    Same as django.contrib.auth.hashers.make_password with the ACL hashers
+    """
+    if password is None:
+        return UNUSABLE_PASSWORD_PREFIX + get_random_string(UNUSABLE_PASSWORD_SUFFIX_LENGTH)
+    hasher = get_hasher()
+    return hasher.encode(password, salt or hasher.salt())
+
+
+def check_password(password, encoded, setter=None):
+    """
+    Same as django.contrib.auth.hashers.check_password with the ACL hashers, setter is called with the raw password
+    when it is correct and the hash must be upgraded to the first hasher or its current parameters
+    """
+    if password is None or not hashers.is_password_usable(encoded):
+        return False
+    preferred = get_hasher()
+    try:
+        hasher = identify_hasher(encoded)
+    except ValueError:
+        return False
+    hasher_changed = hasher.algorithm != preferred.algorithm
+    must_update = hasher_changed or preferred.must_update(encoded)
+    is_correct = hasher.verify(password, encoded)
+    if not is_correct and not hasher_changed and must_update:
+        hasher.harden_runtime(password, encoded)
+    if setter and is_correct and must_update:
+        setter(password)
+    return is_correct
+
+
+@receiver(setting_changed)
+def reset_hashers(setting, **kwargs):
+    if setting in ('MQTT_ACL_PASSWORD_HASHERS', 'PASSWORD_HASHERS'):
+        get_hashers.cache_clear()
@@ -0,0 +1,23 @@
+from __future__ import absolute_import
+
+from django.core.management.base import BaseCommand
+from django.utils.translation import ugettext as _
+
+from django_mqtt.models import CHANGE_ALL, ACLChange
+
+
+class Command(BaseCommand):
+    help = _('Compact the ACL change log, keeping only the last change of each object')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset', action='store_true', default=False, dest='reset',
+            help=_('Log a change of everything before compact, all the processes will rebuild their policy')
+        )
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            ACLChange.log(CHANGE_ALL)
+        deleted = ACLChange.compact()
+        self.stdout.write(_('%(deleted)s changes deleted, %(remain)s remain') % {
+            'deleted': deleted, 'remain': ACLChange.objects.count()})
@@ -0,0 +1,29 @@
+from __future__ import absolute_import
+
+from django.core.management.base import BaseCommand
+from django.utils.translation import ugettext as _
+
+from django_mqtt.mosquitto.export import FORMAT_ACL_FILE, FORMATS, GENERATORS, export_policy
+from django_mqtt.policy import Policy
+
+
+class Command(BaseCommand):
+    help = _('Compile the ACLs into a mosquitto acl_file or a dynamic security plugin document')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--format', choices=FORMATS, default=FORMAT_ACL_FILE, dest='format',
+            help=_('Output format, acl_file by default')
+        )
+        parser.add_argument(
+            '--output', default=None, dest='output',
+            help=_('File replaced atomically with the output, the standard output by default')
+        )
+
+    def handle(self, *args, **options):
+        policy = Policy.build()
+        if options['output']:
+            export_policy(options['output'], options['format'], policy=policy)
+        else:
+            for chunk in GENERATORS[options['format']](policy):
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,236 @@
+"""
+Instrumentation of the auth plugin endpoints: latency, queries and decisions of each request, the decisions resolved by
+the default rule and the counters of the caches. Disabled by default, see MQTT_METRICS.
+"""
+import bisect
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connection
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from django_mqtt.cache import get_caches, get_flights
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+QUERIES_BUCKETS = (0, 1, 2, 3, 5, 10, 25)
+
+
+class Histogram(object):
+    """
+    Cumulative histogram on the Prometheus way, counts[i] are the observations lower or equal than buckets[i] and the
+    last one is +Inf
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def get_samples(self, name, labels):
+        """
+        :return: (name, labels, value) of each bucket, the sum and the count
+        """
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf', ), self.counts):
+            total += count
+            yield '%s_bucket' % name, labels + (('le', str(bound)), ), total
+        yield '%s_sum' % name, labels, self.sum
+        yield '%s_count' % name, labels, self.count
+
+
+class Collector(object):
+    """
+    Receiver of the measures, MQTT_METRICS_COLLECTOR could be any subclass, e.g. to send them to statsd.
+    """
+
+    def observe(self, endpoint, seconds, queries, allowed):
+        """
+        :param endpoint: auth, superuser or acl
+        :param seconds: time resolving the decision
+        :param queries: database queries executed
+        :param allowed: decision
+        """
+        raise NotImplementedError()
+
+    def count_default(self):
+        """
+        Count an ACL decision resolved by the default rule, without any matching ACL
+        """
+        raise NotImplementedError()
+
+    def collect(self):
+        """
+        :return: (name, type, help, samples) of each metric, samples as (name, labels, value)
+        """
+        return []
+
+
+class InProcessCollector(Collector):
+    """
+    Keep the measures by process, each worker exposes only its own ones
+    """
+
+    def __init__(self):
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.queries = defaultdict(lambda: Histogram(QUERIES_BUCKETS))
+        self.decisions = defaultdict(int)
+        self.defaults = 0
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, seconds, queries, allowed):
+        with self._lock:
+            self.latency[endpoint].observe(seconds)
+            self.queries[endpoint].observe(queries)
+            self.decisions[(endpoint, 'allow' if allowed else 'deny')] += 1
+
+    def count_default(self):
+        with self._lock:
+            self.defaults += 1
+
+    def collect(self):
+        with self._lock:
+            latency = [sample for endpoint, histogram in sorted(self.latency.items())
+                       for sample in histogram.get_samples('mqtt_request_duration_seconds',
+                                                           (('endpoint', endpoint), ))]
+            queries = [sample for endpoint, histogram in sorted(self.queries.items())
+                       for sample in histogram.get_samples('mqtt_request_queries', (('endpoint', endpoint), ))]
+            decisions = [('mqtt_decisions_total', (('endpoint', endpoint), ('decision', decision)), count)
+                         for (endpoint, decision), count in sorted(self.decisions.items())]
+            defaults = [('mqtt_default_decisions_total', (), self.defaults)]
+        return [
+            ('mqtt_request_duration_seconds', 'histogram', 'Time resolving the decision of each request', latency),
+            ('mqtt_request_queries', 'histogram', 'Database queries of each request', queries),
+            ('mqtt_decisions_total', 'counter', 'Decisions of the requests', decisions),
+            ('mqtt_default_decisions_total', 'counter', 'ACL decisions resolved by the default rule', defaults),
+        ]
+
+
+_collector = None
+_configured = False
+# Thread state of unmeasured
+_local = threading.local()
+
+
+def get_collector():
+    """
+    :return: Instance of MQTT_METRICS_COLLECTOR if MQTT_METRICS is set, created once by process
+    :rtype: Collector|None
+    """
+    global _collector, _configured
+    if not _configured:
+        collector = None
+        if getattr(settings, 'MQTT_METRICS', False):
+            path = getattr(settings, 'MQTT_METRICS_COLLECTOR', 'django_mqtt.metrics.InProcessCollector')
+            collector = import_string(path)()
+        _collector, _configured = collector, True
+    return _collector
+
+
+@receiver(setting_changed)
+def reset_collector(setting, **kwargs):
+    global _collector, _configured
+    if setting.startswith('MQTT_METRICS'):
+        _collector, _configured = None, False
+
+
+class QueryCounter(object):
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def unmeasured():
+    """
+    Do not record the decisions resolved by this thread inside the block, they are not requests, like the exported ones
+    """
+    previous = getattr(_local, 'unmeasured', False)
+    _local.unmeasured = True
+    try:
+        yield
+    finally:
+        _local.unmeasured = previous
+
+
+def measure(endpoint, decision, data):
+    """
+    :param endpoint: label of the endpoint
+    :param decision: function of the posted data, like auth.acl_allowed
+    :param data: posted data
+    :return: decision(data), measured if there is a collector and it is not unmeasured
+    """
+    collector = _collector if _configured else get_collector()
+    if collector is None or getattr(_local, 'unmeasured', False):
+        return decision(data)
+    queries = QueryCounter()
+    start = time.perf_counter()
+    with connection.execute_wrapper(queries):
+        allowed = decision(data)
+    collector.observe(endpoint, time.perf_counter() - start, queries.count, allowed)
+    return allowed
+
+
+def count_default():
+    collector = _collector if _configured else get_collector()
+    if collector is not None and not getattr(_local, 'unmeasured', False):
+        collector.count_default()
+
+
+def collect_caches():
+    """
+    :return: (name, type, help, samples) of the counters of the caches and the single flights of this process
+    """
+    caches = sorted(get_caches(), key=lambda cache: cache.name)
+    flights = sorted(get_flights(), key=lambda flight: flight.name)
+    ratios = []
+    for cache in caches:
+        lookups = cache.hits + cache.misses
+        ratios.append(('mqtt_cache_hit_ratio', (('cache', cache.name), ), cache.hits / lookups if lookups else 0))
+    return [
+        ('mqtt_cache_hits_total', 'counter', 'Lookups of cached keys',
+         [('mqtt_cache_hits_total', (('cache', cache.name), ), cache.hits) for cache in caches]),
+        ('mqtt_cache_misses_total', 'counter', 'Lookups of keys not cached or expired',
+         [('mqtt_cache_misses_total', (('cache', cache.name), ), cache.misses) for cache in caches]),
+        ('mqtt_cache_hit_ratio', 'gauge', 'Hits of all the lookups', ratios),
+        ('mqtt_cache_size', 'gauge', 'Keys cached',
+         [('mqtt_cache_size', (('cache', cache.name), ), len(cache)) for cache in caches]),
+        ('mqtt_single_flight_calls_total', 'counter', 'Calls that could be coalesced',
+         [('mqtt_single_flight_calls_total', (('flight', flight.name), ), flight.calls) for flight in flights]),
+        ('mqtt_single_flight_coalesced_total', 'counter', 'Calls served by the computation of other call',
+         [('mqtt_single_flight_coalesced_total', (('flight', flight.name), ), flight.coalesced)
+          for flight in flights]),
+    ]
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def generate_text(collector):
+    """
+    :param collector:
+    :type collector: Collector
+    :return: lines of the Prometheus text exposition format of the metrics of collector and the caches
+    """
+    for name, metric_type, help_text, samples in list(collector.collect()) + collect_caches():
+        yield '# HELP %s %s\n' % (name, help_text)
+        yield '# TYPE %s %s\n' % (name, metric_type)
+        for sample_name, labels, value in samples:
+            if labels:
+                sample_name = '%s{%s}' % (sample_name, ','.join('%s="%s"' % (label, escape_label(label_value))
+                                                                for label, label_value in labels))
+            yield '%s %s\n' % (sample_name, repr(float(value)) if isinstance(value, float) else value)
@@ -0,0 +1,60 @@
+# Generated by Django 3.1.14 on 2026-10-18 02:17
+
+import hashlib
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def level_digest(level):
+    return hashlib.sha256(level.encode('utf8')).hexdigest()
+
+
+def fill_levels(apps, schema_editor):
+    Topic = apps.get_model('django_mqtt', 'Topic')
+    TopicLevel = apps.get_model('django_mqtt', 'TopicLevel')
+    db_alias = schema_editor.connection.alias
+    for topic in Topic.objects.using(db_alias).iterator():
+        levels = topic.name.split('/')
+        Topic.objects.using(db_alias).filter(pk=topic.pk).update(depth=len(levels),
+                                                                 first_level_hash=level_digest(levels[0]))
+        TopicLevel.objects.using(db_alias).bulk_create([
+            TopicLevel(topic=topic, position=position, name=level, name_hash=level_digest(level))
+            for position, level in enumerate(levels) if position > 0
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_mqtt', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='topic',
+            name='depth',
+            field=models.PositiveSmallIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='first_level_hash',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=64),
+            preserve_default=False,
+        ),
+        migrations.CreateModel(
+            name='TopicLevel',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveSmallIntegerField()),
+                ('name', models.CharField(blank=True, max_length=1024)),
+                ('name_hash', models.CharField(editable=False, max_length=64)),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='levels', to='django_mqtt.topic')),
+            ],
+            options={
+                'unique_together': {('topic', 'position')},
+                'index_together': {('position', 'name_hash')},
+            },
+        ),
+        migrations.RunPython(fill_levels, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.1.14 on 2026-10-18 02:31
+
+import hashlib
+
+from django.db import migrations, models
+import django_mqtt.validators
+
+
+def fill_name_hash(apps, schema_editor):
+    Topic = apps.get_model('django_mqtt', 'Topic')
+    db_alias = schema_editor.connection.alias
+    for topic in Topic.objects.using(db_alias).iterator():
+        name_hash = hashlib.sha256(topic.name.encode('utf8')).hexdigest()
+        Topic.objects.using(db_alias).filter(pk=topic.pk).update(name_hash=name_hash)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_mqtt', '0002_topic_levels'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='topic',
+            name='name_hash',
+            field=models.CharField(editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(fill_name_hash, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='topic',
+            name='name_hash',
+            field=models.CharField(editable=False, max_length=64, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='topic',
+            name='name',
+            field=models.CharField(max_length=1024, validators=[django_mqtt.validators.TopicValidator()]),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 3.1.14 on 2026-10-18 02:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_mqtt', '0004_policy_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ACLChange',
+            fields=[
+                ('seq', models.BigAutoField(primary_key=True, serialize=False)),
+                ('model', models.CharField(choices=[('all', 'All'), ('acl', 'ACL'), ('topic', 'Topic'), ('clientid', 'Client ID'), ('user', 'User'), ('group', 'Group')], max_length=10)),
+                ('object_id', models.BigIntegerField(blank=True, null=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'index_together': {('model', 'object_id')},
+            },
+        ),
+    ]
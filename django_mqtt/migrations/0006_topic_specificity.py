@@ -0,0 +1,37 @@
+# Generated by Django 3.1.14 on 2026-10-18 03:10
+
+from django.db import migrations, models
+
+
+def topic_specificity(name):
+    """
+    Frozen copy of django_mqtt.protocol.topic_specificity
+    """
+    levels = name.split('/')
+    single = levels.count('+')
+    if levels[-1] != '#':
+        return single
+    return (1 << 20) | ((1024 - len(levels)) << 10) | single
+
+
+def fill_specificity(apps, schema_editor):
+    Topic = apps.get_model('django_mqtt', 'Topic')
+    db_alias = schema_editor.connection.alias
+    for pk, name in Topic.objects.using(db_alias).values_list('pk', 'name').iterator():
+        Topic.objects.using(db_alias).filter(pk=pk).update(specificity=topic_specificity(name))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_mqtt', '0005_acl_change'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='topic',
+            name='specificity',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False),
+        ),
+        migrations.RunPython(fill_specificity, migrations.RunPython.noop),
+    ]
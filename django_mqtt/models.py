@@ -1,14 +1,29 @@
 from django.conf import settings
-from django.contrib.auth.hashers import is_password_usable, make_password, check_password
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import is_password_usable
 from django.contrib.auth.models import Group
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Exists, F, OuterRef, Q
 from django.utils.translation import ugettext_lazy as _
+from django_mqtt.cache import NOT_CACHED, LRUCache, no_user
+from django_mqtt.credentials import (
+    credentials_cache,
+    get_credentials_key,
+    get_verified,
+    is_verified,
+    set_verified
+)
+from django_mqtt.hashers import check_password, make_password
 from django_mqtt.protocol import (
     TOPIC_BEGINNING_DOLLAR,
     TOPIC_SEP,
     WILDCARD_MULTI_LEVEL,
-    WILDCARD_SINGLE_LEVEL
+    WILDCARD_SINGLE_LEVEL,
+    TopicTrie,
+    topic_digest,
+    topic_matches,
+    topic_specificity
 )
 from django_mqtt.validators import ClientIdValidator, TopicValidator
 
@@ -19,6 +34,15 @@ PROTO_MQTT_ACC = (
     (PROTO_MQTT_ACC_PUB, _('Publisher')),
 )
 
+# Broadcast ACL by acc, see ACL.get_broadcast
+broadcast_cache = LRUCache('MQTT_ACL_CACHE_SIZE', 'MQTT_ACL_CACHE_TIMEOUT', name='broadcast', user_key=no_user)
+# Allowed users pk by client id name, see ClientId.get_principals
+clientid_cache = LRUCache('MQTT_CLIENTID_CACHE_SIZE', 'MQTT_CLIENTID_CACHE_TIMEOUT', size=10000, timeout=None,
+                          name='clientid')
+# TopicTrie of the wildcard ACLs by acc, see ACL.get_wildcard_index
+wildcard_index_cache = LRUCache('MQTT_WILDCARD_INDEX_CACHE_SIZE', 'MQTT_WILDCARD_INDEX_CACHE_TIMEOUT',
+                                size=len(PROTO_MQTT_ACC), timeout=None, name='wildcard_index', user_key=no_user)
+
 ALLOW_EMPTY_CLIENT_ID = False
 if hasattr(settings, 'MQTT_ALLOW_EMPTY_CLIENT_ID'):
     ALLOW_EMPTY_CLIENT_ID = settings.MQTT_ALLOW_EMPTY_CLIENT_ID
@@ -41,16 +65,47 @@ class ClientId(SecureSave):
     groups = models.ManyToManyField(Group, blank=True)
 
     def is_public(self):
-        return self.users.count() == 0 and self.groups.count() == 0
+        if hasattr(self, 'has_users'):
+            return not self.has_users and not self.has_groups
+        return not self.users.exists() and not self.groups.exists()
 
     def has_permission(self, user):
-        if not self.is_public():
-            if user:
-                if self.users.filter(pk=user.pk):
-                    return True
-                elif self.groups.filter(pk__in=user.groups.all().values_list('pk')).count() > 0:
-                    return True
-        return self.is_public()
+        principals = ClientId.get_principals(self.name)
+        return principals is None or (user is not None and user.pk in principals)
+
+    @classmethod
+    def load_principals(cls, name):
+        """
+        :return: pk of the users and members of the groups of the client id name, None if it is public or unknown
+        :rtype: frozenset|None
+        """
+        clientid = cls.objects.filter(name=name).annotate(
+            has_users=Exists(cls.users.through.objects.filter(clientid=OuterRef('pk'))),
+            has_groups=Exists(cls.groups.through.objects.filter(clientid=OuterRef('pk')))
+        ).first()
+        if clientid is None or clientid.is_public():
+            return None
+        members = get_user_model().objects.filter(Q(clientid=clientid) | Q(groups__clientid=clientid))
+        return frozenset(members.values_list('pk', flat=True).distinct())
+
+    @classmethod
+    def get_principals(cls, name):
+        """
+        Same as load_principals, cached while MQTT_CLIENTID_CACHE_SIZE is not 0 until any ACL data changes or
+        MQTT_CLIENTID_CACHE_TIMEOUT, the changes of other processes are seen when PolicyVersion is checked.
+
+        :rtype: frozenset|None
+        """
+        if name is None:
+            return None
+        if clientid_cache.enabled:
+            from django_mqtt.policy import get_policy_version
+            get_policy_version()
+        principals = clientid_cache.get(name, NOT_CACHED)
+        if principals is NOT_CACHED:
+            principals = cls.load_principals(name)
+            clientid_cache.set(name, principals)
+        return principals
 
     def __str__(self):
         return self.name
@@ -61,10 +116,33 @@ class ClientId(SecureSave):
                 raise ValidationError('Empty client_id not allowed', code='invalid')
 
 
+class TopicQuerySet(models.QuerySet):
+    def named(self, name):
+        """
+        Equality lookup of the topic name through the indexed digest
+        """
+        if name is None:
+            return self.none()
+        if isinstance(name, bytes):
+            name = name.decode()
+        return self.filter(name_hash=topic_digest(name), name=name)
+
+    def get_or_create_named(self, name):
+        if isinstance(name, bytes):
+            name = name.decode()
+        return self.get_or_create(name_hash=topic_digest(name), defaults={'name': name})
+
+
 class Topic(SecureSave):
-    name = models.CharField(max_length=1024, validators=[TopicValidator()], db_index=True, unique=True, blank=False)
+    name = models.CharField(max_length=1024, validators=[TopicValidator()], blank=False)
+    name_hash = models.CharField(max_length=64, unique=True, editable=False)
     wildcard = models.BooleanField(default=False)
     dollar = models.BooleanField(default=False)
+    depth = models.PositiveSmallIntegerField(default=0, db_index=True, editable=False)
+    first_level_hash = models.CharField(max_length=64, db_index=True, editable=False)  # topic_digest of the first level
+    specificity = models.PositiveIntegerField(default=0, db_index=True, editable=False)  # see topic_specificity
+
+    objects = TopicQuerySet.as_manager()
 
     def __str__(self):
         return self.name
@@ -84,16 +162,15 @@ class Topic(SecureSave):
         return hash(self._get_pk_val())
 
     def __lt__(self, other):
-        comp = None
         if isinstance(other, Topic):
-            comp = other
-        elif isinstance(other, str):
-            comp = Topic(name=other)
+            other = other.name
         elif isinstance(other, bytes):
-            comp = Topic(name=other.decode())
-        if not comp or not comp.is_wildcard():
+            other = other.decode()
+        elif not isinstance(other, str):
             return False
-        return self in comp
+        if WILDCARD_MULTI_LEVEL not in other and WILDCARD_SINGLE_LEVEL not in other:
+            return False
+        return topic_matches(other, self.name)
 
     def __len__(self):
         return len(self.name)
@@ -102,12 +179,10 @@ class Topic(SecureSave):
         if not self.is_wildcard():
             return False
         if isinstance(other, Topic):
-            return other in self
-        elif isinstance(other, str):
-            return Topic(other) in self
-        elif isinstance(other, bytes):
-            return Topic(name=other.decode()) in self
-        return False
+            other = other.name
+        elif not isinstance(other, (str, bytes)):
+            return False
+        return topic_matches(self.name, other)
 
     def is_wildcard(self):
         return WILDCARD_MULTI_LEVEL in self.name or WILDCARD_SINGLE_LEVEL in self.name
@@ -116,73 +191,47 @@ class Topic(SecureSave):
         return self.name.startswith(TOPIC_BEGINNING_DOLLAR)
 
     def __contains__(self, item):
-        comp = None
         if isinstance(item, Topic):
-            comp = item
-        elif isinstance(item, str):
-            comp = Topic(name=item)
-        elif isinstance(item, bytes):
-            comp = Topic(name=item.decode())
-        if not comp:
+            item = item.name
+        elif not isinstance(item, (str, bytes)):
             return False
-
-        if self == comp:
-            return True
-        elif not self.is_wildcard():
-            return False
-        elif (self.is_dollar() and not comp.is_dollar()) or (comp.is_dollar() and not self.is_dollar()):
-            return False
-
-        my_parts = self.name.split(TOPIC_SEP)
-        comp_parts = comp.name.split(TOPIC_SEP)
-        if self.is_dollar():
-            if my_parts[0] != comp_parts[0]:
-                return False
-
-        comp_size = len(comp_parts)
-        if comp_size < len(my_parts):
-            return False
-        if not self.name.endswith(WILDCARD_MULTI_LEVEL) and comp_size > len(my_parts):
-            return False
-
-        iter_comp = iter(comp_parts)
-        for part in my_parts:
-            compare = next(iter_comp)
-            if part == WILDCARD_SINGLE_LEVEL:
-                if comp.is_wildcard() and compare == WILDCARD_MULTI_LEVEL:
-                    return False
-            elif part == WILDCARD_MULTI_LEVEL:
-                return True
-            elif part != compare:
-                return False
-        return True
+        return topic_matches(self.name, item)
+
+    def validate_unique(self, exclude=None):
+        exclude = set(exclude or ())
+        check_name = 'name' not in exclude
+        if check_name:
+            exclude.add('name_hash')
+        super(Topic, self).validate_unique(exclude=exclude)
+        if check_name:
+            topics = Topic.objects.filter(name_hash=topic_digest(self.name))
+            if not self._state.adding and self.pk is not None:
+                topics = topics.exclude(pk=self.pk)
+            if topics.exists():
+                raise ValidationError({'name': self.unique_error_message(Topic, ('name', ))})
+
+    def get_levels(self):
+        return self.name.split(TOPIC_SEP)
 
     def get_candidates(self):
-        # TODO improve it
+        """
+        :return: the not wildcard topics contained in this topic, filtered only with indexed columns
+        :rtype: django.db.models.QuerySet
+        """
         candidates = Topic.objects.filter(dollar=self.is_dollar(), wildcard=False)
-        Topic.objects.filter(dollar=self.is_dollar(), wildcard=False)
-        topic = self.name
-        multi = False
-        if topic.endswith(WILDCARD_MULTI_LEVEL):
-            topic = topic[:-1]
-            multi = True
-
-        parts = topic.split(WILDCARD_SINGLE_LEVEL)
-        if len(parts) == 1:
-            if len(topic) != 0:
-                candidates = candidates.filter(name__startswith=topic)
-        elif topic == WILDCARD_SINGLE_LEVEL:
-            candidates = candidates.exclude(name__contains=TOPIC_SEP)
+        levels = self.get_levels()
+        if levels[-1] == WILDCARD_MULTI_LEVEL:
+            candidates = candidates.filter(depth__gte=len(levels))
+            levels = levels[:-1]
         else:
-            if multi:
-                # ini = candidates.filter(name__startswith=parts[0])
-                # con = candidates.filter(name__contains=parts[-1])
-                # TODO
-                candidates = candidates.filter(name__startswith=parts[0], name__contains=parts[-1])
+            candidates = candidates.filter(depth=len(levels))
+        for position, level in enumerate(levels):
+            if level == WILDCARD_SINGLE_LEVEL:
+                continue
+            if position == 0:
+                candidates = candidates.filter(first_level_hash=topic_digest(level))
             else:
-                candidates = candidates.filter(name__startswith=parts[0], name__endswith=parts[-1])
-            for part in set(parts[1:-1]):
-                candidates = candidates.filter(name__contains=part)
+                candidates = candidates.filter(levels__position=position, levels__name_hash=topic_digest(level))
         return candidates
 
     def __iter__(self):
@@ -190,8 +239,7 @@ class Topic(SecureSave):
             yield self
         else:
             for candidate in self.get_candidates().all():
-                if candidate in self:
-                    yield candidate
+                yield candidate
 
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
@@ -199,8 +247,76 @@ class Topic(SecureSave):
             self.wildcard = self.is_wildcard()
         if not update_fields or 'dollar' in update_fields:
             self.dollar = self.is_dollar()
-        return super(Topic, self).save(force_insert=force_insert, force_update=force_update,
-                                       using=using, update_fields=update_fields)
+        update_levels = not update_fields or 'name' in update_fields
+        if update_levels:
+            self.update_name_fields()
+            if update_fields:
+                update_fields = set(update_fields) | {'name_hash', 'depth', 'first_level_hash', 'specificity'}
+        with transaction.atomic(using=using):
+            saved = super(Topic, self).save(force_insert=force_insert, force_update=force_update,
+                                            using=using, update_fields=update_fields)
+            if update_levels:
+                self.update_levels(using=using)
+        return saved
+
+    def update_name_fields(self):
+        """
+        Derive from the name the fields that are not editable, the TopicLevel rows are saved by update_levels
+        """
+        self.name_hash = topic_digest(self.name)
+        levels = self.get_levels()
+        self.depth = len(levels)
+        self.first_level_hash = topic_digest(levels[0])
+        self.specificity = topic_specificity(self.name)
+
+    def update_levels(self, using=None):
+        TopicLevel.objects.using(using).filter(topic=self).delete()
+        TopicLevel.objects.using(using).bulk_create([
+            TopicLevel(topic=self, position=position, name=level, name_hash=topic_digest(level))
+            for position, level in enumerate(self.get_levels()) if position > 0
+        ])
+
+
+class TopicLevel(models.Model):
+    """
+    Materialised path of a topic, one row by level after the first one (stored in Topic.first_level_hash).
+    The levels are indexed by their digest, the names could be longer than the index key limit of some backends.
+    """
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE, related_name='levels')
+    position = models.PositiveSmallIntegerField()
+    name = models.CharField(max_length=1024, blank=True)
+    name_hash = models.CharField(max_length=64, editable=False)
+
+    class Meta:
+        unique_together = ('topic', 'position')
+        index_together = ('position', 'name_hash')
+
+    def __str__(self):
+        return "%s[%d]" % (self.topic, self.position)
+
+
+class ACLQuerySet(models.QuerySet):
+    def with_principals(self, user=None):
+        """
+        Annotate in the same query if each ACL has users and groups, and if user is one of them or of their groups.
+        ACL.is_public and ACL.has_permission(user) use them without more queries.
+
+        :type user: django.contrib.auth.models.User|None
+        :rtype: ACLQuerySet
+        """
+        acl_users = ACL.users.field
+        acl_groups = ACL.groups.field
+        users = acl_users.remote_field.through.objects.filter(**{acl_users.m2m_field_name(): OuterRef('pk')})
+        groups = acl_groups.remote_field.through.objects.filter(**{acl_groups.m2m_field_name(): OuterRef('pk')})
+        acls = self.annotate(has_users=Exists(users), has_groups=Exists(groups))
+        if user is not None and user.pk is not None:
+            acls = acls.annotate(
+                principal=models.Value(user.pk, output_field=user._meta.pk),
+                user_member=Exists(users.filter(**{acl_users.m2m_reverse_field_name(): user.pk})),
+                group_member=Exists(groups.filter(**{'%s__in' % acl_groups.m2m_reverse_field_name():
+                                                     user.groups.values('pk')})),
+            )
+        return acls
 
 
 class ACL(models.Model):
@@ -215,11 +331,15 @@ class ACL(models.Model):
     class Meta:
         unique_together = ('topic', 'acc')
 
+    objects = ACLQuerySet.as_manager()
+
     def __init__(self, *args, **kwargs):
         super(ACL, self).__init__(*args, **kwargs)
         # Stores the raw password if set_password() is called so that it can
         # be passed to password_changed() after the model is saved.
         self._password = None
+        # (user pks, group pks) when they are known, see get_broadcast
+        self.principal_pks = None
 
     def set_password(self, raw_password):
         self.password = make_password(raw_password)
@@ -229,13 +349,22 @@ class ACL(models.Model):
         """
         Return a boolean of whether the raw_password was correct. Handles
         hashing formats behind the scenes.
+        The successful checks are cached if MQTT_CREDENTIALS_CACHE_SIZE is set.
         """
-        def setter(raw_password):  # pragma: no cover
+        def setter(raw_password):
             self.set_password(raw_password)
             # Password hash upgrades shouldn't be considered password changes.
             self._password = None
             self.save(update_fields=["password"])
-        return check_password(raw_password, self.password, setter)
+        key = None
+        if credentials_cache.enabled and self.pk is not None and raw_password is not None:
+            key = get_credentials_key('acl', self.pk, raw_password)
+            if is_verified(get_verified(key), self.pk, self.password):
+                return True
+        valid = check_password(raw_password, self.password, setter)
+        if valid and key is not None:
+            set_verified(key, self.pk, self.password)
+        return valid
 
     def set_unusable_password(self):
         # Set a value that will never be a valid hash
@@ -245,10 +374,11 @@ class ACL(models.Model):
         return is_password_usable(self.password)
 
     @classmethod
-    def get_default(cls, acc, user=None, password=None):  # TODO rename
+    def get_default(cls, acc, user=None, password=None, broadcast=NOT_CACHED):  # TODO rename
         """
             :type user: django.contrib.auth.models.User
             :param user:
+            :param broadcast: broadcast ACL already known, see get_applicable
             :return: bool
         """
         allow = False
@@ -259,17 +389,38 @@ class ACL(models.Model):
                 allow = settings.MQTT_ACL_ALLOW_ANONIMOUS & allow
                 if not allow and not password:
                     return allow
-        try:
-            broadcast_topic = Topic.objects.get(name=WILDCARD_MULTI_LEVEL)
-            broadcast = cls.objects.filter(topic=broadcast_topic)
-            if acc in dict(PROTO_MQTT_ACC).keys():
-                if broadcast.filter(acc=acc).exists():
-                    broadcast_acl = broadcast.get(acc=acc)
-                    allow = broadcast_acl.has_permission(user=user, password=password)
-        except Topic.DoesNotExist:
-            pass
+        if acc in dict(PROTO_MQTT_ACC).keys():
+            broadcast_acl = broadcast
+            if broadcast_acl is NOT_CACHED:
+                broadcast_acl = cls.get_broadcast(acc, user=user)
+            if broadcast_acl is not None:
+                allow = broadcast_acl.has_permission(user=user, password=password)
         return allow
 
+    @classmethod
+    def get_broadcast(cls, acc, user=None):
+        """
+        :param acc:
+        :param user: annotate the principals of this user if the ACL is not cached
+        :return: The ACL of the broadcast topic (#) for acc. It is cached with the pk of its principals while
+        MQTT_ACL_CACHE_SIZE is set, until any ACL data changes or MQTT_ACL_CACHE_TIMEOUT, the changes of other
+        processes are seen when PolicyVersion is checked.
+        :rtype: ACL|None
+        """
+        broadcast = cls.objects.filter(topic__in=Topic.objects.named(WILDCARD_MULTI_LEVEL), acc=acc)
+        if not broadcast_cache.enabled:
+            return broadcast.with_principals(user).first()
+        from django_mqtt.policy import get_policy_version
+        get_policy_version()
+        acl = broadcast_cache.get(acc, NOT_CACHED)
+        if acl is NOT_CACHED:
+            acl = broadcast.first()
+            if acl is not None:
+                acl.principal_pks = (frozenset(acl.users.values_list('pk', flat=True)),
+                                     frozenset(acl.groups.values_list('pk', flat=True)))
+            broadcast_cache.set(acc, acl)
+        return acl
+
     def __gt__(self, other):
         if isinstance(other, ACL):
             return self.topic > other.topic
@@ -279,26 +430,127 @@ class ACL(models.Model):
             return self.topic < other.topic
 
     @classmethod
-    def get_acl(cls, topic, acc=PROTO_MQTT_ACC_PUB):
+    def get_wildcard_index(cls, acc=PROTO_MQTT_ACC_PUB):
+        """
+        :return: index of the wildcard ACLs pk by topic filter. It is kept by process until any ACL data but the users
+        changes in this process, or in other process once PolicyVersion is checked every MQTT_ACL_POLICY_POLL seconds.
+        :rtype: django_mqtt.protocol.TopicTrie
+        """
+        if wildcard_index_cache.enabled:
+            from django_mqtt.policy import get_policy_version
+            get_policy_version()
+        index = wildcard_index_cache.get(acc)
+        if index is not None:
+            return index
+        index = TopicTrie()
+        for pk, name in cls.objects.filter(topic__wildcard=True, acc=acc).values_list('pk', 'topic__name'):
+            index.add(name, pk)
+        wildcard_index_cache.set(acc, index)
+        return index
+
+    @classmethod
+    def get_wildcard_candidates(cls, topic, acc=PROTO_MQTT_ACC_PUB, user=None):
+        """
+        :param topic: topic name
+        :type topic: str|bytes
+        :param user: annotate the principals of this user, see ACLQuerySet.with_principals
+        :return: the wildcard ACLs whose topic contains the topic name
+        :rtype: django.db.models.QuerySet
+        """
+        acls = cls.objects.with_principals(user)
+        return acls.filter(pk__in=cls.get_wildcard_index(acc).match(topic)).select_related('topic')
+
+    @classmethod
+    def get_applicable(cls, topic, acc=PROTO_MQTT_ACC_PUB, user=None):
+        """
+        Same as get_acl and get_broadcast in only one query, the wildcard ACLs are matched by get_wildcard_index and
+        only the matching ones are read with the exact and broadcast ACLs.
+
+        :param topic: topic name
+        :type topic: str|bytes
+        :param acc:
+        :param user: annotate the principals of this user, see ACLQuerySet.with_principals
+        :return: (exact or most specific wildcard ACL for topic, broadcast ACL)
+        :rtype: (ACL|None, ACL|None)
+        """
+        if isinstance(topic, bytes):
+            topic = topic.decode()
+        matched = set(cls.get_wildcard_index(acc).match(topic))
+        topics = Topic.objects.named(topic) | Topic.objects.named(WILDCARD_MULTI_LEVEL)
+        acls = cls.objects.with_principals(user).filter(acc=acc).filter(
+            Q(topic__in=topics) | Q(pk__in=matched)).select_related('topic')
+        exact = best = broadcast = None
+        for acl in acls:
+            if acl.topic.name == topic:
+                exact = acl
+            elif acl.pk in matched:
+                if best is None or (acl.topic.specificity, acl.pk) < (best.topic.specificity, best.pk):
+                    best = acl
+            if acl.topic.name == WILDCARD_MULTI_LEVEL:
+                broadcast = acl
+        return exact or best, broadcast
+
+    @classmethod
+    def get_acl(cls, topic, acc=PROTO_MQTT_ACC_PUB, create=False, user=None):
+        """
+        :param topic: topic or topic name, an unknown name is matched against the rules without saving it
+        :type topic: django_mqtt.models.Topic|str|bytes
+        :param acc:
+        :type acc: int
+        :param create: save the topic name as a new Topic if it does not exist
+        :type create: bool
+        :param user: annotate the principals of this user, see ACLQuerySet.with_principals
+        :type user: django.contrib.auth.models.User|None
+        :return: The exact ACL for the topic or the most specific wildcard ACL that contains it, the oldest one (lowest
+        pk) if several are equally specific
+        :rtype: ACL|None
+        """
+        acls = cls.objects.with_principals(user)
+        if isinstance(topic, bytes):
+            topic = topic.decode()
         if isinstance(topic, str):
-            topic, is_new = Topic.objects.get_or_create(name=topic)
-        elif isinstance(topic, bytes):
-            topic = Topic.objects.get_or_create(name=topic.decode())
-        elif not isinstance(topic, Topic):
+            if create:
+                topic, is_new = Topic.objects.get_or_create_named(topic)
+                acls = acls.filter(topic=topic, acc=acc)
+            else:
+                acls = acls.filter(topic__in=Topic.objects.named(topic), acc=acc)
+        elif isinstance(topic, Topic):
+            acls = acls.filter(topic=topic, acc=acc)
+        else:
             raise ValueError('topic must be Topic, String or Bytes')
-        candidates = []
-        try:
-            candidates = [ACL.objects.get(topic=topic, acc=acc)]
-        except ACL.DoesNotExist:
-            for candidate in cls.objects.filter(topic__wildcard=True, acc=acc):
-                if topic in candidate.topic:
-                    candidates.append(candidate)
-        if len(candidates) == 0:
-            return None
-        return min(candidates)
+        acl = acls.select_related('topic').first()
+        if acl is None:
+            candidates = cls.get_wildcard_candidates(str(topic), acc, user=user)
+            acl = candidates.order_by('topic__specificity', 'pk').first()
+        return acl
+
+    @classmethod
+    async def aget_acl(cls, topic, acc=PROTO_MQTT_ACC_PUB, create=False, user=None):
+        """
+        Async version of get_acl, it runs in the thread of the database connection because the ORM of this Django
+        version is sync only.
+        """
+        from asgiref.sync import sync_to_async
+        return await sync_to_async(cls.get_acl, thread_sensitive=True)(topic, acc, create=create, user=user)
 
     def is_public(self):
-        return self.users.count() == 0 and self.groups.count() == 0 and not self.password
+        if self.principal_pks is not None:
+            return not self.principal_pks[0] and not self.principal_pks[1] and not self.password
+        if hasattr(self, 'has_users'):
+            return not self.has_users and not self.has_groups and not self.password
+        return not self.users.exists() and not self.groups.exists() and not self.password
+
+    def is_principal(self, user):
+        """
+        :return: If user is one of the users of the ACL or of their groups
+        """
+        if self.principal_pks is not None:
+            users, groups = self.principal_pks
+            return user.pk in users or (bool(groups) and user.groups.filter(pk__in=groups).exists())
+        if user.pk is not None and getattr(self, 'principal', None) == user.pk:
+            return self.user_member or self.group_member
+        return self.users.filter(pk=user.pk).exists() or \
+            self.groups.filter(pk__in=user.groups.values_list('pk')).exists()
 
     def has_permission(self, user=None, password=None):
         allow = False
@@ -306,9 +558,7 @@ class ACL(models.Model):
             allow = self.allow
         else:
             if user:
-                if user in self.users.all():
-                    allow = self.allow
-                elif self.groups.filter(pk__in=user.groups.values_list('pk')).exists():
+                if self.is_principal(user):
                     allow = self.allow
                 else:
                     allow = not self.allow
@@ -318,3 +568,98 @@ class ACL(models.Model):
 
     def __str__(self):
         return "ACL %s for %s" % (dict(PROTO_MQTT_ACC)[self.acc], self.topic)
+
+
+class PolicyVersion(models.Model):
+    """
+    Counter increased on any change of the data used to resolve the ACLs, shared by all the processes
+    """
+    version = models.BigIntegerField(default=0)
+
+    @classmethod
+    def get_version(cls):
+        return cls.objects.filter(pk=1).values_list('version', flat=True).first() or 0
+
+    @classmethod
+    def increase(cls):
+        if not cls.objects.filter(pk=1).update(version=F('version') + 1):
+            cls.objects.get_or_create(pk=1, defaults={'version': 1})
+
+
+CHANGE_ALL = 'all'
+CHANGE_ACL = 'acl'
+CHANGE_TOPIC = 'topic'
+CHANGE_CLIENTID = 'clientid'
+CHANGE_USER = 'user'
+CHANGE_GROUP = 'group'
+CHANGE_MODELS = (
+    (CHANGE_ALL, _('All')),
+    (CHANGE_ACL, _('ACL')),
+    (CHANGE_TOPIC, _('Topic')),
+    (CHANGE_CLIENTID, _('Client ID')),
+    (CHANGE_USER, _('User')),
+    (CHANGE_GROUP, _('Group')),
+)
+
+
+class ACLChange(models.Model):
+    """
+    Log of the objects changed that are used to resolve the ACLs, ordered by the monotonically increasing seq.
+    The CHANGE_ALL entries have not object_id, any data could be changed.
+    """
+    seq = models.BigAutoField(primary_key=True)
+    model = models.CharField(max_length=10, choices=CHANGE_MODELS)
+    object_id = models.BigIntegerField(blank=True, null=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        index_together = (('model', 'object_id'),)
+
+    @classmethod
+    def log(cls, model, object_ids=None):
+        """
+        :param model: One of CHANGE_MODELS
+        :param object_ids: pk of the changed objects, None for CHANGE_ALL
+        """
+        if object_ids is None:
+            cls.objects.create(model=CHANGE_ALL)
+        else:
+            cls.objects.bulk_create([cls(model=model, object_id=object_id) for object_id in object_ids])
+
+    @classmethod
+    def get_last_seq(cls):
+        return cls.objects.order_by('-seq').values_list('seq', flat=True).first() or 0
+
+    @classmethod
+    def get_since(cls, seq, limit=None):
+        """
+        :param seq: Last seq seen
+        :param limit: Max number of entries
+        :return: (seq, model, object_id) of the entries after seq, None if there are more than limit or any seq is
+        missing, it could be a change not committed yet
+        """
+        changes = cls.objects.filter(seq__gt=seq).order_by('seq').values_list('seq', 'model', 'object_id')
+        if limit is not None:
+            changes = changes[:limit + 1]
+        changes = list(changes)
+        if limit is not None and len(changes) > limit or changes and changes[-1][0] - seq != len(changes):
+            return None
+        return changes
+
+    @classmethod
+    def compact(cls):
+        """
+        Delete the entries of the objects changed again later, and everything before the last CHANGE_ALL.
+        The remaining entries still bring any process up to date.
+        :return: Number of deleted entries
+        """
+        last_all = cls.objects.filter(model=CHANGE_ALL).order_by('-seq').values_list('seq', flat=True).first()
+        deleted = 0
+        if last_all is not None:
+            deleted += cls.objects.filter(seq__lt=last_all).delete()[0]
+        newer = cls.objects.filter(model=OuterRef('model'), object_id=OuterRef('object_id'), seq__gt=OuterRef('seq'))
+        deleted += cls.objects.annotate(newer=Exists(newer)).filter(newer=True).delete()[0]
+        return deleted
+
+    def __str__(self):
+        return '#%s %s %s' % (self.seq, self.model, self.object_id or '')
@@ -0,0 +1,103 @@
+"""
+Minimal WSGI and ASGI applications for the mosquitto-auth-plug endpoints, without the urls and middlewares of the
+project. The broker could target them directly, e.g. with gunicorn:
+
+    # mqtt_auth.py
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'project.settings')
+    from django_mqtt.mosquitto.auth_plugin.app import get_wsgi_application
+    application = get_wsgi_application()
+
+    gunicorn mqtt_auth:application
+"""
+from urllib.parse import parse_qsl
+
+import django
+from asgiref.sync import sync_to_async
+from django.core import signals
+
+from django_mqtt.metrics import measure
+from django_mqtt.mosquitto.auth_plugin.auth import acl_allowed, auth_allowed, superuser_allowed
+
+# Decision function by the last segment of the path
+ENDPOINTS = {
+    'auth': auth_allowed,
+    'superuser': superuser_allowed,
+    'acl': acl_allowed,
+}
+STATUS_REASONS = {
+    200: '200 OK',
+    403: '403 Forbidden',
+    404: '404 Not Found',
+    405: '405 Method Not Allowed',
+}
+
+
+def parse_form(body):
+    """
+    :param body: application/x-www-form-urlencoded body
+    :type body: bytes
+    :return: posted fields, the last value is kept as QueryDict.get does
+    :rtype: dict
+    """
+    return dict(parse_qsl(body.decode('utf-8', 'replace'), keep_blank_values=True))
+
+
+class AuthPluginHandler(object):
+    def get_status(self, method, path, body):
+        """
+        :param method: HTTP method
+        :param path: request path, only its last segment is used so the app could be mounted on any prefix
+        :param body: form body
+        :return: HTTP status code
+        :rtype: int
+        """
+        endpoint = path.rstrip('/').rsplit('/', 1)[-1]
+        decision = ENDPOINTS.get(endpoint)
+        if decision is None:
+            return 404
+        if method != 'POST':
+            return 405
+        signals.request_started.send(sender=self.__class__)
+        try:
+            return 200 if measure(endpoint, decision, parse_form(body)) else 403
+        finally:
+            signals.request_finished.send(sender=self.__class__)
+
+
+class AuthPluginWSGIHandler(AuthPluginHandler):
+    def __call__(self, environ, start_response):
+        try:
+            length = int(environ.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        body = environ['wsgi.input'].read(length) if length > 0 else b''
+        status = self.get_status(environ['REQUEST_METHOD'], environ.get('PATH_INFO', ''), body)
+        start_response(STATUS_REASONS[status], [('Content-Length', '0')])
+        return [b'']
+
+
+class AuthPluginASGIHandler(AuthPluginHandler):
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            raise ValueError('Django can only handle ASGI/HTTP connections, not %s.' % scope['type'])
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+        status = await sync_to_async(self.get_status, thread_sensitive=True)(scope['method'], scope['path'], body)
+        await send({'type': 'http.response.start', 'status': status, 'headers': [(b'content-length', b'0')]})
+        await send({'type': 'http.response.body', 'body': b''})
+
+
+def get_wsgi_application():
+    django.setup(set_prefix=False)
+    return AuthPluginWSGIHandler()
+
+
+def get_asgi_application():
+    django.setup(set_prefix=False)
+    return AuthPluginASGIHandler()
@@ -1,21 +1,166 @@
+import threading
+import time
 
-from django_mqtt.models import ACL, PROTO_MQTT_ACC
 from django.conf import settings
+from django.contrib import auth
+from django.contrib.auth import get_user_model
+
+from django_mqtt.bloom import known_clientids, known_topics, known_usernames
+from django_mqtt.cache import NOT_CACHED, LRUCache, SingleFlight
+from django_mqtt.credentials import credentials_cache, get_credentials_key, get_verified, is_verified, set_verified
+from django_mqtt.metrics import count_default
+from django_mqtt.models import ACL, PROTO_MQTT_ACC, ClientId, PolicyVersion, Topic
+from django_mqtt.policy import (
+    Policy,
+    get_policy,
+    get_policy_version,
+    get_user_policy
+)
+
+acl_cache = LRUCache('MQTT_ACL_CACHE_SIZE', 'MQTT_ACL_CACHE_TIMEOUT', name='acl', user_key=lambda key: key[0])
+# Concurrent resolutions of the same decision if MQTT_ACL_SINGLE_FLIGHT is set
+acl_flight = SingleFlight('acl')
+
+
+_superusers = None
+_superusers_version = None
+_superusers_checked = 0
+_superusers_generation = 0
+_superusers_lock = threading.Lock()
+
+
+def get_superusers():
+    """
+    :return: usernames of the active superusers, kept by process. The set is rebuilt after any user is saved or deleted
+    in this process, or when PolicyVersion changes, checked at most every MQTT_ACL_POLICY_POLL seconds.
+    :rtype: frozenset
+    """
+    global _superusers, _superusers_version, _superusers_checked
+    superusers = _superusers
+    now = time.monotonic()
+    if superusers is not None and now - _superusers_checked < getattr(settings, 'MQTT_ACL_POLICY_POLL', 1):
+        return superusers
+    with _superusers_lock:
+        generation = _superusers_generation
+        version = PolicyVersion.get_version()
+        if superusers is None or version != _superusers_version:
+            user_model = get_user_model()
+            users = user_model.objects.filter(is_active=True, is_superuser=True)
+            superusers = frozenset(users.values_list('username', flat=True))
+        if generation == _superusers_generation:
+            _superusers, _superusers_version, _superusers_checked = superusers, version, now
+    return superusers
+
+
+def invalidate_superusers(sender, **kwargs):
+    global _superusers, _superusers_generation
+    _superusers = None
+    _superusers_generation += 1
+
+
+def authenticate(username=None, password=None):
+    """
+    Same as django.contrib.auth.authenticate, the successful ones are cached if MQTT_CREDENTIALS_CACHE_SIZE is set.
+    The cached credentials are verified again if the user password changes or the user is not active.
+
+    :rtype: django.contrib.auth.models.User|None
+    """
+    if username is not None and not known_usernames.may_exist(username):
+        return None
+    if not credentials_cache.enabled or username is None or password is None:
+        return auth.authenticate(username=username, password=password)
+    key = get_credentials_key('user', username, password)
+    verified = get_verified(key)
+    if verified is not None:
+        user = get_user_model().objects.filter(pk=verified[0], is_active=True).first()
+        if user is not None and user.get_username() == username and is_verified(verified, user.pk, user.password):
+            return user
+        credentials_cache.delete(key)
+    user = auth.authenticate(username=username, password=password)
+    if user is not None:
+        set_verified(key, user.pk, user.password)
+    return user
 
 
 def has_permission(user, topic, acc=None, clientid=None):
     """
     :param user: Active user
     :type user: django.contrib.auth.models.User
-    :param topic:
-    :type topic: str
+    :param topic: topic name, the wildcard ACLs that contains it are used if there is not an exact one
+    :type topic: str|bytes|django_mqtt.models.Topic
     :param acc:
     :type acc: int
     :param clientid:
-    :type clientid: django_mqtt.models.ClientId
-    :return: If user have permission to access to topic
+    :type clientid: django_mqtt.models.ClientId|str
+    :return: If user have permission to access to topic, the concurrent resolutions of the same decision are coalesced
+    if MQTT_ACL_SINGLE_FLIGHT is set. The decisions cached are cleared when PolicyVersion changes.
     :rtype: bool
     """
+    policy = get_policy()
+    if policy is not None:
+        if user is not None and not user.is_anonymous:
+            user = policy.get_user(user.get_username())
+        else:
+            user = None
+        return policy.is_clientid_allowed(user, clientid) and policy.has_permission(user, topic, acc=acc)
+
+    if user is not None and not user.is_anonymous and user.is_active:
+        cached = get_user_policy(user)
+        if cached is not None:
+            policy, policy_user = cached
+            return policy.is_clientid_allowed(policy_user, clientid) and \
+                policy.has_permission(policy_user, topic, acc=acc)
+
+    single_flight = getattr(settings, 'MQTT_ACL_SINGLE_FLIGHT', False)
+    if not acl_cache.enabled and not single_flight:
+        return resolve_permission(user, topic, acc=acc, clientid=clientid)
+
+    if acl_cache.enabled:
+        get_policy_version()
+    key = get_decision_key(user, topic, acc, clientid)
+    allow = acl_cache.get(key, NOT_CACHED)
+    if allow is NOT_CACHED:
+        if single_flight:
+            allow = acl_flight.do(key, resolve_permission, user, topic, acc=acc, clientid=clientid)
+        else:
+            allow = resolve_permission(user, topic, acc=acc, clientid=clientid)
+        acl_cache.set(key, allow)
+    return allow
+
+
+def get_decision_key(user, topic, acc, clientid):
+    """
+    :return: key of the decision in acl_cache
+    """
+    if isinstance(topic, Topic):
+        topic = topic.name
+    elif isinstance(topic, bytes):
+        topic = topic.decode()
+    return user.pk if user else None, topic, acc, clientid.name if isinstance(clientid, ClientId) else clientid
+
+
+def is_clientid_allowed(user, clientid):
+    """
+    :param user: User or PolicyUser
+    :param clientid: client id or its name, any user could use the unknown and public ones
+    :type clientid: django_mqtt.models.ClientId|str|None
+    :return: If user could use clientid, see ClientId.get_principals and Policy.is_clientid_allowed for the snapshots
+    :rtype: bool
+    """
+    if isinstance(clientid, ClientId):
+        clientid = clientid.name
+    elif not known_clientids.may_exist(clientid):
+        return True
+    principals = ClientId.get_principals(clientid)
+    return principals is None or (user is not None and user.pk in principals)
+
+
+def resolve_permission(user, topic, acc=None, clientid=None):
+    """
+    Same as has_permission without use the decisions cache
+    """
+    if not is_clientid_allowed(user, clientid):
+        return False
 
     allow = False
     if hasattr(settings, 'MQTT_ACL_ALLOW'):
@@ -29,16 +174,139 @@ def has_permission(user, topic, acc=None, clientid=None):
     if user and not user.is_active:
         return allow
 
-    acls = ACL.objects.filter(topic__name=topic)
     if acc not in dict(PROTO_MQTT_ACC).keys():
         acc = None
 
-    if acc and acls.filter(acc=acc).exists():
-        acl = acls.filter(acc=acc).get()
+    if isinstance(topic, Topic):
+        topic = topic.name
+    acl = None
+    broadcast = NOT_CACHED
+    if acc and topic:
+        acl, broadcast = ACL.get_applicable(topic, acc, user=user)
+
+    if acl:
         allow = acl.has_permission(user=user)
     else:
-        allow = ACL.get_default(acc, user=user)
-
-        # TODO search best candidate
+        count_default()
+        allow = ACL.get_default(acc, user=user, broadcast=broadcast)
 
     return allow
+
+
+def get_active_user(username):
+    """
+    :return: The last active user with username, like the mosquitto-auth-plug checks expect
+    :rtype: django.contrib.auth.models.User|None
+    """
+    if username is None or not known_usernames.may_exist(username):
+        return None
+    user_model = get_user_model()
+    user = user_model.objects.filter(**{user_model.USERNAME_FIELD: username, 'is_active': True}).order_by('-pk').first()
+    if user is None:
+        known_usernames.missed(username)
+    return user
+
+
+def has_permission_many(checks):
+    """
+    Same as has_permission for many checks, with a constant number of queries
+
+    :param checks: (username, topic name, acc, client id name), the unknown or inactive users are anonymous like in the
+    Acl view
+    :type checks: list[(str, str, int, str)]
+    :return: If each user have permission to access to topic with the client id
+    :rtype: list[bool]
+    """
+    checks = [(username, topic.decode() if isinstance(topic, bytes) else topic, acc, clientid)
+              for username, topic, acc, clientid in checks]
+    if not checks:
+        return []
+    policy = get_policy()
+    if policy is None:
+        policy = Policy.build_partial({username for username, topic, acc, clientid in checks if username is not None},
+                                      {topic for username, topic, acc, clientid in checks if topic},
+                                      {clientid for username, topic, acc, clientid in checks if clientid is not None})
+    decisions = []
+    for username, topic, acc, clientid in checks:
+        user = policy.get_user(username, active=True)
+        decisions.append(policy.is_clientid_allowed(user, clientid) and policy.has_permission(user, topic, acc=acc))
+    return decisions
+
+
+def get_acc(data):
+    """
+    :return: The acc field of the posted data as int, None if it is not valid
+    """
+    acc = data.get('acc', None)
+    if isinstance(acc, bool):
+        return None
+    try:
+        return int(acc)
+    except (TypeError, ValueError):
+        return None
+
+
+def auth_allowed(data):
+    """ Decision of the auth endpoint
+    Access if exist ACL with:
+        - ACC, TOPIC and PASSWORD not matter the user
+        - USERNAME and PASSWORD for an existing active user and with topic and acc
+
+    :param data: posted fields
+    :type data: dict|django.http.QueryDict
+    :rtype: bool
+    """
+    acc = get_acc(data)
+    if acc in dict(PROTO_MQTT_ACC).keys() and known_topics.may_exist(data.get('topic')):
+        topics = Topic.objects.named(data.get('topic'))
+        if topics.exists():
+            topic = topics.get()
+            acls = ACL.objects.filter(acc=acc, topic=topic, password__isnull=False, password=data.get('password'))
+            if acls.exists():
+                return True
+        else:
+            known_topics.missed(data.get('topic'))
+    user = authenticate(username=data.get('username'), password=data.get('password'))
+    return has_permission(user, data.get('topic', '#'), acc)
+
+
+def superuser_allowed(data):
+    """ Decision of the superuser endpoint, if the user exist, is active and is superuser
+    It is answered without queries by the policy snapshot if MQTT_ACL_POLICY is set, or by get_superusers if
+    MQTT_SUPERUSER_CACHE is set.
+
+    :param data: posted fields
+    :type data: dict|django.http.QueryDict
+    :rtype: bool
+    """
+    policy = get_policy()
+    if policy is not None:
+        user = policy.get_user(data.get('username'), active=True)
+        return user is not None and user.is_superuser
+    if getattr(settings, 'MQTT_SUPERUSER_CACHE', False):
+        return data.get('username') in get_superusers()
+    if not known_usernames.may_exist(data.get('username')):
+        return False
+    user_model = get_user_model()
+    try:
+        user = user_model.objects.get(username=data.get('username'), is_active=True)
+    except user_model.DoesNotExist:
+        return False
+    return user.is_superuser
+
+
+def acl_allowed(data):
+    """ Decision of the acl endpoint, see has_permission
+
+    :param data: posted fields
+    :type data: dict|django.http.QueryDict
+    :rtype: bool
+    """
+    acc = get_acc(data)
+    policy = get_policy()
+    if policy is not None:
+        user = policy.get_user(data.get('username'), active=True)
+        return policy.is_clientid_allowed(user, data.get('clientid')) and \
+            policy.has_permission(user, data.get('topic', '#'), acc=acc)
+    user = get_active_user(data.get('username'))
+    return has_permission(user, data.get('topic', '#'), acc=acc, clientid=data.get('clientid'))
@@ -0,0 +1,70 @@
+from io import BytesIO
+from itertools import product
+from urllib.parse import urlencode
+
+from asgiref.sync import async_to_sync
+from django.core import signals
+from django.db import close_old_connections
+from django.test import Client
+from django.urls import reverse
+
+from django_mqtt.models import PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS
+from django_mqtt.mosquitto.auth_plugin.app import AuthPluginASGIHandler, AuthPluginWSGIHandler
+from django_mqtt.test import test_policy
+
+
+class AuthPluginAppTestCase(test_policy.BasePolicyTestCase):
+    def setUp(self):
+        super(AuthPluginAppTestCase, self).setUp()
+        self.admin.set_password('admin')
+        self.admin.save()
+        self.client = Client()
+        # Same as django.test.Client, the test transaction must not be closed by the app
+        signals.request_started.disconnect(close_old_connections)
+        self.addCleanup(signals.request_started.connect, close_old_connections)
+
+    def get_posts(self):
+        posts = [('mqtt_superuser', {'username': username}) for username in ['user', 'admin', 'inactive', 'unknown']]
+        posts += [('mqtt_auth', {'username': 'admin', 'password': password, 'topic': '$SYS/one',
+                                 'acc': PROTO_MQTT_ACC_SUS}) for password in ['admin', 'wrong']]
+        for username, topic, acc in product(['user', 'member', 'admin'], self.TOPICS[:-1],
+                                            [PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS, 'wrong']):
+            posts.append(('mqtt_acl', {'username': username, 'topic': topic, 'acc': acc}))
+        return posts
+
+    def wsgi_status(self, method, path, data):
+        body = urlencode(data).encode()
+        statuses = []
+        environ = {'REQUEST_METHOD': method, 'PATH_INFO': path, 'CONTENT_LENGTH': str(len(body)),
+                   'wsgi.input': BytesIO(body)}
+        AuthPluginWSGIHandler()(environ, lambda status, headers: statuses.append(status))
+        return int(statuses[0].split()[0])
+
+    def asgi_status(self, method, path, data):
+        messages = [{'type': 'http.request', 'body': urlencode(data).encode(), 'more_body': False}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        async_to_sync(AuthPluginASGIHandler())({'type': 'http', 'method': method, 'path': path}, receive, send)
+        return sent[0]['status']
+
+    def test_same_status(self):
+        for name, data in self.get_posts():
+            path = reverse('django_mqtt:%s' % name)
+            status = self.client.post(path, data).status_code
+            self.assertEqual(self.wsgi_status('POST', path, data), status, (name, data))
+            self.assertEqual(self.asgi_status('POST', path, data), status, (name, data))
+
+    def test_errors(self):
+        self.assertEqual(self.wsgi_status('GET', '/mqtt/acl', {}), 405)
+        self.assertEqual(self.wsgi_status('POST', '/mqtt/unknown', {}), 404)
+        data = {'username': 'user', 'topic': '/test', 'acc': PROTO_MQTT_ACC_PUB}
+        self.assertEqual(self.wsgi_status('POST', '/acl/', data), 200)
+        self.assertEqual(self.asgi_status('PUT', '/superuser', {}), 405)
+        with self.assertRaises(ValueError):
+            async_to_sync(AuthPluginASGIHandler())({'type': 'websocket'}, None, None)
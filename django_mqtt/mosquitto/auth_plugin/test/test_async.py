@@ -0,0 +1,56 @@
+from itertools import product
+
+from asgiref.sync import async_to_sync
+from django.urls import resolve, reverse
+
+from django_mqtt.models import ACL, PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS
+from django_mqtt.mosquitto.auth_plugin.test import test_acl, test_auth, test_bypass, test_super, test_wildcards
+from django_mqtt.test import test_policy
+
+
+class AsyncURLMixin(object):
+    """ Run the tests of the sync views against their async version """
+    def setUp(self):
+        super(AsyncURLMixin, self).setUp()
+        self.url_testing = reverse('django_mqtt:%s_async' % resolve(self.url_testing).url_name)
+
+
+class AsyncACLTestCase(AsyncURLMixin, test_acl.ACLTestCase):
+    pass
+
+
+class AsyncACLPubAcc(AsyncURLMixin, test_acl.PubAcc):
+    pass
+
+
+class AsyncACLSusAcc(AsyncURLMixin, test_acl.SusAcc):
+    pass
+
+
+class AsyncAuthPubAcc(AsyncURLMixin, test_auth.PubAcc):
+    pass
+
+
+class AsyncAuthSusAcc(AsyncURLMixin, test_auth.SusAcc):
+    pass
+
+
+class AsyncBypassPubAcc(AsyncURLMixin, test_bypass.PubAcc):
+    pass
+
+
+class AsyncAdminTestCase(AsyncURLMixin, test_super.AdminTestCase):
+    pass
+
+
+class AsyncWildcardACLTestCase(AsyncURLMixin, test_wildcards.WildcardACLTestCase):
+    pass
+
+
+class AsyncPermissionTestCase(test_policy.BasePolicyTestCase):
+    def test_aget_acl(self):
+        for topic, acc in product(self.TOPICS[:-1], [PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS]):
+            self.assertEqual(async_to_sync(ACL.aget_acl)(topic, acc), ACL.get_acl(topic, acc))
+
+    def test_method_not_allowed(self):
+        self.assertEqual(self.client.get(reverse('django_mqtt:mqtt_acl_async')).status_code, 405)
@@ -0,0 +1,105 @@
+import json
+from itertools import product
+
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from django_mqtt.models import PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS, ClientId, Topic
+from django_mqtt.mosquitto.auth_plugin.auth import has_permission_many, resolve_permission
+from django_mqtt.test import test_policy
+
+
+class AclBatchTestCase(test_policy.BasePolicyTestCase):
+    USERNAMES = [None, 'user', 'member', 'inactive', 'admin', 'unknown']
+    CLIENTIDS = [None, 'public', 'bound', 'group', 'unknown']
+
+    def setUp(self):
+        super(AclBatchTestCase, self).setUp()
+        self.url_testing = reverse('django_mqtt:mqtt_acl_batch')
+        self.client = Client()
+        ClientId.objects.create(name='public')
+        ClientId.objects.create(name='bound').users.add(self.user)
+        ClientId.objects.create(name='group').groups.add(self.group)
+
+    def post(self, data):
+        return self.client.post(self.url_testing, json.dumps(data), content_type='application/json')
+
+    def get_checks(self):
+        return list(product(self.USERNAMES, self.TOPICS, [PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS, None],
+                            self.CLIENTIDS))
+
+    def resolve(self, username, topic, acc, clientid=None):
+        users = [user for user in [self.user, self.member, self.admin] if user.username == username]
+        return resolve_permission(users[0] if users else None, topic, acc, clientid=clientid)
+
+    def test_same_decisions(self):
+        for allow, anonymous in [(False, False), (True, False), (True, True)]:
+            with self.settings(MQTT_ACL_ALLOW=allow, MQTT_ACL_ALLOW_ANONIMOUS=anonymous):
+                checks = self.get_checks()
+                self.assertEqual(has_permission_many(checks), [self.resolve(*check) for check in checks])
+
+    def test_constant_queries(self):
+        with CaptureQueriesContext(connection) as single:
+            has_permission_many([('user', '/test', PROTO_MQTT_ACC_PUB, 'bound')])
+        for index in range(20):
+            Topic.objects.create(name='/test/%d' % index)
+            ClientId.objects.create(name='bound%d' % index).users.add(self.member)
+        checks = [(username, '/test/%d' % index, PROTO_MQTT_ACC_PUB, 'bound%d' % index)
+                  for username, index in product(self.USERNAMES, range(20))]
+        with self.assertNumQueries(len(single)):
+            has_permission_many(checks)
+
+    @override_settings(MQTT_ACL_POLICY=True, MQTT_ACL_POLICY_POLL=3600)
+    def test_policy(self):
+        checks = self.get_checks()
+        decisions = has_permission_many(checks)
+        with self.assertNumQueries(0):
+            self.assertEqual(has_permission_many(checks), decisions)
+        self.assertEqual(decisions, [self.resolve(*check) for check in checks])
+
+    def test_clientid(self):
+        checks = [('member', '/test/two', PROTO_MQTT_ACC_SUS, 'bound'),
+                  ('user', '/test/two', PROTO_MQTT_ACC_SUS, 'bound'),
+                  ('user', '/test/two', PROTO_MQTT_ACC_SUS, 'group'),
+                  ('member', '/test/two', PROTO_MQTT_ACC_SUS, 'group')]
+        self.assertEqual(has_permission_many(checks), [False, True, False, True])
+        response = self.post([{'username': 'member', 'topic': '/test/two', 'acc': PROTO_MQTT_ACC_SUS,
+                               'clientid': 'bound'}])
+        self.assertEqual(response.json(), [False])
+        self.assertEqual(self.client.post(reverse('django_mqtt:mqtt_acl'), {
+            'username': 'member', 'topic': '/test/two', 'acc': PROTO_MQTT_ACC_SUS, 'clientid': 'bound'}).status_code,
+            403)
+
+    def test_empty(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(has_permission_many([]), [])
+
+    def test_view(self):
+        response = self.post([
+            {'username': 'user', 'topic': '/test', 'acc': PROTO_MQTT_ACC_PUB},
+            {'username': 'member', 'topic': '/test/one', 'acc': str(PROTO_MQTT_ACC_PUB)},
+            {'username': 'user', 'topic': '/test/one', 'acc': PROTO_MQTT_ACC_SUS},
+            {'username': 'member', 'topic': '/test/one/two', 'acc': PROTO_MQTT_ACC_SUS},
+            {'topic': '/test/one/two', 'acc': PROTO_MQTT_ACC_SUS},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [True, False, False, True,
+                                           self.resolve(None, '/test/one/two', PROTO_MQTT_ACC_SUS)])
+
+    def test_bad_request(self):
+        self.assertEqual(self.client.post(self.url_testing, 'no json', content_type='application/json').status_code,
+                         400)
+        self.assertEqual(self.post({'username': 'user'}).status_code, 400)
+        self.assertEqual(self.post(['user']).status_code, 400)
+        self.assertEqual(self.post([{'topic': 5, 'acc': PROTO_MQTT_ACC_PUB}]).status_code, 400)
+        self.assertEqual(self.post([{'username': ['a'], 'topic': '/test'}]).status_code, 400)
+        self.assertEqual(self.post([{'username': {}, 'topic': '/test'}]).status_code, 400)
+        self.assertEqual(self.post([{'username': 'user', 'clientid': 5}]).status_code, 400)
+        for acc in [True, False, 'invalid', 3, 0, None, [PROTO_MQTT_ACC_PUB]]:
+            self.assertEqual(self.post([{'username': 'user', 'topic': '/test', 'acc': acc}]).status_code, 400)
+        self.assertEqual(self.post([{'username': 'user', 'topic': '/test'}]).status_code, 400)
+        self.assertEqual(self.post([{'username': None, 'topic': None, 'acc': PROTO_MQTT_ACC_PUB}]).json(),
+                         [self.resolve(None, None, PROTO_MQTT_ACC_PUB)])
+        self.assertEqual(self.post([]).json(), [])
@@ -0,0 +1,65 @@
+from django.test import override_settings
+from django.urls import reverse
+
+from django_mqtt.bloom import known_clientids, known_topics, known_usernames, negative_cache
+from django_mqtt.models import PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS
+from django_mqtt.mosquitto.auth_plugin.test import test_acl, test_auth, test_super
+from django_mqtt.test import test_policy
+
+
+class KnownNamesMixin(object):
+    def setUp(self):
+        # The rollback of the previous test does not rebuild the filters
+        for known in (known_usernames, known_topics, known_clientids):
+            known.reset()
+        negative_cache.clear()
+        super(KnownNamesMixin, self).setUp()
+
+
+@override_settings(MQTT_BLOOM_FILTER=True, MQTT_NEGATIVE_CACHE_SIZE=100)
+class BloomACLPubAcc(KnownNamesMixin, test_acl.PubAcc):
+    pass
+
+
+@override_settings(MQTT_BLOOM_FILTER=True, MQTT_NEGATIVE_CACHE_SIZE=100)
+class BloomAuthSusAcc(KnownNamesMixin, test_auth.SusAcc):
+    pass
+
+
+@override_settings(MQTT_BLOOM_FILTER=True, MQTT_NEGATIVE_CACHE_SIZE=100)
+class BloomAdminTestCase(KnownNamesMixin, test_super.AdminTestCase):
+    pass
+
+
+@override_settings(MQTT_BLOOM_FILTER=True, MQTT_NEGATIVE_CACHE_SIZE=100, MQTT_ACL_POLICY_POLL=3600)
+class UnknownNamesTestCase(KnownNamesMixin, test_policy.BasePolicyTestCase):
+    def setUp(self):
+        super(UnknownNamesTestCase, self).setUp()
+        for known in (known_usernames, known_topics, known_clientids):
+            known.get_filter()
+        self.build_wildcard_index()
+
+    def test_unknown_user(self):
+        with self.assertNumQueries(0):
+            response = self.client.post(reverse('django_mqtt:mqtt_acl'), {'username': 'unknown', 'topic': '/test',
+                                                                          'acc': PROTO_MQTT_ACC_PUB})
+            self.assertEqual(response.status_code, 403)
+            response = self.client.post(reverse('django_mqtt:mqtt_auth'), {'username': 'unknown', 'password': '1',
+                                                                           'topic': '/unknown', 'acc': 1})
+            self.assertEqual(response.status_code, 403)
+            response = self.client.post(reverse('django_mqtt:mqtt_superuser'), {'username': 'unknown'})
+            self.assertEqual(response.status_code, 403)
+
+    def test_unknown_clientid(self):
+        data = {'username': 'user', 'topic': '/test', 'acc': PROTO_MQTT_ACC_PUB}
+        with self.assertNumQueries(2):
+            response = self.client.post(reverse('django_mqtt:mqtt_acl'), dict(data, clientid='unknown'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_missed_user(self):
+        self.user.username = 'renamed'
+        self.user.save()
+        data = {'username': 'user', 'topic': '/test/one', 'acc': PROTO_MQTT_ACC_SUS}
+        self.assertEqual(self.client.post(reverse('django_mqtt:mqtt_acl'), data).status_code, 403)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.post(reverse('django_mqtt:mqtt_acl'), data).status_code, 403)
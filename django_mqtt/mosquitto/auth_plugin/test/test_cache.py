@@ -0,0 +1,164 @@
+import asyncio
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import Group, User
+from django.test import RequestFactory, TestCase, override_settings
+
+from django_mqtt import models, policy
+from django_mqtt.mosquitto.auth_plugin.auth import acl_cache, has_permission
+from django_mqtt.mosquitto.auth_plugin.views import async_acl, async_flight
+
+
+@override_settings(MQTT_ACL_ALLOW=False)
+@override_settings(MQTT_ACL_ALLOW_ANONIMOUS=False)
+@override_settings(MQTT_ACL_CACHE_SIZE=100)
+class ACLCacheTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user', password='password')
+        self.topic = models.Topic.objects.create(name='/topic')
+        self.acc = models.PROTO_MQTT_ACC_PUB
+        self.acl = models.ACL.objects.create(acc=self.acc, topic=self.topic, allow=True)
+        self.acl.users.add(self.user, User.objects.create_user('other'))
+        # The rollback of the previous test does not send acl_changed
+        policy._version = None
+        policy._seen_version = None
+
+    def assertCached(self, allow):
+        self.assertEqual(has_permission(self.user, '/topic', self.acc), allow)
+        with self.assertNumQueries(0):
+            self.assertEqual(has_permission(self.user, '/topic', self.acc), allow)
+
+    def test_cached(self):
+        self.assertCached(True)
+        self.assertEqual(len(acl_cache), 1)
+
+    def test_acl_changed(self):
+        self.assertCached(True)
+        self.acl.allow = False
+        self.acl.save()
+        self.assertCached(False)
+        self.acl.delete()
+        self.assertCached(False)
+
+    def test_acl_users_changed(self):
+        self.assertCached(True)
+        self.acl.users.remove(self.user)
+        self.assertCached(False)
+
+    def test_user_changed(self):
+        other = User.objects.get(username='other')
+        self.assertCached(True)
+        self.assertEqual(has_permission(other, '/topic', self.acc), True)
+        self.assertEqual(len(acl_cache), 2)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(len(acl_cache), 1)
+        self.assertCached(False)
+
+    def test_user_profile_changed(self):
+        self.assertCached(True)
+        version = models.PolicyVersion.get_version()
+        last_seq = models.ACLChange.get_last_seq()
+        self.user.first_name = 'User'
+        self.user.email = 'user@example.com'
+        self.user.save()
+        self.user.save(update_fields=['last_login'])
+        self.assertEqual(models.ACLChange.get_last_seq(), last_seq)
+        self.assertEqual(models.PolicyVersion.get_version(), version)
+        self.assertEqual(len(acl_cache), 1)
+        self.assertCached(True)
+
+    def test_user_changed_keeps_other_users(self):
+        other = User.objects.get(username='other')
+        self.assertCached(True)
+        self.assertTrue(has_permission(other, '/topic', self.acc))
+        self.user.is_active = False
+        self.user.save(update_fields=['is_active'])
+        self.assertFalse(has_permission(self.user, '/topic', self.acc))
+        policy.get_policy_version()
+        with self.assertNumQueries(0):
+            self.assertTrue(has_permission(other, '/topic', self.acc))
+
+    @override_settings(MQTT_ACL_POLICY_POLL=3600)
+    def test_other_process_user_changed(self):
+        other = User.objects.get(username='other')
+        self.assertTrue(has_permission(other, '/topic', self.acc))
+        self.assertCached(True)
+        # Changed by other process, without signals on this one
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        models.ACLChange.log(models.CHANGE_USER, [self.user.pk])
+        models.PolicyVersion.increase()
+        policy._version_checked -= 3600
+        policy.get_policy_version()
+        self.assertEqual(len(acl_cache), 1)
+        with self.assertNumQueries(0):
+            self.assertTrue(has_permission(other, '/topic', self.acc))
+        # Any other change clears everything
+        models.ACLChange.log(models.CHANGE_TOPIC, [self.topic.pk])
+        models.PolicyVersion.increase()
+        policy._version_checked -= 3600
+        policy.get_policy_version()
+        self.assertEqual(len(acl_cache), 0)
+
+    def test_group_changed(self):
+        group = Group.objects.create(name='mqtt')
+        self.acl.users.remove(self.user)
+        self.acl.groups.add(group)
+        self.assertCached(False)
+        self.user.groups.add(group)
+        self.assertCached(True)
+        group.user_set.remove(self.user)
+        self.assertCached(False)
+        self.user.groups.add(group)
+        self.assertCached(True)
+        group.delete()
+        self.assertCached(False)
+
+    def test_settings_changed(self):
+        self.acl.delete()
+        self.assertCached(False)
+        with self.settings(MQTT_ACL_ALLOW=True):
+            self.assertCached(True)
+        self.assertCached(False)
+
+    @override_settings(MQTT_ACL_POLICY_POLL=3600)
+    def test_other_process_change(self):
+        self.assertCached(True)
+        # Changed by other process, without signals on this one
+        models.ACL.objects.filter(pk=self.acl.pk).update(allow=False)
+        models.PolicyVersion.increase()
+        self.assertTrue(has_permission(self.user, '/topic', self.acc))
+        policy._version_checked -= 3600
+        self.assertFalse(has_permission(self.user, '/topic', self.acc))
+
+    @override_settings(MQTT_ACL_CACHE_SIZE=0)
+    def test_disabled(self):
+        self.assertEqual(has_permission(self.user, '/topic', self.acc), True)
+        self.assertEqual(len(acl_cache), 0)
+
+
+@override_settings(MQTT_ACL_SINGLE_FLIGHT=True)
+class SingleFlightACLCacheTestCase(ACLCacheTestCase):
+    pass
+
+
+@override_settings(MQTT_ACL_SINGLE_FLIGHT=True)
+class SingleFlightAsyncTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user')
+        acl = models.ACL.objects.create(acc=models.PROTO_MQTT_ACC_PUB, allow=True,
+                                        topic=models.Topic.objects.create(name='/topic'))
+        acl.users.add(self.user)
+
+    def test_async_views_coalesced(self):
+        data = {'username': 'user', 'topic': '/topic', 'acc': models.PROTO_MQTT_ACC_PUB}
+        factory = RequestFactory()
+        requests = [factory.post('/', data) for index in range(10)] + [factory.post('/', dict(data, acc=1))]
+        coalesced = async_flight.coalesced
+
+        async def run():
+            return await asyncio.gather(*[async_acl(request) for request in requests])
+
+        responses = async_to_sync(run)()
+        self.assertEqual([response.status_code for response in responses], [200] * 10 + [403])
+        self.assertEqual(async_flight.coalesced - coalesced, 9)
@@ -0,0 +1,82 @@
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from django_mqtt import models
+from django_mqtt.credentials import credentials_cache
+from django_mqtt.mosquitto.auth_plugin.auth import authenticate
+from django_mqtt.mosquitto.auth_plugin.test import test_auth
+
+
+@override_settings(MQTT_CREDENTIALS_CACHE_SIZE=100)
+class CredentialsCacheTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user', password='password')
+        credentials_cache.clear()
+
+    def assertCached(self, username, password):
+        hits = credentials_cache.hits
+        self.assertEqual(authenticate(username=username, password=password), self.user)
+        with self.assertNumQueries(1):
+            self.assertEqual(authenticate(username=username, password=password), self.user)
+        self.assertEqual(credentials_cache.hits, hits + 1)
+
+    def test_cached(self):
+        self.assertCached('user', 'password')
+        self.assertEqual(len(credentials_cache), 1)
+        for key, value in credentials_cache._data.items():
+            self.assertNotIn('password', repr(key))
+            self.assertNotIn(self.user.password, repr(value))
+
+    def test_wrong_not_cached(self):
+        self.assertIsNone(authenticate(username='user', password='wrong'))
+        self.assertIsNone(authenticate(username='wrong', password='password'))
+        self.assertIsNone(authenticate(username='user'))
+        self.assertEqual(len(credentials_cache), 0)
+
+    def test_password_changed(self):
+        self.assertCached('user', 'password')
+        self.user.set_password('new')
+        self.user.save()
+        self.assertIsNone(authenticate(username='user', password='password'))
+        self.assertCached('user', 'new')
+
+    def test_inactive(self):
+        self.assertCached('user', 'password')
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(authenticate(username='user', password='password'))
+
+    def test_acl_password(self):
+        topic = models.Topic.objects.create(name='/topic')
+        acl = models.ACL.objects.create(topic=topic, acc=models.PROTO_MQTT_ACC_PUB)
+        acl.set_password('1234')
+        acl.save()
+        self.assertTrue(acl.check_password('1234'))
+        hits = credentials_cache.hits
+        self.assertTrue(models.ACL.objects.get(pk=acl.pk).check_password('1234'))
+        self.assertEqual(credentials_cache.hits, hits + 1)
+        self.assertFalse(acl.check_password('4321'))
+        acl.set_password('4321')
+        acl.save()
+        self.assertFalse(acl.check_password('1234'))
+        self.assertTrue(acl.check_password('4321'))
+
+    @override_settings(MQTT_CREDENTIALS_CACHE_SIZE=0)
+    def test_disabled(self):
+        self.assertEqual(authenticate(username='user', password='password'), self.user)
+        self.assertEqual(len(credentials_cache), 0)
+
+
+@override_settings(MQTT_CREDENTIALS_CACHE_SIZE=100)
+class CachedAuthTestCase(test_auth.AuthTestCase):
+    pass
+
+
+@override_settings(MQTT_CREDENTIALS_CACHE_SIZE=100)
+class CachedAuthPubAcc(test_auth.PubAcc):
+    pass
+
+
+@override_settings(MQTT_CREDENTIALS_CACHE_SIZE=100)
+class CachedAuthSusAcc(test_auth.SusAcc):
+    pass
@@ -0,0 +1,143 @@
+from asgiref.sync import async_to_sync
+from django.test import Client, RequestFactory, SimpleTestCase, override_settings
+from django.urls import reverse
+
+from django_mqtt import metrics
+from django_mqtt.models import PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS
+from django_mqtt.mosquitto.auth_plugin import views
+from django_mqtt.mosquitto.auth_plugin.app import AuthPluginHandler
+from django_mqtt.mosquitto.auth_plugin.auth import acl_allowed, acl_cache
+from django_mqtt.mosquitto.auth_plugin.test import test_acl, test_super
+from django_mqtt.test import test_policy
+
+
+class RecordingCollector(metrics.Collector):
+    def __init__(self):
+        self.observed = []
+        self.defaults = 0
+
+    def observe(self, endpoint, seconds, queries, allowed):
+        self.observed.append((endpoint, queries, allowed))
+
+    def count_default(self):
+        self.defaults += 1
+
+
+@override_settings(MQTT_METRICS=True)
+class MetricsACLTestCase(test_acl.ACLTestCase):
+    pass
+
+
+@override_settings(MQTT_METRICS=True)
+class MetricsAdminTestCase(test_super.AdminTestCase):
+    pass
+
+
+class HistogramTestCase(SimpleTestCase):
+    def test_samples(self):
+        histogram = metrics.Histogram((1, 2))
+        for value in [0, 1, 1.5, 3]:
+            histogram.observe(value)
+        self.assertEqual(list(histogram.get_samples('test', (('endpoint', 'acl'), ))), [
+            ('test_bucket', (('endpoint', 'acl'), ('le', '1')), 2),
+            ('test_bucket', (('endpoint', 'acl'), ('le', '2')), 3),
+            ('test_bucket', (('endpoint', 'acl'), ('le', '+Inf')), 4),
+            ('test_sum', (('endpoint', 'acl'), ), 5.5),
+            ('test_count', (('endpoint', 'acl'), ), 4),
+        ])
+
+
+class MetricsTestCase(test_policy.BasePolicyTestCase):
+    def setUp(self):
+        super(MetricsTestCase, self).setUp()
+        self.client = Client()
+        self.url_metrics = reverse('django_mqtt:mqtt_metrics')
+
+    def post_acl(self, username, topic, acc, url_name='mqtt_acl'):
+        return self.client.post(reverse('django_mqtt:%s' % url_name), {'username': username, 'topic': topic,
+                                                                       'acc': acc})
+
+    def test_disabled(self):
+        self.assertIsNone(metrics.get_collector())
+        self.assertTrue(metrics.measure('acl', lambda data: True, {}))
+        self.assertEqual(self.client.get(self.url_metrics).status_code, 404)
+
+    @override_settings(MQTT_METRICS=True)
+    def test_collector(self):
+        collector = metrics.get_collector()
+        self.assertIsInstance(collector, metrics.InProcessCollector)
+        self.assertIs(metrics.get_collector(), collector)
+        self.post_acl('user', '/test', PROTO_MQTT_ACC_PUB)
+        self.post_acl('user', '/other', PROTO_MQTT_ACC_PUB)
+        self.post_acl('user', '/other', PROTO_MQTT_ACC_SUS, url_name='mqtt_acl_async')
+        self.client.post(reverse('django_mqtt:mqtt_superuser'), {'username': 'admin'})
+        self.assertEqual(dict(collector.decisions), {('acl', 'allow'): 1, ('acl', 'deny'): 2,
+                                                     ('superuser', 'allow'): 1})
+        self.assertEqual(collector.latency['acl'].count, 3)
+        self.assertEqual(collector.queries['acl'].count, 3)
+        self.assertGreater(collector.queries['acl'].sum, 0)
+        self.assertEqual(collector.defaults, 1)
+
+    @override_settings(MQTT_METRICS=True, MQTT_METRICS_COLLECTOR=__name__ + '.RecordingCollector')
+    def test_unmeasured(self):
+        collector = metrics.get_collector()
+        with metrics.unmeasured():
+            self.assertFalse(metrics.measure('acl', acl_allowed, {'username': 'user', 'topic': '/other',
+                                                                  'acc': PROTO_MQTT_ACC_PUB}))
+            metrics.count_default()
+        self.assertEqual((collector.observed, collector.defaults), ([], 0))
+        metrics.count_default()
+        self.assertEqual(collector.defaults, 1)
+
+    @override_settings(MQTT_METRICS=True, MQTT_ACL_POLICY_POLL=3600)
+    def test_queries(self):
+        self.build_wildcard_index()
+        collector = metrics.get_collector()
+        with self.assertNumQueries(2):
+            self.assertTrue(metrics.measure('acl', acl_allowed, {'username': 'user', 'topic': '/test',
+                                                                 'acc': PROTO_MQTT_ACC_PUB}))
+        self.assertEqual(collector.queries['acl'].sum, 2)
+
+    @override_settings(MQTT_METRICS=True, MQTT_METRICS_COLLECTOR=__name__ + '.RecordingCollector',
+                       MQTT_ACL_POLICY_POLL=3600)
+    def test_custom_collector(self):
+        self.build_wildcard_index()
+        collector = metrics.get_collector()
+        self.assertIsInstance(collector, RecordingCollector)
+        self.assertEqual(AuthPluginHandler().get_status('POST', '/acl', b'username=user&topic=/other&acc=1'), 403)
+        self.assertEqual(collector.observed, [('acl', 2, False)])
+        self.assertEqual(collector.defaults, 1)
+        self.assertEqual(self.client.get(self.url_metrics).status_code, 200)
+
+    @override_settings(MQTT_METRICS=True, MQTT_ACL_CACHE_SIZE=100, MQTT_ACL_SINGLE_FLIGHT=True)
+    def test_exposition(self):
+        hits = acl_cache.hits
+        for index in range(3):
+            self.post_acl('user', '/test', PROTO_MQTT_ACC_PUB)
+        async_to_sync(views.async_acl)(RequestFactory().post('/', {'username': 'user', 'topic': '/test',
+                                                                   'acc': PROTO_MQTT_ACC_PUB}))
+        response = self.client.get(self.url_metrics)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        lines = response.content.decode().splitlines()
+        self.assertIn('# TYPE mqtt_request_duration_seconds histogram', lines)
+        self.assertIn('mqtt_request_duration_seconds_count{endpoint="acl"} 4', lines)
+        self.assertIn('mqtt_request_duration_seconds_bucket{endpoint="acl",le="+Inf"} 4', lines)
+        self.assertIn('mqtt_request_queries_bucket{endpoint="acl",le="1"} 3', lines)
+        self.assertIn('mqtt_decisions_total{endpoint="acl",decision="allow"} 4', lines)
+        self.assertIn('mqtt_cache_hits_total{cache="acl"} %s' % (hits + 3), lines)
+        self.assertIn('mqtt_cache_size{cache="acl"} 1', lines)
+        self.assertIn('mqtt_single_flight_calls_total{flight="async"} %s' % views.async_flight.calls, lines)
+        ratio = acl_cache.hits / (acl_cache.hits + acl_cache.misses)
+        self.assertIn('mqtt_cache_hit_ratio{cache="acl"} %r' % ratio, lines)
+
+    @override_settings(MQTT_METRICS=True)
+    def test_allowed_ips(self):
+        self.assertEqual(self.client.get(self.url_metrics, REMOTE_ADDR='10.0.0.1').status_code, 403)
+        with self.settings(MQTT_METRICS_ALLOWED_IPS=['10.0.0.1']):
+            self.assertEqual(self.client.get(self.url_metrics, REMOTE_ADDR='10.0.0.1').status_code, 200)
+            self.assertEqual(self.client.get(self.url_metrics).status_code, 403)
+        self.assertEqual(self.client.post(self.url_metrics).status_code, 405)
+
+    def test_escape_label(self):
+        self.assertEqual(metrics.escape_label('a"b\\c\nd'), 'a\\"b\\\\c\\nd')
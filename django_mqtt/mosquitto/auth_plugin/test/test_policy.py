@@ -0,0 +1,73 @@
+from django.test import override_settings
+
+from django_mqtt import policy
+from django_mqtt.mosquitto.auth_plugin.test import test_acl, test_auth, test_bypass, test_wildcards
+
+
+@override_settings(MQTT_ACL_POLICY=True, MQTT_ACL_POLICY_POLL=0)
+class PolicyACLTestCase(test_acl.ACLTestCase):
+    pass
+
+
+@override_settings(MQTT_ACL_POLICY=True, MQTT_ACL_POLICY_POLL=0)
+class PolicyACLNoAcc(test_acl.NoAcc):
+    pass
+
+
+@override_settings(MQTT_ACL_POLICY=True, MQTT_ACL_POLICY_POLL=0)
+class PolicyACLPubAcc(test_acl.PubAcc):
+    pass
+
+
+@override_settings(MQTT_ACL_POLICY=True, MQTT_ACL_POLICY_POLL=0)
+class PolicyACLSusAcc(test_acl.SusAcc):
+    pass
+
+
+@override_settings(MQTT_ACL_POLICY=True, MQTT_ACL_POLICY_POLL=0)
+class PolicyAuthPubAcc(test_auth.PubAcc):
+    pass
+
+
+@override_settings(MQTT_ACL_POLICY=True, MQTT_ACL_POLICY_POLL=0)
+class PolicyAuthSusAcc(test_auth.SusAcc):
+    pass
+
+
+@override_settings(MQTT_ACL_POLICY=True, MQTT_ACL_POLICY_POLL=0)
+class PolicyBypassPubAcc(test_bypass.PubAcc):
+    pass
+
+
+@override_settings(MQTT_ACL_POLICY=True, MQTT_ACL_POLICY_POLL=0)
+class PolicyBypassSusAcc(test_bypass.SusAcc):
+    pass
+
+
+@override_settings(MQTT_ACL_POLICY=True, MQTT_ACL_POLICY_POLL=0)
+class PolicyWildcardACLTestCase(test_wildcards.WildcardACLTestCase):
+    pass
+
+
+class UserPolicyMixin(object):
+    def setUp(self):
+        # The rollback of the previous test does not send acl_changed
+        policy.user_policies.clear()
+        policy._version = None
+        policy._rules_policy = None
+        super(UserPolicyMixin, self).setUp()
+
+
+@override_settings(MQTT_USER_POLICY_CACHE_SIZE=100)
+class UserPolicyACLPubAcc(UserPolicyMixin, test_acl.PubAcc):
+    pass
+
+
+@override_settings(MQTT_USER_POLICY_CACHE_SIZE=100)
+class UserPolicyACLSusAcc(UserPolicyMixin, test_acl.SusAcc):
+    pass
+
+
+@override_settings(MQTT_USER_POLICY_CACHE_SIZE=100)
+class UserPolicyWildcardACLTestCase(UserPolicyMixin, test_wildcards.WildcardACLTestCase):
+    pass
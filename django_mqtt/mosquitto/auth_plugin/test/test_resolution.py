@@ -0,0 +1,101 @@
+from itertools import product
+
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from django_mqtt.models import ACL, PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS, ClientId, Topic
+from django_mqtt.mosquitto.auth_plugin.auth import has_permission
+from django_mqtt.test import test_policy
+
+
+class AclResolutionTestCase(test_policy.BasePolicyTestCase):
+    TOPICS = test_policy.BasePolicyTestCase.TOPICS[:-1] + ['/test/one/two', '/test/+', '$SYS', 'other/test']
+
+    def setUp(self):
+        super(AclResolutionTestCase, self).setUp()
+        self.url_testing = reverse('django_mqtt:mqtt_acl')
+        self.client = Client()
+
+    def test_get_applicable(self):
+        for topic, acc in product(self.TOPICS, [PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS]):
+            broadcast = ACL.objects.filter(topic__name='#', acc=acc).first()
+            self.assertEqual(ACL.get_applicable(topic, acc), (ACL.get_acl(topic, acc), broadcast), (topic, acc))
+
+    @override_settings(MQTT_ACL_POLICY_POLL=3600)
+    def test_query_budget(self):
+        for index in range(20):
+            ACL.objects.create(topic=Topic.objects.create(name='/test/%d/#' % index), acc=PROTO_MQTT_ACC_PUB)
+        self.build_wildcard_index()
+        for username, topic in product(['user', 'member', 'admin'], ['/test', '/test/one', '/other', '$SYS/one']):
+            for acc in [PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS]:
+                with self.assertNumQueries(2):
+                    self.client.post(self.url_testing, {'username': username, 'topic': topic, 'acc': acc})
+        with self.settings(MQTT_ACL_ALLOW=True, MQTT_ACL_ALLOW_ANONIMOUS=True):
+            self.build_wildcard_index()
+            with self.assertNumQueries(1):
+                response = self.client.post(self.url_testing, {'topic': '/test/one', 'acc': PROTO_MQTT_ACC_SUS})
+        self.assertEqual(response.status_code, 403)
+        self.build_wildcard_index()
+        with self.assertNumQueries(2):
+            response = self.client.post(self.url_testing, {'username': 'user', 'topic': '/test',
+                                                           'acc': PROTO_MQTT_ACC_PUB})
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(MQTT_ACL_POLICY_POLL=3600)
+    def test_wildcard_candidates(self):
+        for start, end in [(0, 10), (10, 200)]:
+            for index in range(start, end):
+                ACL.objects.create(topic=Topic.objects.create(name='sensors/%d/#' % index), acc=PROTO_MQTT_ACC_PUB)
+            self.build_wildcard_index()
+            with self.assertNumQueries(1):
+                acl, broadcast = ACL.get_applicable('sensors/5/temperature', PROTO_MQTT_ACC_PUB)
+            self.assertEqual(acl.topic.name, 'sensors/5/#')
+            self.assertEqual(broadcast.topic.name, '#')
+            # Only the wildcard ACLs matching the topic are read, not all the ones with the same first level
+            self.assertEqual(len(ACL.get_wildcard_index(PROTO_MQTT_ACC_PUB).match('sensors/5/temperature')), 2)
+
+    def post_clientid(self, username, clientid):
+        data = {'topic': '/test', 'acc': PROTO_MQTT_ACC_PUB, 'clientid': clientid}
+        if username is not None:
+            data['username'] = username
+        return self.client.post(self.url_testing, data).status_code
+
+    def test_clientid(self):
+        ClientId.objects.create(name='public')
+        ClientId.objects.create(name='bound').users.add(self.user)
+        ClientId.objects.create(name='group').groups.add(self.group)
+        self.assertEqual(self.post_clientid('user', 'public'), 200)
+        self.assertEqual(self.post_clientid('user', 'unknown'), 200)
+        self.assertEqual(self.post_clientid('user', 'bound'), 200)
+        self.assertEqual(self.post_clientid('user', 'group'), 403)
+        self.assertFalse(has_permission(self.user, '/test', PROTO_MQTT_ACC_PUB, clientid=ClientId.objects.get(
+            name='group')))
+        self.group.user_set.add(self.user)
+        self.assertEqual(self.post_clientid('user', 'group'), 200)
+        self.assertEqual(self.post_clientid('member', 'bound'), 403)
+        with self.settings(MQTT_ACL_ALLOW=True, MQTT_ACL_ALLOW_ANONIMOUS=True):
+            self.assertFalse(has_permission(None, '/other', PROTO_MQTT_ACC_SUS, clientid='bound'))
+            self.assertTrue(has_permission(None, '/other', PROTO_MQTT_ACC_SUS, clientid='public'))
+
+    @override_settings(MQTT_ACL_POLICY=True, MQTT_ACL_POLICY_POLL=0)
+    def test_clientid_policy(self):
+        self.test_clientid()
+
+    @override_settings(MQTT_ACL_POLICY=True, MQTT_ACL_POLICY_POLL=3600)
+    def test_clientid_policy_queries(self):
+        ClientId.objects.create(name='bound').users.add(self.user)
+        self.assertEqual(self.post_clientid('user', 'bound'), 200)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.post_clientid('member', 'bound'), 403)
+            self.assertEqual(self.post_clientid('user', 'bound'), 200)
+
+    @override_settings(MQTT_ACL_POLICY_POLL=3600)
+    def test_clientid_cached(self):
+        ClientId.objects.create(name='bound').users.add(self.user)
+        self.assertEqual(self.post_clientid('user', 'bound'), 200)
+        with self.assertNumQueries(2):
+            self.client.post(self.url_testing, {'username': 'user', 'topic': '/test/one', 'acc': PROTO_MQTT_ACC_PUB,
+                                                'clientid': 'bound'})
+        ClientId.objects.get(name='bound').users.remove(self.user)
+        ClientId.objects.get(name='bound').users.add(self.member)
+        self.assertEqual(self.post_clientid('user', 'bound'), 403)
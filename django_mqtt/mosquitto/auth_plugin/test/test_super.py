@@ -1,8 +1,11 @@
 
 from django.contrib.auth.models import User
-from django.test import TestCase, Client
+from django.test import TestCase, Client, override_settings
 from django.urls import reverse
 
+from django_mqtt.models import PolicyVersion, Topic
+from django_mqtt.mosquitto.auth_plugin import auth
+
 
 class AdminTestCase(TestCase):
     def setUp(self):
@@ -32,3 +35,48 @@ class AdminTestCase(TestCase):
         user.save()
         response = self.client.post(self.url_testing, {'username': username})
         self.assertEqual(response.status_code, 403)
+
+
+@override_settings(MQTT_SUPERUSER_CACHE=True, MQTT_ACL_POLICY_POLL=3600)
+class CachedAdminTestCase(AdminTestCase):
+    def setUp(self):
+        super(CachedAdminTestCase, self).setUp()
+        # The rollback of the previous test does not send post_delete
+        auth._superusers = None
+
+    def test_no_queries(self):
+        admin = User.objects.create_superuser('admin', 'email@test.test', 'password')
+        User.objects.create_user('user')
+        self.assertEqual(auth.get_superusers(), frozenset(['admin']))
+        with self.assertNumQueries(0):
+            for username in ['admin', 'user', 'unknown']:
+                self.client.post(self.url_testing, {'username': username})
+        admin.is_superuser = False
+        admin.save()
+        self.assertEqual(self.client.post(self.url_testing, {'username': 'admin'}).status_code, 403)
+        admin.is_superuser = True
+        admin.save()
+        self.assertEqual(self.client.post(self.url_testing, {'username': 'admin'}).status_code, 200)
+        admin.delete()
+        self.assertEqual(self.client.post(self.url_testing, {'username': 'admin'}).status_code, 403)
+
+    def test_other_models(self):
+        superusers = auth.get_superusers()
+        Topic.objects.create(name='/test')
+        self.assertIs(auth._superusers, superusers)
+        User.objects.create_user('user')
+        self.assertIsNone(auth._superusers)
+
+    def test_other_process_change(self):
+        User.objects.create_superuser('admin', 'email@test.test', 'password')
+        self.assertEqual(auth.get_superusers(), frozenset(['admin']))
+        User.objects.filter(username='admin').update(is_active=False)
+        PolicyVersion.increase()
+        self.assertEqual(auth.get_superusers(), frozenset(['admin']))
+        with self.settings(MQTT_ACL_POLICY_POLL=0):
+            self.assertEqual(auth.get_superusers(), frozenset())
+
+
+@override_settings(MQTT_ACL_POLICY=True, MQTT_ACL_POLICY_POLL=0)
+class PolicyAdminTestCase(AdminTestCase):
+    pass
@@ -0,0 +1,47 @@
+from django.contrib.auth.models import User
+from django.test import TestCase, Client, override_settings
+from django.urls import reverse
+
+from django_mqtt import models
+
+
+@override_settings(MQTT_ACL_ALLOW=False)
+@override_settings(MQTT_ACL_ALLOW_ANONIMOUS=False)
+class WildcardACLTestCase(TestCase):
+    def setUp(self):
+        self.username = 'user'
+        self.user = User.objects.create_user(self.username, password='password')
+        self.url_testing = reverse('django_mqtt:mqtt_acl')
+        self.client = Client()
+        self.acc = models.PROTO_MQTT_ACC_PUB
+
+    def create_acl(self, name, allow=True):
+        topic = models.Topic.objects.create(name=name)
+        acl = models.ACL.objects.create(acc=self.acc, topic=topic, allow=allow)
+        acl.users.add(self.user)
+        return acl
+
+    def post(self, topic):
+        return self.client.post(self.url_testing, {'username': self.username, 'topic': topic, 'acc': self.acc})
+
+    def test_single_level(self):
+        self.create_acl('/sensors/+/temp')
+        self.assertEqual(self.post('/sensors/one/temp').status_code, 200)
+        self.assertEqual(self.post('/sensors/one/hum').status_code, 403)
+        self.assertEqual(self.post('/sensors/one/two/temp').status_code, 403)
+
+    def test_multi_level(self):
+        self.create_acl('/sensors/#')
+        self.assertEqual(self.post('/sensors/one/temp').status_code, 200)
+        self.assertEqual(self.post('/actuators/one').status_code, 403)
+
+    def test_most_specific(self):
+        self.create_acl('/sensors/#')
+        self.create_acl('/sensors/+/temp', allow=False)
+        self.assertEqual(self.post('/sensors/one/hum').status_code, 200)
+        self.assertEqual(self.post('/sensors/one/temp').status_code, 403)
+
+    def test_dollar(self):
+        self.create_acl('+/#')
+        self.assertEqual(self.post('sensors/temp').status_code, 200)
+        self.assertEqual(self.post('$SYS/temp').status_code, 403)
@@ -7,4 +7,9 @@ urlpatterns = [
     url(r'^auth$', views.Auth.as_view(), name='mqtt_auth'),
     url(r'^superuser$', views.Superuser.as_view(), name='mqtt_superuser'),
     url(r'^acl$', views.Acl.as_view(), name='mqtt_acl'),
+    url(r'^acl/batch$', views.AclBatch.as_view(), name='mqtt_acl_batch'),
+    url(r'^async/auth$', views.async_auth, name='mqtt_auth_async'),
+    url(r'^async/superuser$', views.async_superuser, name='mqtt_superuser_async'),
+    url(r'^async/acl$', views.async_acl, name='mqtt_acl_async'),
+    url(r'^metrics$', views.Metrics.as_view(), name='mqtt_metrics'),
 ]
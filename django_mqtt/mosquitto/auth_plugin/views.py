@@ -1,11 +1,29 @@
-from django.http import HttpResponse, HttpResponseForbidden
+import json
+from functools import partial
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import (
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseForbidden,
+    HttpResponseNotAllowed,
+    HttpResponseNotFound,
+    JsonResponse
+)
 from django.views.generic.base import View
 from django.views.decorators.csrf import csrf_exempt
-from django.contrib.auth import authenticate
-from django.contrib.auth import get_user_model
 
-from django_mqtt.models import Topic, ClientId, ACL, PROTO_MQTT_ACC
-from django_mqtt.mosquitto.auth_plugin.auth import has_permission
+from django_mqtt.cache import SingleFlight
+from django_mqtt.metrics import generate_text, get_collector, measure
+from django_mqtt.models import PROTO_MQTT_ACC
+from django_mqtt.mosquitto.auth_plugin.auth import (
+    acl_allowed,
+    auth_allowed,
+    get_acc,
+    has_permission_many,
+    superuser_allowed
+)
 
 
 class Auth(View):
@@ -32,23 +50,7 @@ class Auth(View):
         elif hasattr(request, 'DATA'):  # pragma: no cover
             data = request.DATA
 
-        topics = Topic.objects.filter(name=data.get('topic'))
-        try:
-            acc = int(data.get('acc', None))
-        except (TypeError, ValueError):
-            acc = None
-        allow = False
-        if topics.exists() and acc in dict(PROTO_MQTT_ACC).keys():
-            topic = topics.get()
-            acls = ACL.objects.filter(acc=acc, topic=topic,
-                                      password__isnull=False, password=data.get('password'))
-            if acls.exists():
-                allow = True
-        if not allow:
-            user = authenticate(username=data.get('username'), password=data.get('password'))
-            allow = has_permission(user, data.get('topic', '#'), acc)
-
-        if not allow:
+        if not measure('auth', auth_allowed, data):
             return HttpResponseForbidden('')
         return HttpResponse('')
 
@@ -73,14 +75,9 @@ class Superuser(View):
         elif hasattr(request, 'DATA'):  # pragma: no cover
             data = request.DATA
 
-        user_model = get_user_model()
-        try:
-            user = user_model.objects.get(username=data.get('username'), is_active=True)
-            if user.is_superuser:
-                return HttpResponse('')
-        except user_model.DoesNotExist:
-            pass
-        return HttpResponseForbidden('')
+        if not measure('superuser', superuser_allowed, data):
+            return HttpResponseForbidden('')
+        return HttpResponse('')
 
 
 class Acl(View):
@@ -105,26 +102,106 @@ class Acl(View):
         elif hasattr(request, 'DATA'):  # pragma: no cover
             data = request.DATA
 
-        user = None
-        users = get_user_model().objects.filter(username=data.get('username'), is_active=True)
-        if users.exists():
-            user = users.latest('pk')
+        if not measure('acl', acl_allowed, data):
+            return HttpResponseForbidden('')
+        return HttpResponse('')
+
 
-        topic = None
-        topics = Topic.objects.filter(name=data.get('topic', '#'))
-        if topics.exists():
-            topic = topics.get()
+class AclBatch(View):
+    http_method_names = ['post', 'head', 'options']
+
+    @csrf_exempt
+    def dispatch(self, *args, **kwargs):
+        return super(AclBatch, self).dispatch(*args, **kwargs)
+
+    # Fields of each check that must be a string or null
+    STRING_FIELDS = ('username', 'topic', 'clientid')
 
-        clientid = None
-        clientids = ClientId.objects.filter(name=data.get('clientid'))
-        if clientids.exists():
-            clientid = clientids.get()
+    def is_valid_check(self, check):
+        return isinstance(check, dict) and all(isinstance(check.get(field), (str, type(None)))
+                                               for field in self.STRING_FIELDS) and \
+            get_acc(check) in dict(PROTO_MQTT_ACC)
 
+    def post(self, request, *args, **kwargs):
+        """ HTTP response 200 with a JSON array of decisions, 400 if the body is not a JSON array of checks
+        Each check is an object with the same fields that the Acl view: username, topic, acc and clientid, username,
+        topic and clientid must be strings or null, acc one of PROTO_MQTT_ACC as number or string
+        see function django_mqtt.mosquitto.auth_plugin.auth.has_permission_many
+
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
         try:
-            acc = int(data.get('acc', None))
-        except (TypeError, ValueError):
-            acc = None
+            data = json.loads(request.body.decode('utf-8'))
+        except ValueError:
+            return HttpResponseBadRequest('')
+        if not isinstance(data, list) or not all(self.is_valid_check(check) for check in data):
+            return HttpResponseBadRequest('')
+
+        checks = [(check.get('username'), check.get('topic', '#'), get_acc(check), check.get('clientid'))
+                  for check in data]
+        return JsonResponse(has_permission_many(checks), safe=False)
+
+
+class Metrics(View):
+    http_method_names = ['get', 'head', 'options']
 
-        if not has_permission(user, topic, acc=acc, clientid=clientid):
+    def get(self, request, *args, **kwargs):
+        """ HTTP response 200 with the metrics on the Prometheus text format, 404 without MQTT_METRICS and 403 for the
+        clients out of MQTT_METRICS_ALLOWED_IPS
+
+        :param request:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        collector = get_collector()
+        if collector is None:
+            return HttpResponseNotFound('')
+        if request.META.get('REMOTE_ADDR') not in getattr(settings, 'MQTT_METRICS_ALLOWED_IPS', ['127.0.0.1', '::1']):
+            return HttpResponseForbidden('')
+        return HttpResponse(''.join(generate_text(collector)), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def async_decision_view(decision, get_key=None, endpoint=None):
+    """ Async view of the decision of an endpoint, HTTP response 200 to allow, 403 in other case
+    The decision runs in the thread of the database connection, so under ASGI the pending checks wait in the event
+    loop instead of holding a thread each. With MQTT_ACL_SINGLE_FLIGHT the concurrent requests with the same key are
+    served by one decision.
+
+    :param decision: function of the posted data that returns the decision, like auth.acl_allowed
+    :param get_key: function of the posted data that returns the fields used by decision
+    :param endpoint: label of the endpoint on the metrics
+    :return: async view
+    """
+    async def view(request, *args, **kwargs):
+        if request.method != 'POST':
+            return HttpResponseNotAllowed(['POST'])
+        resolve = sync_to_async(partial(measure, endpoint, decision), thread_sensitive=True)
+        if get_key is not None and getattr(settings, 'MQTT_ACL_SINGLE_FLIGHT', False):
+            allow = await async_flight.ado(get_key(request.POST), resolve, request.POST)
+        else:
+            allow = await resolve(request.POST)
+        if not allow:
             return HttpResponseForbidden('')
         return HttpResponse('')
+    view.csrf_exempt = True
+    return view
+
+
+def get_acl_key(data):
+    return 'acl', data.get('username'), data.get('topic', '#'), get_acc(data), data.get('clientid')
+
+
+def get_superuser_key(data):
+    return 'superuser', data.get('username')
+
+
+# Concurrent requests of the async views, the auth ones are not coalesced because their key has the password
+async_flight = SingleFlight('async')
+
+async_auth = async_decision_view(auth_allowed, endpoint='auth')
+async_superuser = async_decision_view(superuser_allowed, get_superuser_key, endpoint='superuser')
+async_acl = async_decision_view(acl_allowed, get_acl_key, endpoint='acl')
@@ -0,0 +1,316 @@
+"""
+Compile the ACLs, topics, users and groups into the mosquitto acl_file format and into a dynamic security plugin
+document, so the broker could resolve the checks by itself. The output is generated by chunks and written atomically,
+the broker could reload the file at any moment.
+"""
+import json
+import os
+import tempfile
+from itertools import zip_longest
+
+from django.conf import settings
+from django.db import transaction
+
+from django_mqtt.metrics import unmeasured
+from django_mqtt.models import PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS
+from django_mqtt.policy import Policy
+from django_mqtt.protocol import (
+    TOPIC_BEGINNING_DOLLAR,
+    TOPIC_SEP,
+    WILDCARD_MULTI_LEVEL,
+    WILDCARD_SINGLE_LEVEL,
+    TopicTrie,
+    topic_specificity
+)
+
+FORMAT_ACL_FILE = 'acl_file'
+FORMAT_DYNSEC = 'dynsec'
+FORMATS = (FORMAT_ACL_FILE, FORMAT_DYNSEC)
+
+ACCS = (PROTO_MQTT_ACC_SUS, PROTO_MQTT_ACC_PUB)
+ACL_FILE_ACCESS = {PROTO_MQTT_ACC_SUS: 'read', PROTO_MQTT_ACC_PUB: 'write'}
+DYNSEC_ACLTYPE = {PROTO_MQTT_ACC_SUS: 'subscribePattern', PROTO_MQTT_ACC_PUB: 'publishClientSend'}
+DYNSEC_ROLE_PREFIX = 'django_mqtt'
+DYNSEC_ANONYMOUS = '%s.anonymous' % DYNSEC_ROLE_PREFIX
+DYNSEC_SUPERUSER = '%s.superuser' % DYNSEC_ROLE_PREFIX
+DOLLAR_LEVELS = ('%sSYS' % TOPIC_BEGINNING_DOLLAR, )
+
+
+def filters_overlap(first, second):
+    """
+    :return: If any topic name is contained by both topic filters
+    :rtype: bool
+    """
+    wildcards = (WILDCARD_SINGLE_LEVEL, WILDCARD_MULTI_LEVEL)
+    dollar = first.startswith(TOPIC_BEGINNING_DOLLAR) or second.startswith(TOPIC_BEGINNING_DOLLAR)
+    for index, (part, compare) in enumerate(zip_longest(first.split(TOPIC_SEP), second.split(TOPIC_SEP))):
+        if index == 0 and dollar and (part in wildcards or compare in wildcards):
+            return False
+        if part == WILDCARD_MULTI_LEVEL or compare == WILDCARD_MULTI_LEVEL:
+            return True
+        if part is None or compare is None:
+            return False
+        if part != compare and part != WILDCARD_SINGLE_LEVEL and compare != WILDCARD_SINGLE_LEVEL:
+            return False
+    return True
+
+
+class PolicyCompiler(object):
+    """
+    Decisions of a Policy for the rules of each acc and the broadcast filters, sorted like ACL.get_acl resolves them:
+    the filters without wildcards first, then the most specific ones and the equally specific ones by the pk of their
+    rules. The broadcast filters without a rule of the acc are resolved by the default rule after all of them.
+    The users that are principals of the same rules get the same decisions, they are compiled once.
+    """
+
+    def __init__(self, policy):
+        self.policy = policy
+        topics = {rule.topic for rule in policy.rules.values()}
+        # The wildcards do not match the topics starting with $, the default rule is repeated for each of them
+        levels = {name.split(TOPIC_SEP, 1)[0] for name in topics if name.startswith(TOPIC_BEGINNING_DOLLAR)}
+        self.broadcast = [WILDCARD_MULTI_LEVEL] + ['%s%s%s' % (level, TOPIC_SEP, WILDCARD_MULTI_LEVEL)
+                                                   for level in sorted(levels | set(DOLLAR_LEVELS))]
+        self.filters = sorted(topics | set(self.broadcast), key=lambda name: self.get_order(name, ACCS))
+        self.rules = {}
+        self.defaults = {}
+        self.priorities = {}
+        for acc in ACCS:
+            self.rules[acc] = sorted((rule for rule in policy.rules.values() if rule.acc == acc),
+                                     key=lambda rule: (rule.specificity, rule.pk))
+            self.defaults[acc] = [name for name in self.broadcast if policy.get_rule(name, acc) is None]
+            names = [rule.topic for rule in self.rules[acc]] + self.defaults[acc]
+            self.priorities[acc] = {name: len(names) - index for index, name in enumerate(names)}
+        self.principal_rules = [rule for rule in policy.rules.values()
+                                if rule.users or rule.groups or rule.has_password]
+        self.decisions = {}
+
+    def get_order(self, name, accs):
+        """
+        :return: Sort key of the topic filter, the equally specific filters by the lowest pk of their rules of accs and
+        the filters without rules after them. It sorts the lines of the acl_file.
+        """
+        pks = [rule.pk for rule in (self.policy.get_rule(name, acc) for acc in accs) if rule is not None]
+        return topic_specificity(name), not pks, min(pks, default=0), name
+
+    def get_users(self):
+        """
+        :return: The active users sorted by username
+        :rtype: list[django_mqtt.policy.PolicyUser]
+        """
+        return [user for name, user in sorted(self.policy.users.items()) if user.is_active]
+
+    def get_signature(self, user):
+        """
+        :param user: PolicyUser or None for the anonymous
+        :return: Key of the users with the same decisions
+        """
+        if user is None:
+            return None
+        if user.is_superuser:
+            return True
+        return frozenset(rule.pk for rule in self.principal_rules if self.policy.is_member(rule, user))
+
+    def get_decisions(self, user):
+        """
+        The rules are resolved by Policy.rule_permission and the broadcast filters by Policy.get_default, like
+        Policy.has_permission does for the topics without an exact or wildcard rule. They are not recorded on the
+        metrics of the requests.
+
+        :param user: PolicyUser or None for the anonymous
+        :return: list of (topic filter, allow) in the resolution order by acc
+        :rtype: dict
+        """
+        signature = self.get_signature(user)
+        if signature not in self.decisions:
+            with unmeasured():
+                self.decisions[signature] = self.resolve_decisions(user)
+        return self.decisions[signature]
+
+    def resolve_decisions(self, user):
+        allow, checked = self.policy.get_settings_permission(user)
+        decisions = {}
+        for acc in ACCS:
+            if not checked:
+                decisions[acc] = [(name, allow) for name in self.broadcast]
+                continue
+            default = self.policy.get_default(acc, user=user)
+            decisions[acc] = [(rule.topic, self.policy.rule_permission(rule, user)) for rule in self.rules[acc]]
+            decisions[acc].extend((name, default) for name in self.defaults[acc])
+        return decisions
+
+
+def get_acl_file_lines(decisions, filters):
+    """
+    mosquitto checks all the denials of a user first and then allows any matching rule, without order, and a denial
+    applies to both accesses. An access is allowed on the filters where it is. A filter without allowed accesses is
+    denied when a less specific allowed filter of its accs overlaps it, unless the denial would deny an overlapped
+    allowed filter more specific than it, or of an acc without a rule on it.
+
+    :param decisions: from PolicyCompiler.get_decisions
+    :param filters: PolicyCompiler.filters, the order of the lines
+    :return: topic lines
+    """
+    positions = {}
+    allowed_index = {}
+    for acc in ACCS:
+        positions[acc] = {}
+        allowed_index[acc] = TopicTrie()
+        for index, (name, allow) in enumerate(decisions[acc]):
+            positions[acc][name] = index
+            if allow:
+                allowed_index[acc].add(name, index)
+    for name in filters:
+        accs = [acc for acc in ACCS if name in positions[acc]]
+        allowed = [acc for acc in accs if decisions[acc][positions[acc][name]][1]]
+        if allowed:
+            access = 'readwrite' if len(allowed) == len(ACCS) else ACL_FILE_ACCESS[allowed[0]]
+            yield 'topic %s %s\n' % (access, name)
+            continue
+        if not accs:
+            continue
+        # Positions of the allowed filters of each acc that overlap it
+        overlapped = {acc: allowed_index[acc].overlap(name) for acc in ACCS}
+        if not any(index > positions[acc][name] for acc in accs for index in overlapped[acc]):
+            continue
+        if any(index < positions[acc].get(name, len(decisions[acc])) for acc in ACCS for index in overlapped[acc]):
+            continue
+        yield 'topic deny %s\n' % name
+
+
+def generate_acl_file(policy):
+    """
+    :param policy:
+    :type policy: Policy
+    :return: chunks of the mosquitto acl_file of the policy, the first section is for the anonymous clients and there
+    is one user section for each active user
+    """
+    compiler = PolicyCompiler(policy)
+    yield '# Generated by django_mqtt, the changes will be overwritten\n'
+    for line in get_acl_file_lines(compiler.get_decisions(None), compiler.filters):
+        yield line
+    # Topic lines by signature, the users with the same decisions get the same lines
+    sections = {True: ''.join('topic readwrite %s\n' % name for name in compiler.broadcast)}
+    for user in compiler.get_users():
+        signature = compiler.get_signature(user)
+        if signature not in sections:
+            sections[signature] = ''.join(get_acl_file_lines(compiler.get_decisions(user), compiler.filters))
+        yield '\nuser %s\n%s' % (user.username, sections[signature])
+
+
+def get_dynsec_acls(decisions, priorities):
+    """
+    The dynamic security plugin applies the first matching ACL by priority, so every decision is kept with the
+    priority of its resolution order for its acc.
+
+    :param decisions: from PolicyCompiler.get_decisions
+    :param priorities: PolicyCompiler.priorities
+    :return: ACL list of a role
+    """
+    acls = []
+    for acc in ACCS:
+        for name, allow in decisions[acc]:
+            acls.append({'acltype': DYNSEC_ACLTYPE[acc], 'topic': name, 'priority': priorities[acc][name],
+                         'allow': allow})
+    return acls
+
+
+def generate_dynsec(policy):
+    """
+    :param policy:
+    :type policy: Policy
+    :return: chunks of the JSON document of the mosquitto dynamic security plugin of the policy, with a client for each
+    active user and a role for each set of users with the same decisions. The passwords are not exported.
+    """
+    compiler = PolicyCompiler(policy)
+    default_access = {'publishClientSend': False, 'publishClientReceive': True, 'subscribe': False,
+                      'unsubscribe': True}
+    yield '{"defaultACLAccess": %s,\n"clients": [' % json.dumps(default_access)
+    roles = {}
+    separator = '\n'
+    for user in compiler.get_users():
+        signature = compiler.get_signature(user)
+        if signature not in roles:
+            roles[signature] = (DYNSEC_SUPERUSER if signature is True else
+                                '%s.%d' % (DYNSEC_ROLE_PREFIX, len(roles)), user)
+        client = {'username': user.username, 'roles': [{'rolename': roles[signature][0]}]}
+        yield separator + json.dumps(client, sort_keys=True)
+        separator = ',\n'
+
+    anonymous = compiler.get_decisions(None)
+    if any(allow for acc in ACCS for name, allow in anonymous[acc]):
+        roles[None] = (DYNSEC_ANONYMOUS, None)
+        group = {'groupname': DYNSEC_ANONYMOUS, 'roles': [{'rolename': DYNSEC_ANONYMOUS}], 'clients': []}
+        yield '],\n"groups": [\n%s],\n"anonymousGroup": %s,\n"roles": [' % (
+            json.dumps(group, sort_keys=True), json.dumps(DYNSEC_ANONYMOUS))
+    else:
+        yield '],\n"groups": [],\n"roles": ['
+    separator = '\n'
+    for signature, (rolename, user) in roles.items():
+        if signature is True:
+            acls = [{'acltype': acltype, 'topic': name, 'priority': 0, 'allow': True}
+                    for name in compiler.broadcast for acltype in DYNSEC_ACLTYPE.values()]
+        else:
+            acls = get_dynsec_acls(compiler.get_decisions(user), compiler.priorities)
+        yield separator + json.dumps({'rolename': rolename, 'acls': acls}, sort_keys=True)
+        separator = ',\n'
+    yield ']}\n'
+
+
+GENERATORS = {FORMAT_ACL_FILE: generate_acl_file, FORMAT_DYNSEC: generate_dynsec}
+
+
+def write_chunks(chunks, path):
+    """
+    Write the chunks on path atomically, the broker never reads a partial file
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.%s.' % os.path.basename(path))
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as tmp:
+            for chunk in chunks:
+                tmp.write(chunk)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+def export_policy(path, export_format=FORMAT_ACL_FILE, policy=None):
+    """
+    :param path: output file, replaced atomically
+    :param export_format: one of FORMATS
+    :param policy: Policy.build by default
+    """
+    if policy is None:
+        policy = Policy.build()
+    write_chunks(GENERATORS[export_format](policy), path)
+
+
+def export_files():
+    """
+    Write MQTT_MOSQUITTO_ACL_FILE and MQTT_MOSQUITTO_DYNSEC_FILE from the same policy, if they are set
+    """
+    paths = [(getattr(settings, 'MQTT_MOSQUITTO_ACL_FILE', None), FORMAT_ACL_FILE),
+             (getattr(settings, 'MQTT_MOSQUITTO_DYNSEC_FILE', None), FORMAT_DYNSEC)]
+    paths = [(path, export_format) for path, export_format in paths if path]
+    if not paths:
+        return
+    policy = Policy.build()
+    for path, export_format in paths:
+        export_policy(path, export_format, policy=policy)
+
+
+def export_on_change(sender, **kwargs):
+    """
+    Rewrite the exported files once after the transaction of the changes is committed
+    """
+    if not getattr(settings, 'MQTT_MOSQUITTO_ACL_FILE', None) and \
+            not getattr(settings, 'MQTT_MOSQUITTO_DYNSEC_FILE', None):
+        return
+    connection = transaction.get_connection()
+    if any(callback[1] is export_files for callback in connection.run_on_commit):
+        return
+    transaction.on_commit(export_files)
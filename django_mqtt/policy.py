@@ -0,0 +1,641 @@
+import threading
+import time
+from collections import defaultdict, namedtuple
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.db.models import Q
+from django.dispatch import receiver
+
+from django_mqtt.cache import LRUCache, clear_caches, clear_users
+from django_mqtt.metrics import count_default
+from django_mqtt.models import (
+    ACL,
+    CHANGE_ACL,
+    CHANGE_ALL,
+    CHANGE_CLIENTID,
+    CHANGE_GROUP,
+    CHANGE_TOPIC,
+    CHANGE_USER,
+    PROTO_MQTT_ACC,
+    ACLChange,
+    ClientId,
+    PolicyVersion,
+    Topic
+)
+from django_mqtt.protocol import (
+    WILDCARD_MULTI_LEVEL,
+    WILDCARD_SINGLE_LEVEL,
+    TopicTrie,
+    topic_digest,
+    topic_specificity
+)
+from django_mqtt.signals import acl_changed
+
+PolicyUser = namedtuple('PolicyUser', ['pk', 'username', 'is_active', 'is_superuser', 'groups'])
+PolicyRule = namedtuple('PolicyRule', ['pk', 'topic', 'acc', 'allow', 'users', 'groups', 'has_password',
+                                       'specificity'])
+PolicyClientId = namedtuple('PolicyClientId', ['pk', 'name', 'users', 'groups'])
+
+
+class Policy(object):
+    """
+    Snapshot of the ACLs with its topics, users and groups, it resolves the checks without any query.
+    It is kept up to date applying the ACLChange entries after seq on a copy, a snapshot in use is never modified.
+
+    :var version: PolicyVersion.version when the snapshot was built
+    :var seq: Last ACLChange.seq applied
+    :var created: ACLChange.created of seq, to detect that the log was reset
+    :var users: PolicyUser by username
+    :var rules: PolicyRule by (topic name, acc)
+    :var wildcards: TopicTrie of the wildcard PolicyRule by acc
+    :var clientids: PolicyClientId by name, only the ones with users or groups
+    :var with_users: If the users are loaded, the snapshots without them are shared by the users of get_user_policy
+    """
+    with_users = True
+
+    def __init__(self, version, users, rules, seq=0, created=None, clientids=None):
+        self.version = version
+        self.seq = seq
+        self.created = created
+        self.gaps = {}
+        self.users = users
+        self.clientids = clientids or {}
+        self.rules = {}
+        self.wildcards = {}
+        for rule in rules:
+            self.add_rule(rule)
+
+    def add_rule(self, rule):
+        self.rules[(rule.topic, rule.acc)] = rule
+        if WILDCARD_MULTI_LEVEL in rule.topic or WILDCARD_SINGLE_LEVEL in rule.topic:
+            if rule.acc not in self.wildcards:
+                self.wildcards[rule.acc] = TopicTrie()
+            self.wildcards[rule.acc].add(rule.topic, rule)
+
+    def remove_rule(self, rule):
+        if self.rules.get((rule.topic, rule.acc)) is rule:
+            del self.rules[(rule.topic, rule.acc)]
+        if rule.acc in self.wildcards:
+            self.wildcards[rule.acc].remove(rule.topic, rule)
+
+    @staticmethod
+    def load_users(pks=None, usernames=None):
+        """
+        :param pks: Load only these users
+        :param usernames: Load only the users with these usernames
+        :return: PolicyUser by username
+        """
+        user_model = get_user_model()
+        user_groups = user_model.groups.field
+        memberships = user_groups.remote_field.through.objects.all()
+        users = user_model.objects.all()
+        if pks is not None:
+            memberships = memberships.filter(**{'%s__in' % user_groups.m2m_field_name(): pks})
+            users = users.filter(pk__in=pks)
+        if usernames is not None:
+            memberships = memberships.filter(**{'%s__%s__in' % (user_groups.m2m_field_name(),
+                                                                user_model.USERNAME_FIELD): usernames})
+            users = users.filter(**{'%s__in' % user_model.USERNAME_FIELD: usernames})
+
+        groups = defaultdict(set)
+        for user_pk, group_pk in memberships.values_list(user_groups.m2m_field_name(),
+                                                         user_groups.m2m_reverse_field_name()):
+            groups[user_pk].add(group_pk)
+        return {
+            username: PolicyUser(pk, username, is_active, is_superuser, frozenset(groups.get(pk, ())))
+            for pk, username, is_active, is_superuser in users.values_list(
+                'pk', user_model.USERNAME_FIELD, 'is_active', 'is_superuser')
+        }
+
+    @staticmethod
+    def load_rules(acls=None):
+        """
+        :param acls: Load only the rules of this ACL queryset
+        :return: PolicyRule list
+        """
+        acl_users = ACL.users.field
+        acl_groups = ACL.groups.field
+        user_principals = acl_users.remote_field.through.objects.all()
+        group_principals = acl_groups.remote_field.through.objects.all()
+        if acls is None:
+            acls = ACL.objects.all()
+        else:
+            user_principals = user_principals.filter(**{'%s__in' % acl_users.m2m_field_name(): acls})
+            group_principals = group_principals.filter(**{'%s__in' % acl_groups.m2m_field_name(): acls})
+
+        users = defaultdict(set)
+        for acl_pk, user_pk in user_principals.values_list(acl_users.m2m_field_name(),
+                                                           acl_users.m2m_reverse_field_name()):
+            users[acl_pk].add(user_pk)
+        groups = defaultdict(set)
+        for acl_pk, group_pk in group_principals.values_list(acl_groups.m2m_field_name(),
+                                                             acl_groups.m2m_reverse_field_name()):
+            groups[acl_pk].add(group_pk)
+        return [
+            PolicyRule(pk, name, acc, allow, frozenset(users.get(pk, ())), frozenset(groups.get(pk, ())),
+                       bool(password), topic_specificity(name))
+            for pk, name, acc, allow, password in acls.values_list('pk', 'topic__name', 'acc', 'allow', 'password')
+        ]
+
+    @staticmethod
+    def load_clientids(names=None, pks=None):
+        """
+        :param names: Load only the client ids with these names
+        :param pks: Load only these client ids
+        :return: PolicyClientId by name of the client ids with users or groups, the others could be used by anyone
+        """
+        clientid_users = ClientId.users.field
+        clientid_groups = ClientId.groups.field
+        user_principals = clientid_users.remote_field.through.objects.all()
+        group_principals = clientid_groups.remote_field.through.objects.all()
+        if names is not None:
+            user_principals = user_principals.filter(**{'%s__name__in' % clientid_users.m2m_field_name(): names})
+            group_principals = group_principals.filter(**{'%s__name__in' % clientid_groups.m2m_field_name(): names})
+        if pks is not None:
+            user_principals = user_principals.filter(**{'%s__in' % clientid_users.m2m_field_name(): pks})
+            group_principals = group_principals.filter(**{'%s__in' % clientid_groups.m2m_field_name(): pks})
+
+        clientids = {}
+        users = defaultdict(set)
+        for clientid_pk, name, user_pk in user_principals.values_list(
+                clientid_users.m2m_field_name(), '%s__name' % clientid_users.m2m_field_name(),
+                clientid_users.m2m_reverse_field_name()):
+            clientids[clientid_pk] = name
+            users[clientid_pk].add(user_pk)
+        groups = defaultdict(set)
+        for clientid_pk, name, group_pk in group_principals.values_list(
+                clientid_groups.m2m_field_name(), '%s__name' % clientid_groups.m2m_field_name(),
+                clientid_groups.m2m_reverse_field_name()):
+            clientids[clientid_pk] = name
+            groups[clientid_pk].add(group_pk)
+        return {
+            name: PolicyClientId(pk, name, frozenset(users.get(pk, ())), frozenset(groups.get(pk, ())))
+            for pk, name in clientids.items()
+        }
+
+    @classmethod
+    def build(cls, with_users=True):
+        """
+        :param with_users: Load the users too
+        """
+        with transaction.atomic():
+            version = PolicyVersion.get_version()
+            last = ACLChange.objects.order_by('-seq').values_list('seq', 'created').first() or (0, None)
+            users = cls.load_users() if with_users else {}
+            rules = cls.load_rules()
+            clientids = cls.load_clientids()
+        policy = cls(version, users, rules, seq=last[0], created=last[1], clientids=clientids)
+        policy.with_users = with_users
+        return policy
+
+    @classmethod
+    def build_partial(cls, usernames, topics, clientids=()):
+        """
+        :param usernames:
+        :param topics: topic names
+        :param clientids: client id names
+        :return: Snapshot with only the users, rules and client ids needed to resolve the checks of usernames on topics
+        with clientids
+        """
+        digests = [topic_digest(topic) for topic in topics]
+        with transaction.atomic():
+            users = cls.load_users(usernames=usernames)
+            rules = cls.load_rules(ACL.objects.filter(Q(topic__name_hash__in=digests) | Q(topic__wildcard=True)))
+            clientids = cls.load_clientids(names=clientids) if clientids else {}
+        return cls(None, users, rules, clientids=clientids)
+
+    def copy(self):
+        """
+        :return: Snapshot with copies of the mappings and indexes of this one, the users and rules are shared
+        :rtype: Policy
+        """
+        policy = Policy(self.version, dict(self.users), (), seq=self.seq, created=self.created,
+                        clientids=dict(self.clientids))
+        policy.with_users = self.with_users
+        policy.gaps = dict(self.gaps)
+        policy.rules = dict(self.rules)
+        policy.wildcards = {acc: trie.copy() for acc, trie in self.wildcards.items()}
+        return policy
+
+    def get_changes(self, limit=None):
+        """
+        :param limit: Max number of changes returned
+        :return: (seq, model, object_id, created) of the ACLChange entries not applied yet, including the ones that
+        were not committed yet when a later one was applied. None if the last one applied is not in the log anymore,
+        the log was compacted, reset or rolled back, so the changes could not be known.
+        """
+        changes = ACLChange.objects.filter(Q(seq__gte=self.seq) | Q(seq__in=list(self.gaps)))
+        changes = changes.order_by('seq').values_list('seq', 'model', 'object_id', 'created')
+        if limit is not None:
+            changes = changes[:limit + 1]
+        pending = []
+        anchor = None
+        for change in changes:
+            if change[0] == self.seq:
+                anchor = change[3]
+            else:
+                pending.append(change)
+        if self.seq and anchor != self.created:
+            return None
+        return pending
+
+    def apply_changes(self, changes, gap_timeout=60):
+        """
+        Reload the users and rules of the changes in place, only on a copy that is not in use yet
+        :param changes: from get_changes
+        :param gap_timeout: Seconds waiting for a missing seq, the transaction could have been rolled back
+        :return: False if the changes could not be applied and the policy must be rebuilt
+        """
+        changed = defaultdict(set)
+        for seq, model, object_id, created in changes:
+            if model == CHANGE_ALL:
+                return False
+            changed[model].add(object_id)
+        users = changed[CHANGE_USER]
+        groups = changed[CHANGE_GROUP]
+        acls = changed[CHANGE_ACL]
+        clientids = changed[CHANGE_CLIENTID]
+        if groups:
+            users |= {user.pk for user in self.users.values() if user.groups & groups}
+        if users or groups:
+            acls |= {rule.pk for rule in self.rules.values() if rule.users & users or rule.groups & groups}
+            clientids |= {clientid.pk for clientid in self.clientids.values()
+                          if clientid.users & users or clientid.groups & groups}
+        loaded_users = {}
+        loaded_rules = []
+        loaded_clientids = {}
+        if users or acls or changed[CHANGE_TOPIC] or clientids:
+            with transaction.atomic():
+                if self.with_users:
+                    loaded_users = self.load_users(pks=users)
+                topics = changed[CHANGE_TOPIC]
+                loaded_rules = self.load_rules(ACL.objects.filter(Q(pk__in=acls) | Q(topic__in=topics)))
+                loaded_clientids = self.load_clientids(pks=clientids) if clientids else {}
+
+        if clientids:
+            for name, clientid in list(self.clientids.items()):
+                if clientid.pk in clientids:
+                    del self.clientids[name]
+            self.clientids.update(loaded_clientids)
+
+        if users:
+            for username, user in list(self.users.items()):
+                if user.pk in users:
+                    del self.users[username]
+            self.users.update(loaded_users)
+        acls |= {rule.pk for rule in loaded_rules}
+        for rule in list(self.rules.values()):
+            if rule.pk in acls:
+                self.remove_rule(rule)
+        for rule in loaded_rules:
+            self.add_rule(rule)
+
+        now = time.monotonic()
+        received = {change[0] for change in changes}
+        last = max(changes) if changes else None
+        if last is not None and last[0] > self.seq:
+            for seq in range(self.seq + 1, last[0]):
+                if seq not in received:
+                    self.gaps[seq] = now
+            self.seq, self.created = last[0], last[3]
+        for seq, seen in list(self.gaps.items()):
+            if seq in received or now - seen > gap_timeout:
+                del self.gaps[seq]
+        return True
+
+    def get_user(self, username, active=False):
+        """
+        :param username:
+        :param active: return None for the inactive users
+        :rtype: PolicyUser|None
+        """
+        user = self.users.get(username)
+        if user is not None and active and not user.is_active:
+            return None
+        return user
+
+    def get_rule(self, topic, acc):
+        """
+        :return: The rule of the topic filter, without wildcard matching
+        :rtype: PolicyRule|None
+        """
+        return self.rules.get((topic, acc))
+
+    def get_acl(self, topic, acc):
+        """
+        Same as ACL.get_acl
+        :rtype: PolicyRule|None
+        """
+        rule = self.get_rule(topic, acc)
+        if rule is None and acc in self.wildcards:
+            candidates = self.wildcards[acc].match(topic)
+            if candidates:
+                rule = min(candidates, key=lambda candidate: (candidate.specificity, candidate.pk))
+        return rule
+
+    def is_member(self, rule, user):
+        """
+        :param rule: PolicyRule or PolicyClientId
+        """
+        return user.pk in rule.users or bool(user.groups & rule.groups)
+
+    def get_clientid(self, name):
+        """
+        :return: The client id if it has users or groups
+        :rtype: PolicyClientId|None
+        """
+        return self.clientids.get(name)
+
+    def is_clientid_allowed(self, user, clientid):
+        """
+        Same as django_mqtt.mosquitto.auth_plugin.auth.is_clientid_allowed
+
+        :param user: user from Policy.get_user
+        :type user: PolicyUser|None
+        :param clientid: client id or its name
+        :type clientid: django_mqtt.models.ClientId|str|None
+        :rtype: bool
+        """
+        if isinstance(clientid, ClientId):
+            clientid = clientid.name
+        if clientid is None:
+            return True
+        principals = self.get_clientid(clientid)
+        return principals is None or (user is not None and self.is_member(principals, user))
+
+    def rule_permission(self, rule, user):
+        """
+        Same as ACL.has_permission without password
+        """
+        if not rule.users and not rule.groups and not rule.has_password:
+            return rule.allow
+        if user is None:
+            return False
+        if self.is_member(rule, user):
+            return rule.allow
+        return not rule.allow
+
+    def get_default(self, acc, user=None):
+        """
+        Same as ACL.get_default without password
+        """
+        allow = False
+        if hasattr(settings, 'MQTT_ACL_ALLOW'):
+            allow = settings.MQTT_ACL_ALLOW
+        if hasattr(settings, 'MQTT_ACL_ALLOW_ANONIMOUS'):
+            if user is None:
+                allow = settings.MQTT_ACL_ALLOW_ANONIMOUS & allow
+                if not allow:
+                    return allow
+        rule = self.get_rule(WILDCARD_MULTI_LEVEL, acc)
+        if rule is not None:
+            allow = self.rule_permission(rule, user)
+        return allow
+
+    def get_settings_permission(self, user):
+        """
+        :param user: user from Policy.get_user
+        :type user: PolicyUser|None
+        :return: (decision of the settings, if the rules must be checked) of any check of user
+        :rtype: (bool, bool)
+        """
+        allow = False
+        if hasattr(settings, 'MQTT_ACL_ALLOW'):
+            allow = settings.MQTT_ACL_ALLOW
+        if hasattr(settings, 'MQTT_ACL_ALLOW_ANONIMOUS'):
+            if user is None:
+                allow = settings.MQTT_ACL_ALLOW_ANONIMOUS & allow
+                if not allow:
+                    return allow, False
+
+        if user and not user.is_active:
+            return allow, False
+        return allow, True
+
+    def has_permission(self, user, topic, acc=None):
+        """
+        Same as django_mqtt.mosquitto.auth_plugin.auth.has_permission
+
+        :param user: user from Policy.get_user
+        :type user: PolicyUser|None
+        :param topic: topic name
+        :type topic: str|bytes|django_mqtt.models.Topic
+        :param acc:
+        :type acc: int
+        :rtype: bool
+        """
+        allow, checked = self.get_settings_permission(user)
+        if not checked:
+            return allow
+
+        if isinstance(topic, Topic):
+            topic = topic.name
+        elif isinstance(topic, bytes):
+            topic = topic.decode()
+        if acc not in dict(PROTO_MQTT_ACC).keys():
+            acc = None
+
+        rule = None
+        if acc and topic:
+            rule = self.get_acl(topic, acc)
+        if rule is not None:
+            return self.rule_permission(rule, user)
+        count_default()
+        return self.get_default(acc, user=user)
+
+
+def clear_changed(changes):
+    """
+    Clear the caches of the process for the ACLChange entries changes, only the keys of the changed users if all of
+    them are user changes
+    :param changes: (seq, model, object_id, ...) of the entries
+    """
+    if all(change[1] == CHANGE_USER for change in changes):
+        clear_users({change[2] for change in changes})
+    else:
+        clear_caches()
+
+
+def clear_changed_since(seq):
+    """
+    Clear the caches for the ACLChange entries after seq with clear_changed. Everything is cleared if there are not
+    entries or ACLChange.get_since could not read them.
+    :param seq: Last ACLChange.seq seen
+    :return: Last ACLChange.seq seen now
+    """
+    changes = ACLChange.get_since(seq, limit=getattr(settings, 'MQTT_ACL_POLICY_DELTA_LIMIT', 1000))
+    if changes:
+        clear_changed(changes)
+        return changes[-1][0]
+    clear_caches()
+    return ACLChange.get_last_seq()
+
+
+def update_policy(policy):
+    """
+    Apply the pending ACLChange entries on a copy of policy, policy could be read by other threads meanwhile
+    :return: The updated copy, policy if there is nothing to apply, or None if there are more than
+    MQTT_ACL_POLICY_DELTA_LIMIT changes or they could not be applied
+    :rtype: Policy|None
+    """
+    limit = getattr(settings, 'MQTT_ACL_POLICY_DELTA_LIMIT', 1000)
+    changes = policy.get_changes(limit=limit + 1)
+    if changes is None or len(changes) > limit:
+        return None
+    if not changes and not policy.gaps:
+        return policy
+    if changes:
+        clear_changed(changes)
+    updated = policy.copy()
+    if not updated.apply_changes(changes):
+        return None
+    return updated
+
+
+def refresh_policy(policy, with_users=True):
+    """
+    :return: policy updated by update_policy, or built again if it could not be updated
+    :rtype: Policy
+    """
+    updated = update_policy(policy) if policy is not None else None
+    if updated is None:
+        if policy is not None:
+            clear_caches()
+        updated = Policy.build(with_users=with_users)
+    return updated
+
+
+_policy = None
+_checked = 0
+_version = None
+_version_checked = 0
+# Last version polled and last ACLChange.seq seen then, the caches are cleared when it changes, see get_policy_version
+_seen_version = None
+_seen_seq = None
+# Snapshot without users shared by the users of get_user_policy
+_rules_policy = None
+_rules_checked = 0
+_rules_stale = False
+# PolicyUser by user pk, see get_user_policy
+user_policies = LRUCache('MQTT_USER_POLICY_CACHE_SIZE', 'MQTT_USER_POLICY_CACHE_TIMEOUT', timeout=None,
+                         name='user_policy', user_key=lambda pk: pk)
+_stale = False
+_lock = threading.Lock()
+
+
+def get_policy():
+    """
+    :return: The current policy snapshot if MQTT_ACL_POLICY is enabled, it is swapped by a copy with the pending
+    ACLChange entries applied, or with MQTT_ACL_POLICY_FILE it is mapped again when PolicyVersion changes.
+    The changes are checked at most every MQTT_ACL_POLICY_POLL seconds.
+    :rtype: Policy|None
+    """
+    global _policy, _checked, _stale
+    if not getattr(settings, 'MQTT_ACL_POLICY', False):
+        return None
+    policy = _policy
+    now = time.monotonic()
+    if policy is not None and not _stale and now - _checked < getattr(settings, 'MQTT_ACL_POLICY_POLL', 1):
+        return policy
+    with _lock:
+        if _policy is not policy:
+            return _policy
+        stale, _stale = _stale, False
+        path = getattr(settings, 'MQTT_ACL_POLICY_FILE', None)
+        if path:
+            version = PolicyVersion.get_version()
+            if stale or policy is None or policy.version != version:
+                if policy is not None:
+                    clear_caches()
+                from django_mqtt.policy_file import load_policy
+                policy = load_policy(path, version, force=stale, current=policy)
+        else:
+            policy = refresh_policy(policy)
+        _policy = policy
+        _checked = now
+    return policy
+
+
+def get_policy_version():
+    """
+    Call it before reading any cache of the ACL data, the caches of the process are cleared when the version changes,
+    so the changes of other processes are seen in MQTT_ACL_POLICY_POLL seconds at most. Only the keys of the changed
+    users are discarded if the new ACLChange entries are user changes, see clear_changed_since.
+
+    :return: PolicyVersion.version checked at most every MQTT_ACL_POLICY_POLL seconds, or after any change of this
+    process
+    :rtype: int
+    """
+    global _version, _version_checked, _seen_version, _seen_seq
+    now = time.monotonic()
+    if _version is None or now - _version_checked >= getattr(settings, 'MQTT_ACL_POLICY_POLL', 1):
+        _version, _version_checked = PolicyVersion.get_version(), now
+        if _version != _seen_version:
+            if _seen_version is None:
+                _seen_seq = ACLChange.get_last_seq()
+            else:
+                _seen_seq = clear_changed_since(_seen_seq)
+            _seen_version = _version
+    return _version
+
+
+def get_rules_policy():
+    """
+    :return: The snapshot of the rules and client ids without users, shared by the users of get_user_policy. It is
+    updated like get_policy, the changes are checked at most every MQTT_ACL_POLICY_POLL seconds.
+    :rtype: Policy
+    """
+    global _rules_policy, _rules_checked, _rules_stale
+    policy = _rules_policy
+    now = time.monotonic()
+    if policy is not None and not _rules_stale and now - _rules_checked < getattr(settings, 'MQTT_ACL_POLICY_POLL', 1):
+        return policy
+    with _lock:
+        if _rules_policy is not policy:
+            return _rules_policy
+        _rules_stale = False
+        policy = refresh_policy(policy, with_users=False)
+        _rules_policy, _rules_checked = policy, now
+    return policy
+
+
+def get_user_policy(user):
+    """
+    All the users share the same rules, only the PolicyUser of each user is cached. It is loaded with two queries and
+    it is kept until any ACL data changes, then the users are loaded again on their next check.
+
+    :param user: active user
+    :return: (get_rules_policy, PolicyUser of user) if MQTT_USER_POLICY_CACHE_SIZE is set, None if it is not set or the
+    user does not exist anymore
+    :rtype: (Policy, PolicyUser)|None
+    """
+    if not user_policies.enabled:
+        return None
+    policy = get_rules_policy()
+    policy_user = user_policies.get(user.pk)
+    if policy_user is None or policy_user.username != user.get_username():
+        policy_user = Policy.load_users(pks=[user.pk]).get(user.get_username())
+        if policy_user is None:
+            return None
+        user_policies.set(user.pk, policy_user)
+    return policy, policy_user
+
+
+@receiver(acl_changed)
+def invalidate_policy(sender, **kwargs):
+    global _stale, _rules_stale, _version
+    _stale = True
+    _rules_stale = True
+    _version = None
+
+
+@receiver(setting_changed)
+def reload_policy(setting, **kwargs):
+    global _policy, _rules_policy
+    if setting.startswith('MQTT_ACL_POLICY'):
+        _policy = None
+    if setting.startswith('MQTT_ACL_POLICY') or setting.startswith('MQTT_USER_POLICY'):
+        _rules_policy = None
@@ -0,0 +1,396 @@
+import mmap
+import os
+import struct
+import tempfile
+from collections import namedtuple
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from django_mqtt.policy import Policy, PolicyUser
+from django_mqtt.protocol import (
+    TOPIC_SEP,
+    WILDCARD_MULTI_LEVEL,
+    WILDCARD_SINGLE_LEVEL
+)
+
+MAGIC = b'MQTTACL\x02'
+# magic, version, users offset and count, rules offset and count, nodes offset and count, edges offset,
+# roots offset and count, client ids offset and count, integers offset, strings offset
+HEADER = struct.Struct('<8sqIIIIIIIIIIIII')
+# pk, username offset and length, groups offset and count, flags
+USER = struct.Struct('<qIIIIB3x')
+# pk, topic offset and length, acc, allow, has password, specificity, users offset and count, groups offset and count
+RULE = struct.Struct('<qIIBBBxIIIII')
+# edges offset and count, values offset and count
+NODE = struct.Struct('<IIII')
+# level offset and length, node
+EDGE = struct.Struct('<III')
+# acc, root node
+ROOT = struct.Struct('<II')
+# pk, name offset and length, users offset and count, groups offset and count
+CLIENTID = struct.Struct('<qIIIIII')
+INTEGER = struct.Struct('<q')
+
+USER_ACTIVE = 1
+USER_SUPERUSER = 2
+
+MappedRule = namedtuple('MappedRule', ['pk', 'topic', 'acc', 'allow', 'users', 'groups', 'has_password',
+                                       'specificity'])
+MappedClientId = namedtuple('MappedClientId', ['pk', 'name', 'users', 'groups'])
+
+
+class PolicyFileError(ValueError):
+    pass
+
+
+class PolicyWriter(object):
+    """
+    Serialise a Policy on a compact binary format:
+        - The users sorted by username
+        - The rules sorted by (topic, acc) with the principals as sorted arrays of pk
+        - The TopicTrie of the wildcard rules, with the children of each node sorted by level
+        - The client ids with users or groups sorted by name, with the principals as sorted arrays of pk
+    All the strings are stored only once on a strings pool.
+    """
+
+    def __init__(self, policy):
+        self.policy = policy
+        self.strings = bytearray()
+        self.string_offsets = {}
+        self.integers = []
+
+    def add_string(self, value):
+        data = value.encode('utf-8')
+        if data not in self.string_offsets:
+            self.string_offsets[data] = len(self.strings)
+            self.strings.extend(data)
+        return self.string_offsets[data], len(data)
+
+    def add_integers(self, values):
+        offset = len(self.integers)
+        values = sorted(values)
+        self.integers.extend(values)
+        return offset, len(values)
+
+    def dumps(self):
+        """
+        :rtype: bytes
+        """
+        users = bytearray()
+        for name, user in sorted(self.policy.users.items(), key=lambda item: item[0].encode('utf-8')):
+            flags = (USER_ACTIVE if user.is_active else 0) | (USER_SUPERUSER if user.is_superuser else 0)
+            users.extend(USER.pack(user.pk, *(self.add_string(name) + self.add_integers(user.groups) + (flags,))))
+
+        rules = sorted(self.policy.rules.values(), key=lambda rule: (rule.topic.encode('utf-8'), rule.acc))
+        rule_indexes = {}
+        packed_rules = bytearray()
+        for index, rule in enumerate(rules):
+            rule_indexes[id(rule)] = index
+            topic = self.add_string(rule.topic)
+            packed_rules.extend(RULE.pack(rule.pk, topic[0], topic[1], rule.acc, rule.allow, rule.has_password,
+                                          rule.specificity, *(self.add_integers(rule.users) +
+                                                              self.add_integers(rule.groups))))
+
+        nodes = []
+        edges = []
+        roots = bytearray()
+        for acc, trie in sorted(self.policy.wildcards.items()):
+            roots.extend(ROOT.pack(acc, len(nodes)))
+            pending = [(trie.root, len(nodes))]
+            nodes.append(None)
+            while pending:
+                node, node_index = pending.pop()
+                values = self.add_integers(rule_indexes[id(value)] for value in node.values)
+                children = sorted(node.children.items(), key=lambda item: item[0].encode('utf-8'))
+                nodes[node_index] = NODE.pack(len(edges), len(children), *values)
+                for level, child in children:
+                    edges.append(EDGE.pack(*(self.add_string(level) + (len(nodes),))))
+                    pending.append((child, len(nodes)))
+                    nodes.append(None)
+
+        clientids = bytearray()
+        for name, clientid in sorted(self.policy.clientids.items(), key=lambda item: item[0].encode('utf-8')):
+            clientids.extend(CLIENTID.pack(clientid.pk, *(self.add_string(name) + self.add_integers(clientid.users) +
+                                                          self.add_integers(clientid.groups))))
+
+        sections = [
+            bytes(users),
+            bytes(packed_rules),
+            b''.join(nodes),
+            b''.join(edges),
+            bytes(roots),
+            bytes(clientids),
+            b''.join(INTEGER.pack(value) for value in self.integers),
+            bytes(self.strings),
+        ]
+        offsets = []
+        offset = HEADER.size
+        for section in sections:
+            offsets.append(offset)
+            offset += len(section)
+        header = HEADER.pack(MAGIC, self.policy.version,
+                             offsets[0], len(self.policy.users),
+                             offsets[1], len(rules),
+                             offsets[2], len(nodes),
+                             offsets[3],
+                             offsets[4], len(roots) // ROOT.size,
+                             offsets[5], len(self.policy.clientids),
+                             offsets[6], offsets[7])
+        return header + b''.join(sections)
+
+    def write(self, path):
+        """
+        Write the policy on path atomically, the mapped files are not changed
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.%s.' % os.path.basename(path))
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                tmp.write(self.dumps())
+                tmp.flush()
+                os.fsync(tmp.fileno())
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.unlink(tmp_path)
+            raise
+
+
+class MappedPolicy(Policy):
+    """
+    Policy that resolves the lookups directly on a memory mapped file written by PolicyWriter.
+    The file is mapped read-only so all the processes share the same pages.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as policy_file:
+            stat = os.fstat(policy_file.fileno())
+            self.buffer = mmap.mmap(policy_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.inode = (stat.st_dev, stat.st_ino)
+        if len(self.buffer) < HEADER.size:
+            raise PolicyFileError('%s is not a policy file' % path)
+        (magic, self.version, self.users_offset, self.users_count, self.rules_offset, self.rules_count,
+         self.nodes_offset, self.nodes_count, self.edges_offset, self.roots_offset, roots_count,
+         self.clientids_offset, self.clientids_count, self.integers_offset,
+         self.strings_offset) = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC:
+            raise PolicyFileError('%s is not a policy file' % path)
+        self.roots = dict(ROOT.unpack_from(self.buffer, self.roots_offset + index * ROOT.size)
+                          for index in range(roots_count))
+
+    def close(self):
+        self.buffer.close()
+
+    def get_string(self, offset, size):
+        offset += self.strings_offset
+        return self.buffer[offset:offset + size]
+
+    def get_integers(self, offset, size):
+        offset = self.integers_offset + offset * INTEGER.size
+        return struct.unpack_from('<%dq' % size, self.buffer, offset)
+
+    def contains_integer(self, offset, size, value):
+        low, high = 0, size
+        while low < high:
+            middle = (low + high) // 2
+            current = INTEGER.unpack_from(self.buffer, self.integers_offset + (offset + middle) * INTEGER.size)[0]
+            if current < value:
+                low = middle + 1
+            elif current > value:
+                high = middle
+            else:
+                return True
+        return False
+
+    def search(self, key, count, get_key):
+        """
+        Binary search on a sorted section
+        :return: index or None
+        """
+        low, high = 0, count
+        while low < high:
+            middle = (low + high) // 2
+            current = get_key(middle)
+            if current < key:
+                low = middle + 1
+            elif current > key:
+                high = middle
+            else:
+                return middle
+        return None
+
+    def user_key(self, index):
+        values = USER.unpack_from(self.buffer, self.users_offset + index * USER.size)
+        return self.get_string(values[1], values[2])
+
+    def rule_key(self, index):
+        values = RULE.unpack_from(self.buffer, self.rules_offset + index * RULE.size)
+        return self.get_string(values[1], values[2]), values[3]
+
+    def get_user(self, username, active=False):
+        """
+        Same as Policy.get_user
+        :rtype: PolicyUser|None
+        """
+        if username is None:
+            return None
+        name = username.encode('utf-8')
+        index = self.search(name, self.users_count, self.user_key)
+        if index is None:
+            return None
+        pk, name_offset, name_size, groups_offset, groups_count, flags = USER.unpack_from(
+            self.buffer, self.users_offset + index * USER.size)
+        if active and not flags & USER_ACTIVE:
+            return None
+        return PolicyUser(pk, username, bool(flags & USER_ACTIVE), bool(flags & USER_SUPERUSER),
+                          frozenset(self.get_integers(groups_offset, groups_count)))
+
+    def get_rule_at(self, index):
+        (pk, topic_offset, topic_size, acc, allow, has_password, specificity,
+         users_offset, users_count, groups_offset, groups_count) = RULE.unpack_from(
+            self.buffer, self.rules_offset + index * RULE.size)
+        return MappedRule(pk, self.get_string(topic_offset, topic_size).decode('utf-8'), acc, bool(allow),
+                          (users_offset, users_count), (groups_offset, groups_count), bool(has_password),
+                          specificity)
+
+    def get_rule(self, topic, acc):
+        if topic is None or acc is None:
+            return None
+        index = self.search((topic.encode('utf-8'), acc), self.rules_count, self.rule_key)
+        if index is None:
+            return None
+        return self.get_rule_at(index)
+
+    def clientid_key(self, index):
+        values = CLIENTID.unpack_from(self.buffer, self.clientids_offset + index * CLIENTID.size)
+        return self.get_string(values[1], values[2])
+
+    def get_clientid(self, name):
+        """
+        Same as Policy.get_clientid, the principals are (offset, count) of the integers
+        :rtype: MappedClientId|None
+        """
+        if not isinstance(name, str):
+            return None
+        index = self.search(name.encode('utf-8'), self.clientids_count, self.clientid_key)
+        if index is None:
+            return None
+        pk, name_offset, name_size, users_offset, users_count, groups_offset, groups_count = CLIENTID.unpack_from(
+            self.buffer, self.clientids_offset + index * CLIENTID.size)
+        return MappedClientId(pk, name, (users_offset, users_count), (groups_offset, groups_count))
+
+    def get_child(self, node, level):
+        edges_offset, edges_count = NODE.unpack_from(self.buffer, self.nodes_offset + node * NODE.size)[:2]
+
+        def edge_key(index):
+            values = EDGE.unpack_from(self.buffer, self.edges_offset + (edges_offset + index) * EDGE.size)
+            return self.get_string(values[0], values[1])
+
+        index = self.search(level.encode('utf-8'), edges_count, edge_key)
+        if index is None:
+            return None
+        return EDGE.unpack_from(self.buffer, self.edges_offset + (edges_offset + index) * EDGE.size)[2]
+
+    def get_values(self, node):
+        values_offset, values_count = NODE.unpack_from(self.buffer, self.nodes_offset + node * NODE.size)[2:]
+        return self.get_integers(values_offset, values_count)
+
+    def match(self, root, name):
+        """
+        Same as TopicTrie.match on the mapped nodes
+        :return: indexes of the matched rules
+        """
+        levels = name.split(TOPIC_SEP)
+        dollar = name.startswith('$')
+        matches = []
+        pending = [(root, 0)]
+        while pending:
+            node, index = pending.pop()
+            wildcards = not (dollar and index == 0)
+            if wildcards:
+                child = self.get_child(node, WILDCARD_MULTI_LEVEL)
+                if child is not None and index < len(levels):
+                    matches.extend(self.get_values(child))
+            if index == len(levels):
+                matches.extend(self.get_values(node))
+                continue
+            level = levels[index]
+            if level not in (WILDCARD_SINGLE_LEVEL, WILDCARD_MULTI_LEVEL):
+                child = self.get_child(node, level)
+                if child is not None:
+                    pending.append((child, index + 1))
+            if wildcards and level != WILDCARD_MULTI_LEVEL:
+                child = self.get_child(node, WILDCARD_SINGLE_LEVEL)
+                if child is not None:
+                    pending.append((child, index + 1))
+        return matches
+
+    def get_acl(self, topic, acc):
+        rule = self.get_rule(topic, acc)
+        if rule is None and acc in self.roots and topic:
+            candidates = [self.get_rule_at(index) for index in self.match(self.roots[acc], topic)]
+            if candidates:
+                rule = min(candidates, key=lambda candidate: (candidate.specificity, candidate.pk))
+        return rule
+
+    def is_member(self, rule, user):
+        if self.contains_integer(rule.users[0], rule.users[1], user.pk):
+            return True
+        if rule.groups[1]:
+            for group in user.groups:
+                if self.contains_integer(rule.groups[0], rule.groups[1], group):
+                    return True
+        return False
+
+    def rule_permission(self, rule, user):
+        if not rule.users[1] and not rule.groups[1] and not rule.has_password:
+            return rule.allow
+        return super(MappedPolicy, self).rule_permission(rule, user)
+
+
+def write_policy(policy, path):
+    PolicyWriter(policy).write(path)
+
+
+def load_policy(path, version, force=False, current=None):
+    """
+    Map the policy file of path, if it is missing or its version is not the given one it is built and written first.
+    Only one process rebuilds the file, the others wait for it and map the new one.
+
+    :param path: Policy file path
+    :param version: Expected PolicyVersion.version
+    :param force: Rebuild the file even if the version is the same
+    :param current: MappedPolicy currently used, returned if the file was not replaced
+    :rtype: MappedPolicy
+    """
+    def mapped():
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if getattr(current, 'inode', None) == (stat.st_dev, stat.st_ino):
+            return current
+        try:
+            return MappedPolicy(path)
+        except (OSError, PolicyFileError, struct.error):
+            return None
+
+    policy = None if force else mapped()
+    if policy is not None and policy.version == version:
+        return policy
+    with open(path + '.lock', 'a') as lock:
+        if fcntl is not None:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            if not force:
+                policy = mapped()
+                if policy is not None and policy.version == version:
+                    return policy
+            write_policy(Policy.build(), path)
+            return mapped()
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
@@ -1,3 +1,4 @@
+import hashlib
 import random
 import re
 import struct
@@ -210,3 +211,243 @@ def gen_client_id():
     for s in range(rand.randint(1, 23)):
         client_id += rand.choice('0123456789abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ')
     return client_id
+
+
+def topic_digest(name):
+    """
+    :param name: topic name
+    :type name: str|bytes
+    :return: fixed-width digest of the topic name, used for equality lookups
+    :rtype: str
+    """
+    if isinstance(name, str):
+        name = name.encode('utf8')
+    return hashlib.sha256(name).hexdigest()
+
+
+def topic_matches(topic_filter, name):
+    """
+    :param topic_filter: topic filter, could contains wildcards
+    :type topic_filter: str|bytes
+    :param name: topic name, could be a wildcard too
+    :type name: str|bytes
+    :return: If the topic filter contains the topic name
+    :rtype: bool
+    """
+    if isinstance(topic_filter, bytes):
+        topic_filter = topic_filter.decode()
+    if isinstance(name, bytes):
+        name = name.decode()
+    if not name:
+        return False
+    if topic_filter == name:
+        return True
+    if WILDCARD_MULTI_LEVEL not in topic_filter and WILDCARD_SINGLE_LEVEL not in topic_filter:
+        return False
+    dollar = topic_filter.startswith(TOPIC_BEGINNING_DOLLAR)
+    if dollar != name.startswith(TOPIC_BEGINNING_DOLLAR):
+        return False
+
+    filter_parts = topic_filter.split(TOPIC_SEP)
+    name_parts = name.split(TOPIC_SEP)
+    if dollar and filter_parts[0] != name_parts[0]:
+        return False
+
+    name_size = len(name_parts)
+    if name_size < len(filter_parts):
+        return False
+    if not topic_filter.endswith(WILDCARD_MULTI_LEVEL) and name_size > len(filter_parts):
+        return False
+
+    for part, compare in zip(filter_parts, name_parts):
+        if part == WILDCARD_SINGLE_LEVEL:
+            if compare == WILDCARD_MULTI_LEVEL:
+                return False
+        elif part == WILDCARD_MULTI_LEVEL:
+            return True
+        elif part != compare:
+            return False
+    return True
+
+
+# Flag of the topic_specificity of the filters ending with the multi level wildcard
+SPECIFICITY_MULTI_LEVEL = 1 << 20
+
+
+def topic_specificity(topic_filter):
+    """
+    :param topic_filter: topic filter
+    :type topic_filter: str|bytes
+    :return: Sort key of the filter, lower is more specific. If a filter contains other the contained one has the
+    lower key. The filters without wildcards have the key 0.
+    :rtype: int
+    """
+    if isinstance(topic_filter, bytes):
+        topic_filter = topic_filter.decode()
+    levels = topic_filter.split(TOPIC_SEP)
+    single = levels.count(WILDCARD_SINGLE_LEVEL)
+    if levels[-1] != WILDCARD_MULTI_LEVEL:
+        return single
+    return SPECIFICITY_MULTI_LEVEL | ((1024 - len(levels)) << 10) | single
+
+
+class TopicTrieNode(object):
+    __slots__ = ('children', 'values')
+
+    def __init__(self):
+        self.children = {}
+        self.values = []
+
+
+class TopicTrie(object):
+    """
+    Index of topic filters keyed by level, a lookup walks the levels of the topic name only once.
+    The match rules are the same as topic_matches
+    """
+
+    def __init__(self):
+        self.root = TopicTrieNode()
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, topic_filter, value=None):
+        if isinstance(topic_filter, bytes):
+            topic_filter = topic_filter.decode()
+        node = self.root
+        for level in topic_filter.split(TOPIC_SEP):
+            child = node.children.get(level)
+            if child is None:
+                child = TopicTrieNode()
+                node.children[level] = child
+            node = child
+        node.values.append(value)
+        self.size += 1
+
+    def remove(self, topic_filter, value=None):
+        if isinstance(topic_filter, bytes):
+            topic_filter = topic_filter.decode()
+        path = [self.root]
+        levels = topic_filter.split(TOPIC_SEP)
+        for level in levels:
+            node = path[-1].children.get(level)
+            if node is None:
+                return False
+            path.append(node)
+        node = path[-1]
+        if value not in node.values:
+            return False
+        node.values.remove(value)
+        self.size -= 1
+        for level in reversed(levels):
+            node = path.pop()
+            if node.children or node.values:
+                break
+            del path[-1].children[level]
+        return True
+
+    def copy(self):
+        """
+        :return: Index with copies of all the nodes, the values are shared
+        :rtype: TopicTrie
+        """
+        trie = TopicTrie()
+        trie.size = self.size
+        pending = [(self.root, trie.root)]
+        while pending:
+            node, copy = pending.pop()
+            copy.values = list(node.values)
+            for level, child in node.children.items():
+                copy.children[level] = TopicTrieNode()
+                pending.append((child, copy.children[level]))
+        return trie
+
+    def match(self, name):
+        """
+        :param name: topic name, could be a wildcard too
+        :type name: str|bytes
+        :return: values of all the filters that contain the name
+        :rtype: list
+        """
+        if isinstance(name, bytes):
+            name = name.decode()
+        if not name:
+            return []
+        levels = name.split(TOPIC_SEP)
+        size = len(levels)
+        dollar = name.startswith(TOPIC_BEGINNING_DOLLAR)
+        found = []
+        pending = [(self.root, 0)]
+        while pending:
+            node, index = pending.pop()
+            wildcards = not (dollar and index == 0)
+            if wildcards and index < size:
+                multi = node.children.get(WILDCARD_MULTI_LEVEL)
+                if multi is not None:
+                    found.extend(multi.values)
+            if index == size:
+                found.extend(node.values)
+                continue
+            level = levels[index]
+            if level != WILDCARD_SINGLE_LEVEL and level != WILDCARD_MULTI_LEVEL:
+                child = node.children.get(level)
+                if child is not None:
+                    pending.append((child, index + 1))
+            if wildcards and level != WILDCARD_MULTI_LEVEL:
+                child = node.children.get(WILDCARD_SINGLE_LEVEL)
+                if child is not None:
+                    pending.append((child, index + 1))
+        return found
+
+    def overlap(self, topic_filter):
+        """
+        :param topic_filter: topic filter, could contains wildcards
+        :type topic_filter: str|bytes
+        :return: values of all the filters that contain any topic name contained by topic_filter too
+        :rtype: list
+        """
+        if isinstance(topic_filter, bytes):
+            topic_filter = topic_filter.decode()
+        levels = topic_filter.split(TOPIC_SEP)
+        size = len(levels)
+        dollar = topic_filter.startswith(TOPIC_BEGINNING_DOLLAR)
+        found = []
+        pending = [(self.root, 0)]
+        while pending:
+            node, index = pending.pop()
+            if index == size:
+                found.extend(node.values)
+                multi = node.children.get(WILDCARD_MULTI_LEVEL)
+                if multi is not None:
+                    found.extend(multi.values)
+                continue
+            level = levels[index]
+            # The wildcards of the first level do not match the topics starting with $
+            if index == 0 and dollar:
+                child = node.children.get(level)
+                if child is not None:
+                    pending.append((child, index + 1))
+                continue
+            if level == WILDCARD_MULTI_LEVEL:
+                found.extend(node.values)
+                subtree = [child for name, child in node.children.items()
+                           if index > 0 or not name.startswith(TOPIC_BEGINNING_DOLLAR)]
+                while subtree:
+                    child = subtree.pop()
+                    found.extend(child.values)
+                    subtree.extend(child.children.values())
+                continue
+            multi = node.children.get(WILDCARD_MULTI_LEVEL)
+            if multi is not None:
+                found.extend(multi.values)
+            if level == WILDCARD_SINGLE_LEVEL:
+                pending.extend((child, index + 1) for name, child in node.children.items()
+                               if name != WILDCARD_MULTI_LEVEL and
+                               (index > 0 or not name.startswith(TOPIC_BEGINNING_DOLLAR)))
+                continue
+            for name in (level, WILDCARD_SINGLE_LEVEL):
+                child = node.children.get(name)
+                if child is not None:
+                    pending.append((child, index + 1))
+        return found
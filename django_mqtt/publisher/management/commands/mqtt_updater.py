@@ -73,7 +73,7 @@ class Command(BaseCommand):
             return
         self.stdout.write('New message to {}'.format(message.topic))
 
-        topics = Topic.objects.filter(name=message.topic)
+        topics = Topic.objects.named(message.topic)
         topic = None
         if topics.exists():
             topic = topics.get()
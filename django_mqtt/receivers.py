@@ -0,0 +1,148 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+
+from django_mqtt.cache import clear_caches, clear_users
+from django_mqtt.models import (
+    ACL,
+    CHANGE_ACL,
+    CHANGE_CLIENTID,
+    CHANGE_GROUP,
+    CHANGE_TOPIC,
+    CHANGE_USER,
+    ACLChange,
+    ClientId,
+    PolicyVersion,
+    Topic
+)
+from django_mqtt.bloom import known_clientids, known_topics, known_usernames
+from django_mqtt.mosquitto.auth_plugin.auth import invalidate_superusers
+from django_mqtt.mosquitto.export import export_on_change
+from django_mqtt.signals import acl_changed
+
+
+def get_change_model(model):
+    if issubclass(model, get_user_model()):
+        return CHANGE_USER
+    return {ACL: CHANGE_ACL, Topic: CHANGE_TOPIC, ClientId: CHANGE_CLIENTID, Group: CHANGE_GROUP}[model]
+
+
+def log_m2m_changed(instance, reverse, model, pk_set):
+    """
+    Log the objects changed by a m2m action, the objects with the relation if it is known or the instance for clear
+    """
+    if reverse and pk_set is not None:
+        ACLChange.log(get_change_model(model), pk_set)
+    else:
+        ACLChange.log(get_change_model(instance.__class__), [instance.pk])
+
+
+def policy_changed(sender, instance, **kwargs):
+    ACLChange.log(get_change_model(sender), [instance.pk])
+    acl_changed.send(sender=sender, instance=instance, users=None)
+
+
+def policy_m2m_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if action.startswith('post_'):
+        log_m2m_changed(instance, reverse, model, pk_set)
+        acl_changed.send(sender=sender, instance=instance, users=None)
+
+
+def get_user_fields(user_model):
+    """
+    :return: names of the user fields used to resolve the ACLs, the groups are changed by user_groups_changed
+    """
+    return user_model.USERNAME_FIELD, 'is_active', 'is_superuser'
+
+
+def user_saving(sender, instance, update_fields=None, **kwargs):
+    """
+    Compare the user fields of get_user_fields with the stored ones, user_saved uses it to skip the other changes
+    """
+    fields = get_user_fields(sender)
+    if update_fields is not None:
+        fields = [field for field in fields if field in update_fields]
+    changed = bool(fields)
+    if fields and instance.pk is not None:
+        stored = sender.objects.filter(pk=instance.pk).values_list(*fields).first()
+        changed = stored != tuple(getattr(instance, field) for field in fields)
+    instance._mqtt_acl_changed = changed
+
+
+def user_saved(sender, instance, **kwargs):
+    if instance.__dict__.pop('_mqtt_acl_changed', True):
+        user_changed(sender, instance)
+
+
+def user_changed(sender, instance, **kwargs):
+    ACLChange.log(CHANGE_USER, [instance.pk])
+    acl_changed.send(sender=sender, instance=instance, users={instance.pk})
+
+
+def user_groups_changed(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    log_m2m_changed(instance, reverse, model, pk_set)
+    users = {instance.pk}
+    if reverse:
+        users = set(pk_set) if pk_set else None
+    acl_changed.send(sender=sender, instance=instance, users=users)
+
+
+def topic_loading(sender, instance, raw=False, **kwargs):
+    """
+    The raw saves, like loaddata, skip Topic.save, the fields derived from the name are filled here
+    """
+    if raw:
+        instance.wildcard = instance.is_wildcard()
+        instance.dollar = instance.is_dollar()
+        instance.update_name_fields()
+
+
+def topic_loaded(sender, instance, raw=False, using=None, **kwargs):
+    if raw:
+        instance.update_levels(using=using)
+
+
+def add_known_name(sender, instance, **kwargs):
+    if isinstance(instance, Topic):
+        known_topics.add(instance.name)
+    elif isinstance(instance, ClientId):
+        known_clientids.add(instance.name)
+    else:
+        known_usernames.add(instance.get_username())
+
+
+def increase_policy_version(sender, **kwargs):
+    PolicyVersion.increase()
+
+
+def invalidate_caches(sender, users=None, **kwargs):
+    if users is None:
+        clear_caches()
+    else:
+        clear_users(users)
+
+
+def connect():
+    user_model = get_user_model()
+    for model in (ACL, Topic, ClientId, Group):
+        post_save.connect(policy_changed, sender=model, dispatch_uid='django_mqtt_acl_save_%s' % model.__name__)
+        post_delete.connect(policy_changed, sender=model, dispatch_uid='django_mqtt_acl_delete_%s' % model.__name__)
+    for through in (ACL.users.through, ACL.groups.through, ClientId.users.through, ClientId.groups.through):
+        m2m_changed.connect(policy_m2m_changed, sender=through,
+                            dispatch_uid='django_mqtt_acl_m2m_%s' % through.__name__)
+    pre_save.connect(topic_loading, sender=Topic, dispatch_uid='django_mqtt_topic_loading')
+    post_save.connect(topic_loaded, sender=Topic, dispatch_uid='django_mqtt_topic_loaded')
+    for model in (user_model, Topic, ClientId):
+        post_save.connect(add_known_name, sender=model, dispatch_uid='django_mqtt_known_%s' % model.__name__)
+    pre_save.connect(user_saving, sender=user_model, dispatch_uid='django_mqtt_acl_saving_user')
+    post_save.connect(user_saved, sender=user_model, dispatch_uid='django_mqtt_acl_save_user')
+    post_delete.connect(user_changed, sender=user_model, dispatch_uid='django_mqtt_acl_delete_user')
+    post_save.connect(invalidate_superusers, sender=user_model, dispatch_uid='django_mqtt_superusers_save')
+    post_delete.connect(invalidate_superusers, sender=user_model, dispatch_uid='django_mqtt_superusers_delete')
+    m2m_changed.connect(user_groups_changed, sender=user_model.groups.through,
+                        dispatch_uid='django_mqtt_acl_m2m_user_groups')
+    acl_changed.connect(increase_policy_version, dispatch_uid='django_mqtt_policy_version')
+    acl_changed.connect(invalidate_caches, dispatch_uid='django_mqtt_caches')
+    acl_changed.connect(export_on_change, dispatch_uid='django_mqtt_mosquitto_export')
@@ -0,0 +1,5 @@
+from django.dispatch import Signal
+
+# Sent when any data used to resolve the ACLs changes.
+# Arguments: instance, the changed object, and users, the pk set of the affected users or None if it could be anyone
+acl_changed = Signal()
@@ -3,12 +3,16 @@ import struct
 from django.core.exceptions import ValidationError
 from django.test import TestCase
 
+from django_mqtt.models import Topic
+from django_mqtt.mosquitto.export import filters_overlap
 from django_mqtt.protocol import (
     gen_string,
     get_remaining,
     get_string,
     int2remaining,
-    remaining2list
+    remaining2list,
+    TopicTrie,
+    topic_matches
 )
 from django_mqtt.validators import (
     ClientIdValidator,
@@ -156,3 +160,105 @@ class ProtocolTestCase(TestCase):
         self.assertRaises(UnicodeDecodeError, get_string, b'\x00\x01\xFF', exception=True)
         self.assertRaises(TypeError, get_string, None, exception=True)
         self.assertRaises(TypeError, get_string, object, exception=True)
+
+
+class TopicMatchesTestCase(TestCase):
+
+    def test_simple_wildcard(self):
+        self.assertFalse(topic_matches('+', ''))
+        self.assertTrue(topic_matches('+', 'test'))
+        self.assertFalse(topic_matches('+', '/test'))
+        self.assertTrue(topic_matches('/+/two', '/test/two'))
+        self.assertFalse(topic_matches('/+/two', '/test/two/3'))
+        self.assertFalse(topic_matches('/+/two', '$test/two'))
+        self.assertTrue(topic_matches('/+/+', '/+/two'))
+        self.assertFalse(topic_matches('+/+', '+/#'))
+
+    def test_multi_wildcard(self):
+        self.assertTrue(topic_matches('#', 'test/b/two/3'))
+        self.assertTrue(topic_matches('#', '/#'))
+        self.assertTrue(topic_matches('/#', '/test'))
+        self.assertFalse(topic_matches('/#', 'test'))
+        self.assertFalse(topic_matches('/#', '#'))
+        self.assertFalse(topic_matches('/test/#', '/test'))
+
+    def test_dollar(self):
+        self.assertTrue(topic_matches('$SYS/#', '$SYS/+'))
+        self.assertFalse(topic_matches('$SYS/#', '$SYSTEM/test/one'))
+        self.assertFalse(topic_matches('#', '$SYS'))
+        self.assertFalse(topic_matches('$/+', '+/+'))
+        self.assertTrue(topic_matches('$/+', '$/test'))
+
+    def test_not_wildcard(self):
+        self.assertTrue(topic_matches('/test/one', '/test/one'))
+        self.assertFalse(topic_matches('/test/one', '/test'))
+        self.assertFalse(topic_matches('/test', '/test/one'))
+
+    def test_bytes(self):
+        self.assertTrue(topic_matches(b'/+/two', '/test/two'))
+        self.assertTrue(topic_matches('/+/two', b'/test/two'))
+        self.assertFalse(topic_matches(b'/+/two', b'/test/three'))
+
+    def test_model(self):
+        topic = Topic(name='/+/two')
+        self.assertTrue('/test/two' in topic)
+        self.assertTrue(b'/test/two' in topic)
+        self.assertTrue(topic > '/test/two')
+        self.assertTrue(topic > b'/test/two')
+        self.assertFalse(topic > '/test/three')
+        self.assertTrue(topic < '/#')
+        self.assertTrue(topic < b'/#')
+        self.assertFalse(topic < '/test/two')
+        self.assertFalse(object() in topic)
+
+
+class TopicTrieTestCase(TestCase):
+    FILTERS = ['#', '+', '/#', '/+', '/+/two', '+/two', '/test/+/two/#', '/+/#', '+/#', '+/+',
+               '$SYS/#', '$SYS/+', '$/+', '$/#', '/test/one', 'test']
+    NAMES = ['', 'test', '/test', '/test/two', '/1/two', 'test/two', 'test/two/3', '/test/a/two/b',
+             '$SYS', '$SYS/one', '$SYSTEM/one', '$/test', '$/test/one', '/test/one', '+/+', '/+', '#']
+
+    def test_match(self):
+        trie = TopicTrie()
+        for topic_filter in self.FILTERS:
+            trie.add(topic_filter, topic_filter)
+        self.assertEqual(len(trie), len(self.FILTERS))
+        for name in self.NAMES:
+            expected = [f for f in self.FILTERS if topic_matches(f, name)]
+            self.assertEqual(sorted(trie.match(name)), sorted(expected), name)
+            self.assertEqual(sorted(trie.match(name.encode())), sorted(expected), name)
+
+    def test_overlap(self):
+        trie = TopicTrie()
+        for topic_filter in self.FILTERS:
+            trie.add(topic_filter, topic_filter)
+        for topic_filter in self.FILTERS + self.NAMES[1:] + ['/test/#', '/+/+/two/+', '$SYS/one/#']:
+            expected = [f for f in self.FILTERS if filters_overlap(f, topic_filter)]
+            self.assertEqual(sorted(trie.overlap(topic_filter)), sorted(expected), topic_filter)
+
+    def test_remove(self):
+        trie = TopicTrie()
+        trie.add('/+/two', 1)
+        trie.add('/+/two', 2)
+        trie.add('/+/#', 3)
+        self.assertEqual(sorted(trie.match('/one/two')), [1, 2, 3])
+        self.assertTrue(trie.remove('/+/two', 1))
+        self.assertFalse(trie.remove('/+/two', 1))
+        self.assertFalse(trie.remove('/+/three', 2))
+        self.assertEqual(sorted(trie.match('/one/two')), [2, 3])
+        self.assertTrue(trie.remove('/+/two', 2))
+        self.assertTrue(trie.remove('/+/#', 3))
+        self.assertEqual(trie.match('/one/two'), [])
+        self.assertEqual(len(trie), 0)
+        self.assertEqual(trie.root.children, {})
+
+    def test_copy(self):
+        trie = TopicTrie()
+        trie.add('/+/two', 1)
+        trie.add('/+/#', 2)
+        copy = trie.copy()
+        self.assertTrue(copy.remove('/+/two', 1))
+        copy.add('/one/+', 3)
+        self.assertEqual(sorted(trie.match('/one/two')), [1, 2])
+        self.assertEqual(sorted(copy.match('/one/two')), [2, 3])
+        self.assertEqual((len(trie), len(copy)), (2, 2))
@@ -0,0 +1,91 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from django_mqtt.bloom import BloomFilter, known_topics, known_usernames, negative_cache
+from django_mqtt.models import CHANGE_TOPIC, CHANGE_USER, ACLChange, PolicyVersion, Topic
+
+
+class BloomFilterTestCase(TestCase):
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        names = ['/topic/%d' % index for index in range(1000)]
+        for name in names:
+            bloom.add(name)
+        self.assertTrue(all(name in bloom for name in names))
+        false_positives = sum('/other/%d' % index in bloom for index in range(10000))
+        self.assertLess(false_positives, 300)
+
+    def test_empty(self):
+        bloom = BloomFilter(0)
+        self.assertNotIn('', bloom)
+        bloom.add('')
+        self.assertIn('', bloom)
+
+
+@override_settings(MQTT_BLOOM_FILTER=True, MQTT_NEGATIVE_CACHE_SIZE=100, MQTT_ACL_POLICY_POLL=3600)
+class KnownNamesTestCase(TestCase):
+    def setUp(self):
+        known_usernames.reset()
+        known_topics.reset()
+        negative_cache.clear()
+
+    def test_may_exist(self):
+        User.objects.create_user('user')
+        self.assertTrue(known_usernames.may_exist('user'))
+        with self.assertNumQueries(0):
+            self.assertFalse(known_usernames.may_exist('unknown'))
+            self.assertFalse(known_usernames.may_exist(None))
+        User.objects.create_user('unknown')
+        with self.assertNumQueries(0):
+            self.assertTrue(known_usernames.may_exist('unknown'))
+
+    def test_missed(self):
+        Topic.objects.create(name='/topic')
+        self.assertTrue(known_topics.may_exist('/topic'))
+        known_topics.missed('/topic')
+        self.assertFalse(known_topics.may_exist('/topic'))
+        Topic.objects.get(name='/topic').save()
+        self.assertTrue(known_topics.may_exist('/topic'))
+
+    def test_other_process_change(self):
+        self.assertFalse(known_usernames.may_exist('user'))
+        User.objects.bulk_create([User(username='user')])
+        PolicyVersion.increase()
+        self.assertFalse(known_usernames.may_exist('user'))
+        with self.settings(MQTT_ACL_POLICY_POLL=0):
+            self.assertTrue(known_usernames.may_exist('user'))
+
+    def test_other_process_added(self):
+        User.objects.create_user('user')
+        self.assertFalse(known_usernames.may_exist('other'))
+        self.assertFalse(known_usernames.may_exist('renamed'))
+        # Changed by other process, without signals on this one
+        User.objects.bulk_create([User(username='other')])
+        other = User.objects.get(username='other')
+        User.objects.filter(username='user').update(username='renamed')
+        ACLChange.log(CHANGE_USER, [other.pk, User.objects.get(username='renamed').pk])
+        PolicyVersion.increase()
+        with self.settings(MQTT_ACL_POLICY_POLL=0), \
+                mock.patch.object(known_usernames, 'build', side_effect=AssertionError('Rebuilt')):
+            self.assertTrue(known_usernames.may_exist('other'))
+            self.assertTrue(known_usernames.may_exist('renamed'))
+            self.assertFalse(known_usernames.may_exist('unknown'))
+
+    def test_other_process_deleted(self):
+        topic = Topic.objects.create(name='/topic')
+        self.assertTrue(known_topics.may_exist('/topic'))
+        # Deleted by other process, without signals on this one
+        Topic.objects.filter(pk=topic.pk).delete()
+        ACLChange.log(CHANGE_TOPIC, [topic.pk])
+        PolicyVersion.increase()
+        with self.settings(MQTT_ACL_POLICY_POLL=0), \
+                mock.patch.object(known_topics, 'build', wraps=known_topics.build) as build:
+            self.assertFalse(known_topics.may_exist('/topic'))
+        self.assertEqual(build.call_count, 1)
+
+    @override_settings(MQTT_BLOOM_FILTER=False)
+    def test_disabled(self):
+        with self.assertNumQueries(0):
+            self.assertTrue(known_usernames.may_exist('unknown'))
@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from django.test import TestCase, override_settings
+
+from django_mqtt.cache import LRUCache, SingleFlight
+
+
+class LRUCacheTestCase(TestCase):
+
+    @override_settings(TEST_CACHE_SIZE=2, TEST_CACHE_TIMEOUT=None)
+    def test_bounded(self):
+        cache = LRUCache('TEST_CACHE_SIZE', 'TEST_CACHE_TIMEOUT')
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(cache.hits, 3)
+        self.assertEqual(cache.misses, 1)
+
+    @override_settings(TEST_CACHE_SIZE=10, TEST_CACHE_TIMEOUT=0.01)
+    def test_timeout(self):
+        cache = LRUCache('TEST_CACHE_SIZE', 'TEST_CACHE_TIMEOUT')
+        cache.set('a', False)
+        self.assertEqual(cache.get('a', True), False)
+        time.sleep(0.02)
+        self.assertEqual(cache.get('a', True), True)
+        self.assertEqual(len(cache), 0)
+
+    def test_disabled(self):
+        cache = LRUCache('TEST_CACHE_SIZE', 'TEST_CACHE_TIMEOUT')
+        self.assertFalse(cache.enabled)
+        cache.set('a', 1)
+        self.assertIsNone(cache.get('a'))
+        with self.settings(TEST_CACHE_SIZE=10):
+            self.assertTrue(cache.enabled)
+            cache.set('a', 1)
+            self.assertEqual(cache.get('a'), 1)
+        self.assertFalse(cache.enabled)
+
+    @override_settings(TEST_CACHE_SIZE=10)
+    def test_invalidate(self):
+        cache = LRUCache('TEST_CACHE_SIZE', 'TEST_CACHE_TIMEOUT')
+        cache.set((1, 'a'), 1)
+        cache.set((2, 'a'), 2)
+        cache.set((2, 'b'), 3)
+        cache.discard(lambda key: key[0] == 2)
+        self.assertEqual(len(cache), 1)
+        cache.delete((1, 'a'))
+        self.assertEqual(len(cache), 0)
+        cache.set((1, 'a'), 1)
+        cache.clear()
+        self.assertIsNone(cache.get((1, 'a')))
+
+
+class SingleFlightTestCase(TestCase):
+    def test_coalesced(self):
+        flight = SingleFlight()
+        release = threading.Event()
+        computed = []
+        results = []
+
+        def compute():
+            release.wait(5)
+            computed.append(True)
+            return 'value'
+
+        threads = [threading.Thread(target=lambda: results.append(flight.do('key', compute))) for index in range(5)]
+        for thread in threads:
+            thread.start()
+        while flight.calls < 5:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['value'] * 5)
+        self.assertEqual(len(computed), 1)
+        self.assertEqual((flight.calls, flight.coalesced), (5, 4))
+        self.assertEqual(flight.do('key', lambda: 'other'), 'other')
+
+    def test_error(self):
+        flight = SingleFlight()
+        with self.assertRaises(ZeroDivisionError):
+            flight.do('key', lambda: 1 / 0)
+        self.assertEqual(flight.do('key', lambda: 1), 1)
+
+    def test_async(self):
+        flight = SingleFlight()
+        computed = []
+
+        async def compute(value):
+            await asyncio.sleep(0.01)
+            computed.append(value)
+            return 1 / value
+
+        async def run():
+            return await asyncio.gather(*[flight.ado('key', compute, 1) for index in range(5)],
+                                        flight.ado('other', compute, 2),
+                                        flight.ado('error', compute, 0), flight.ado('error', compute, 0),
+                                        return_exceptions=True)
+
+        results = async_to_sync(run)()
+        self.assertEqual(results[:6], [1] * 5 + [0.5])
+        self.assertIsInstance(results[6], ZeroDivisionError)
+        self.assertIsInstance(results[7], ZeroDivisionError)
+        self.assertEqual(sorted(computed), [0, 1, 2])
+        self.assertEqual((flight.calls, flight.coalesced), (8, 5))
@@ -0,0 +1,310 @@
+import json
+import os
+import random
+import shutil
+import tempfile
+from io import StringIO
+from itertools import product
+
+from django.contrib.auth.models import Group, User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from django_mqtt import metrics
+from django_mqtt.models import ACL, PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS, Topic
+from django_mqtt.mosquitto import export
+from django_mqtt.mosquitto.auth_plugin.auth import resolve_permission
+from django_mqtt.policy import Policy
+from django_mqtt.protocol import topic_matches
+from django_mqtt.test.test_policy import BasePolicyTestCase
+
+NAMES = ['/test/one', '/test/two', '/test/secret', '/test/private/one', '/other', 'test', '$SYS/one']
+
+
+def parse_acl_file(content):
+    """
+    :return: list of (access, topic filter) by username, None for the anonymous section
+    """
+    sections = {None: []}
+    username = None
+    for line in content.splitlines():
+        if not line or line.startswith('#'):
+            continue
+        if line.startswith('user '):
+            username = line[5:]
+            sections[username] = []
+        else:
+            keyword, access, topic_filter = line.split(' ', 2)
+            sections[username].append((access, topic_filter))
+    return sections
+
+
+def acl_file_permission(entries, name, acc):
+    """ Same check of mosquitto, the denials first and then any allowed """
+    matching = [access for access, topic_filter in entries if topic_matches(topic_filter, name)]
+    if 'deny' in matching:
+        return False
+    return 'readwrite' in matching or export.ACL_FILE_ACCESS[acc] in matching
+
+
+def dynsec_permission(acls, name, acc):
+    """ Same check of the dynamic security plugin, the first matching ACL by priority """
+    for acl in sorted(acls, key=lambda item: -item['priority']):
+        if acl['acltype'] == export.DYNSEC_ACLTYPE[acc] and topic_matches(acl['topic'], name):
+            return acl['allow']
+    return False
+
+
+def expected_permission(user, name, acc):
+    if user is not None and user.is_superuser:
+        return True
+    return resolve_permission(user, name, acc)
+
+
+class FiltersOverlapTestCase(TestCase):
+    def test_overlap(self):
+        for first, second in [('a/b', 'a/b'), ('a/+', 'a/b'), ('#', 'a/b'), ('a/#', 'a/+/c'), ('+/b', 'a/+')]:
+            self.assertTrue(export.filters_overlap(first, second), (first, second))
+            self.assertTrue(export.filters_overlap(second, first), (first, second))
+
+    def test_disjoint(self):
+        for first, second in [('a/b', 'a/c'), ('a/+', 'a/b/c'), ('a/b/#', 'a/c/#'), ('#', '$SYS/one'),
+                              ('+/one', '$SYS/one')]:
+            self.assertFalse(export.filters_overlap(first, second), (first, second))
+            self.assertFalse(export.filters_overlap(second, first), (first, second))
+
+
+class ExportTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user')
+        self.other = User.objects.create_user('other')
+        self.admin = User.objects.create_superuser('admin', 'admin@test.com', 'admin')
+        User.objects.create_user('inactive', is_active=False)
+        for acc in [PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS]:
+            self.create_acl('/test/#', acc)
+            self.create_acl('/test/secret', acc, allow=False)
+            self.create_acl('/test/private/#', acc, users=[self.user])
+
+    def create_acl(self, name, acc, allow=True, users=()):
+        topic, is_new = Topic.objects.get_or_create_named(name)
+        ACL.objects.create(topic=topic, acc=acc, allow=allow).users.add(*users)
+
+    def get_users(self):
+        return [None, self.user, self.other, self.admin]
+
+    def assertSameDecisions(self, check):
+        for user, name, acc in product(self.get_users(), NAMES, [PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS]):
+            self.assertEqual(check(user, name, acc), expected_permission(user, name, acc), (user, name, acc))
+
+    def test_acl_file(self):
+        for allow, anonymous in [(False, False), (True, True)]:
+            with self.settings(MQTT_ACL_ALLOW=allow, MQTT_ACL_ALLOW_ANONIMOUS=anonymous):
+                sections = parse_acl_file(''.join(export.generate_acl_file(Policy.build())))
+                self.assertNotIn('inactive', sections)
+                self.assertSameDecisions(lambda user, name, acc: acl_file_permission(
+                    sections[user.username if user else None], name, acc))
+        self.assertEqual(sections['other'], [('deny', '/test/secret'), ('deny', '/test/private/#'),
+                                             ('readwrite', '/test/#'), ('readwrite', '$SYS/#'),
+                                             ('readwrite', '#')])
+        self.assertEqual(sections['admin'], [('readwrite', '#'), ('readwrite', '$SYS/#')])
+
+    def test_dynsec(self):
+        for allow, anonymous in [(False, False), (True, True)]:
+            with self.settings(MQTT_ACL_ALLOW=allow, MQTT_ACL_ALLOW_ANONIMOUS=anonymous):
+                document = json.loads(''.join(export.generate_dynsec(Policy.build())))
+                roles = {role['rolename']: role['acls'] for role in document['roles']}
+                clients = {client['username']: roles[client['roles'][0]['rolename']]
+                           for client in document['clients']}
+                clients[None] = roles.get(document.get('anonymousGroup'), [])
+                self.assertNotIn('inactive', clients)
+                self.assertSameDecisions(lambda user, name, acc: dynsec_permission(
+                    clients[user.username if user else None], name, acc))
+        self.assertEqual(len(roles), 4)
+        self.assertEqual(document['anonymousGroup'], export.DYNSEC_ANONYMOUS)
+
+    def test_specificity_tie(self):
+        # Each acc resolves the equally specific filters by the pk of its own ACLs
+        self.create_acl('a/+', PROTO_MQTT_ACC_SUS)
+        self.create_acl('+/x', PROTO_MQTT_ACC_SUS, allow=False)
+        self.create_acl('+/x', PROTO_MQTT_ACC_PUB)
+        self.create_acl('a/+', PROTO_MQTT_ACC_PUB, allow=False)
+        document = json.loads(''.join(export.generate_dynsec(Policy.build())))
+        roles = {role['rolename']: role['acls'] for role in document['roles']}
+        clients = {client['username']: roles[client['roles'][0]['rolename']] for client in document['clients']}
+        for user, name, acc in product([self.user, self.other], ['a/x', 'a/y', 'b/x', 'b/y'],
+                                       [PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS]):
+            self.assertEqual(dynsec_permission(clients[user.username], name, acc),
+                             expected_permission(user, name, acc), (user, name, acc))
+
+    def test_acl_file_access_without_rule(self):
+        # +/a has only a publication rule, its denial must not hide the subscriptions allowed by a/#
+        self.create_acl('+/a', PROTO_MQTT_ACC_PUB, allow=False)
+        self.create_acl('a/#', PROTO_MQTT_ACC_SUS)
+        sections = parse_acl_file(''.join(export.generate_acl_file(Policy.build())))
+        self.assertNotIn(('deny', '+/a'), sections['other'])
+        for name, acc in product(['a/a', 'b/a', 'a/b'], [PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS]):
+            self.assertEqual(acl_file_permission(sections['other'], name, acc),
+                             expected_permission(self.other, name, acc), (name, acc))
+
+    def test_command(self):
+        out = StringIO()
+        call_command('mqtt_acl_export', stdout=out)
+        self.assertEqual(out.getvalue(), ''.join(export.generate_acl_file(Policy.build())))
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'dynamic-security.json')
+        call_command('mqtt_acl_export', '--format', export.FORMAT_DYNSEC, '--output', path)
+        with open(path) as output:
+            self.assertEqual(output.read(), ''.join(export.generate_dynsec(Policy.build())))
+        self.assertEqual(os.listdir(directory), ['dynamic-security.json'])
+
+    @override_settings(MQTT_METRICS=True)
+    def test_metrics_unchanged(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.create_acl('/denied', PROTO_MQTT_ACC_PUB, allow=False)
+        collector = metrics.get_collector()
+        samples = list(collector.collect())
+        call_command('mqtt_acl_export', stdout=StringIO())
+        call_command('mqtt_acl_export', '--format', export.FORMAT_DYNSEC, stdout=StringIO())
+        with self.settings(MQTT_MOSQUITTO_ACL_FILE=os.path.join(directory, 'acl'),
+                           MQTT_MOSQUITTO_DYNSEC_FILE=os.path.join(directory, 'dynamic-security.json')):
+            export.export_files()
+        self.assertEqual(list(collector.collect()), samples)
+
+    def test_write_failure(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'acl')
+        export.export_policy(path)
+
+        def broken():
+            yield 'user broken\n'
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            export.write_chunks(broken(), path)
+        self.assertEqual(os.listdir(directory), ['acl'])
+        with open(path) as output:
+            self.assertIn('user user\n', output.read())
+
+    def test_export_on_change(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        acl_path = os.path.join(directory, 'acl')
+        dynsec_path = os.path.join(directory, 'dynamic-security.json')
+        Topic.objects.create(name='/disabled')
+        self.assertFalse(connection.run_on_commit)
+        with self.settings(MQTT_MOSQUITTO_ACL_FILE=acl_path, MQTT_MOSQUITTO_DYNSEC_FILE=dynsec_path):
+            Topic.objects.create(name='/new')
+            self.user.delete()
+            self.assertEqual([callback[1] for callback in connection.run_on_commit], [export.export_files])
+            # The test transaction is never committed
+            export.export_files()
+        with open(acl_path) as output:
+            self.assertNotIn('user user\n', output.read())
+        with open(dynsec_path) as output:
+            self.assertNotIn('"user"', output.read())
+
+
+class RandomRulesTestCase(TestCase):
+    """
+    Replay every topic name of a few levels through the matching order of mosquitto on the exported document of random
+    rules, the decisions must be the same of Policy.has_permission
+    """
+    LEVELS = ['a', 'b', 'c']
+    FILTER_LEVELS = ['a', 'b', '+']
+
+    def setUp(self):
+        self.group = Group.objects.create(name='mqtt')
+        self.user = User.objects.create_user('user')
+        self.member = User.objects.create_user('member')
+        self.member.groups.add(self.group)
+        User.objects.create_user('other')
+        User.objects.create_superuser('admin', 'admin@test.com', 'admin')
+
+    def create_rules(self, seed, count=15):
+        generator = random.Random(seed)
+        for index in range(count):
+            levels = [generator.choice(self.FILTER_LEVELS) for level in range(generator.randint(1, 3))]
+            if generator.random() < 0.4:
+                levels.append('#')
+            if generator.random() < 0.1:
+                levels[0] = '$SYS'
+            topic, is_new = Topic.objects.get_or_create_named('/'.join(levels))
+            acl, is_new = ACL.objects.get_or_create(topic=topic, acc=generator.choice([PROTO_MQTT_ACC_PUB,
+                                                                                       PROTO_MQTT_ACC_SUS]),
+                                                    defaults={'allow': generator.random() < 0.5})
+            principal = generator.random()
+            if principal < 0.2:
+                acl.users.add(self.user)
+            elif principal < 0.4:
+                acl.groups.add(self.group)
+
+    def get_names(self):
+        names = ['$SYS/a', '$SYS/b/c']
+        for depth in range(1, 4):
+            names.extend('/'.join(levels) for levels in product(self.LEVELS, repeat=depth))
+        return names
+
+    def test_acl_file(self):
+        # The denials of mosquitto apply to both accesses before any allow, the ones that would deny an allowed check
+        # are not exported, so a check could be allowed by a less specific filter but an allowed one is never denied
+        for seed in range(5):
+            ACL.objects.all().delete()
+            self.create_rules(seed)
+            for allow, anonymous in [(False, False), (True, True)]:
+                with self.settings(MQTT_ACL_ALLOW=allow, MQTT_ACL_ALLOW_ANONIMOUS=anonymous):
+                    policy = Policy.build()
+                    sections = parse_acl_file(''.join(export.generate_acl_file(policy)))
+                    for username, name, acc in product([None, 'user', 'member', 'other', 'admin'], self.get_names(),
+                                                       [PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS]):
+                        user = policy.get_user(username) if username else None
+                        expected = (user is not None and user.is_superuser) or policy.has_permission(user, name, acc)
+                        if expected:
+                            self.assertTrue(acl_file_permission(sections[username], name, acc),
+                                            (seed, username, name, acc))
+
+    def test_dynsec(self):
+        for seed in range(5):
+            ACL.objects.all().delete()
+            self.create_rules(seed)
+            for allow, anonymous in [(False, False), (True, True)]:
+                with self.settings(MQTT_ACL_ALLOW=allow, MQTT_ACL_ALLOW_ANONIMOUS=anonymous):
+                    policy = Policy.build()
+                    document = json.loads(''.join(export.generate_dynsec(policy)))
+                    roles = {role['rolename']: role['acls'] for role in document['roles']}
+                    clients = {client['username']: roles[client['roles'][0]['rolename']]
+                               for client in document['clients']}
+                    clients[None] = roles.get(document.get('anonymousGroup'), [])
+                    for username, name, acc in product([None, 'user', 'member', 'other', 'admin'], self.get_names(),
+                                                       [PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS]):
+                        user = policy.get_user(username) if username else None
+                        expected = (user is not None and user.is_superuser) or policy.has_permission(user, name, acc)
+                        self.assertEqual(dynsec_permission(clients[username], name, acc), expected,
+                                         (seed, username, name, acc))
+
+
+class ExportPolicyTestCase(BasePolicyTestCase):
+    def test_dynsec(self):
+        for allow, anonymous in [(False, False), (True, False), (True, True)]:
+            with self.settings(MQTT_ACL_ALLOW=allow, MQTT_ACL_ALLOW_ANONIMOUS=anonymous):
+                document = json.loads(''.join(export.generate_dynsec(Policy.build())))
+                roles = {role['rolename']: role['acls'] for role in document['roles']}
+                clients = {client['username']: roles[client['roles'][0]['rolename']]
+                           for client in document['clients']}
+                clients[None] = roles.get(document.get('anonymousGroup'), [])
+                for user, name, acc in product([None, self.user, self.member, self.admin], self.TOPICS[:6],
+                                               [PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS]):
+                    self.assertEqual(dynsec_permission(clients[user.username if user else None], name, acc),
+                                     expected_permission(user, name, acc), (user, name, acc))
+
+    @override_settings(MQTT_ACL_ALLOW=True)
+    def test_acl_file_partial_denial(self):
+        # Only the subscriptions of /test/one are denied, mosquitto could not deny one access of a filter
+        sections = parse_acl_file(''.join(export.generate_acl_file(Policy.build())))
+        self.assertIn(('write', '/test/+'), sections['user'])
+        self.assertNotIn(('deny', '/test/one'), sections['user'])
+        # /test/one has not a rule of the publications, it is not exported for them
+        self.assertNotIn(('write', '/test/one'), sections['user'])
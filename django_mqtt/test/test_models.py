@@ -1,16 +1,20 @@
 from django.conf import settings
 from django.contrib.auth.models import Group, User
+from django.core import serializers
 from django.core.exceptions import ValidationError
-from django.test import TestCase
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django_mqtt import policy
 from django_mqtt.models import (
     ACL,
     PROTO_MQTT_ACC_PUB,
     PROTO_MQTT_ACC_SUS,
     WILDCARD_MULTI_LEVEL,
     ClientId,
+    PolicyVersion,
     Topic
 )
-from django_mqtt.protocol import gen_client_id
+from django_mqtt.protocol import gen_client_id, topic_digest, topic_specificity
 
 
 class TopicModelsTestCase(TestCase):
@@ -197,6 +201,52 @@ class TopicModelsTestCase(TestCase):
             '/test/1/not/2/3', '/test/1/not/2/3/4',
         ])
 
+    def test_levels(self):
+        topic = Topic.objects.create(name='/test/one')
+        self.assertEqual(topic.depth, 3)
+        self.assertEqual(topic.first_level_hash, topic_digest(''))
+        self.assertEqual(list(topic.levels.order_by('position').values_list('position', 'name')),
+                         [(1, 'test'), (2, 'one')])
+        topic.name = 'test/two'
+        topic.save()
+        self.assertEqual(topic.depth, 2)
+        self.assertEqual(topic.first_level_hash, topic_digest('test'))
+        self.assertEqual(list(topic.levels.values_list('position', 'name')), [(1, 'two')])
+        self.assertEqual(list(Topic.objects.create(name='+/two')), ['test/two'])
+
+    def test_name_hash(self):
+        topic = Topic.objects.create(name='/test/one')
+        self.assertEqual(topic.name_hash, topic_digest('/test/one'))
+        self.assertEqual(Topic.objects.named('/test/one').get(), topic)
+        self.assertEqual(Topic.objects.named(b'/test/one').get(), topic)
+        self.assertFalse(Topic.objects.named('/test').exists())
+        self.assertFalse(Topic.objects.named(None).exists())
+        self.assertRaises(ValidationError, Topic.objects.create, name='/test/one')
+        topic.name = '/test/two'
+        topic.save(update_fields=['name'])
+        self.assertEqual(Topic.objects.named('/test/two').get(), topic)
+        self.assertEqual(Topic.objects.get_or_create_named('/test/two'), (topic, False))
+
+    def test_raw_save(self):
+        data = serializers.serialize('json', [Topic(pk=10, name='$SYS/+/one')], fields=['name'])
+        for loaded in serializers.deserialize('json', data):
+            loaded.save()
+        topic = Topic.objects.named('$SYS/+/one').get()
+        self.assertEqual((topic.wildcard, topic.dollar, topic.depth), (True, True, 3))
+        self.assertEqual(topic.first_level_hash, topic_digest('$SYS'))
+        self.assertEqual(topic.specificity, topic_specificity('$SYS/+/one'))
+        self.assertEqual(list(topic.levels.order_by('position').values_list('name', flat=True)), ['+', 'one'])
+
+    def test_load_initial_data(self):
+        call_command('loaddata', 'initial_data', verbosity=0)
+        self.assertEqual(Topic.objects.named('#').get().specificity, topic_specificity('#'))
+        self.assertTrue(Topic.objects.named('$SYS/#').get().dollar)
+        self.assertEqual(ACL.get_acl('/any', PROTO_MQTT_ACC_SUS).topic.name, '#')
+
+    def test_candidates_indexed(self):
+        sql = str(Topic.objects.create(name='sensors/+/temp/#').get_candidates().query)
+        self.assertNotIn('LIKE', sql.upper())
+
     def test_delete(self):
         topic = Topic.objects.create(name='topic')
         self.assertEqual(1, Topic.objects.count())
@@ -287,6 +337,19 @@ class ACLModelsTestCase(TestCase):
         self.assertEqual(acl > acl_plus, True)
         self.assertEqual(acl_plus < acl, True)
 
+    def test_get_acl_read_only(self):
+        topic = Topic.objects.create(name='/+')
+        acl_plus = ACL.objects.create(topic=topic, acc=PROTO_MQTT_ACC_SUS, allow=True)
+        self.assertEqual(ACL.get_acl('/test', PROTO_MQTT_ACC_SUS), acl_plus)
+        self.assertEqual(ACL.get_acl(b'/test', PROTO_MQTT_ACC_SUS), acl_plus)
+        self.assertIsNone(ACL.get_acl('/test/one', PROTO_MQTT_ACC_SUS))
+        self.assertIsNone(ACL.get_acl('not valid/#/', PROTO_MQTT_ACC_SUS))
+        self.assertFalse(Topic.objects.named('/test').exists())
+        self.assertEqual(ACL.get_acl('/test', PROTO_MQTT_ACC_SUS, create=True), acl_plus)
+        self.assertTrue(Topic.objects.named('/test').exists())
+        acl = ACL.objects.create(topic=Topic.objects.named('/test').get(), acc=PROTO_MQTT_ACC_SUS, allow=False)
+        self.assertEqual(ACL.get_acl('/test', PROTO_MQTT_ACC_SUS), acl)
+
     def test_acl_get_default(self):
         for us, ano in [(False, False), (True, False), (True, True)]:
             settings.MQTT_ACL_ALLOW = us
@@ -337,3 +400,118 @@ class ACLModelsTestCase(TestCase):
         acl = ACL.objects.create(topic=topic, acc=PROTO_MQTT_ACC_SUS, allow=True)
         acl.set_password('1234')
         self.assertNotEqual(acl.password, '1234')
+
+    def test_with_principals(self):
+        topic = Topic.objects.create(name='/test')
+        acl = ACL.objects.create(topic=topic, acc=PROTO_MQTT_ACC_SUS, allow=True)
+        annotated = ACL.objects.with_principals().get(pk=acl.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(annotated.is_public())
+        acl.groups.add(self.group)
+        for user, member in [(self.user_login, False), (self.user_group, True), (self.admin, False)]:
+            annotated = ACL.objects.with_principals(user).get(pk=acl.pk)
+            with self.assertNumQueries(0):
+                self.assertFalse(annotated.is_public())
+                self.assertEqual(annotated.has_permission(user), member)
+            self.assertEqual(acl.has_permission(user), member)
+        acl.users.add(self.admin)
+        annotated = ACL.objects.with_principals(self.admin).get(pk=acl.pk)
+        with self.assertNumQueries(0):
+            self.assertTrue(annotated.has_permission(self.admin))
+        self.assertFalse(annotated.has_permission(self.user_login))
+
+    def test_get_acl_queries(self):
+        topic = Topic.objects.create(name='/test')
+        acl = ACL.objects.create(topic=topic, acc=PROTO_MQTT_ACC_SUS, allow=True)
+        acl.users.add(self.user_login)
+        with self.assertNumQueries(1):
+            self.assertTrue(ACL.get_acl('/test', PROTO_MQTT_ACC_SUS, user=self.user_login).has_permission(
+                self.user_login))
+        acl.users.add(*[User.objects.create_user('user%d' % index) for index in range(50)])
+        with self.assertNumQueries(1):
+            self.assertFalse(ACL.get_acl('/test', PROTO_MQTT_ACC_SUS, user=self.admin).has_permission(self.admin))
+
+    @override_settings(MQTT_ACL_POLICY_POLL=60)
+    def test_wildcard_index_cached(self):
+        acl_plus = ACL.objects.create(topic=Topic.objects.create(name='/+'), acc=PROTO_MQTT_ACC_SUS)
+        self.assertEqual(ACL.get_acl('/test', PROTO_MQTT_ACC_SUS), acl_plus)
+        with self.assertNumQueries(2):
+            self.assertEqual(ACL.get_acl('/other', PROTO_MQTT_ACC_SUS), acl_plus)
+        acl = ACL.objects.create(topic=Topic.objects.create(name='/other'), acc=PROTO_MQTT_ACC_SUS)
+        acl_multi = ACL.objects.create(topic=Topic.objects.create(name='/test/#'), acc=PROTO_MQTT_ACC_SUS)
+        self.assertEqual(ACL.get_acl('/other', PROTO_MQTT_ACC_SUS), acl)
+        self.assertEqual(ACL.get_acl('/test/one', PROTO_MQTT_ACC_SUS), acl_multi)
+        # Changed by other process, without signals
+        Topic.objects.filter(pk=acl_multi.topic.pk).update(name='/test/+/#', depth=3)
+        PolicyVersion.increase()
+        self.assertEqual(ACL.get_acl('/test/one', PROTO_MQTT_ACC_SUS), acl_multi)
+        policy._version_checked -= 60
+        self.assertIsNone(ACL.get_acl('/test/one', PROTO_MQTT_ACC_SUS))
+
+    def test_acl_password_hashers(self):
+        fast = 'django_mqtt.hashers.MQTTPBKDF2PasswordHasher'
+        default = 'django.contrib.auth.hashers.PBKDF2PasswordHasher'
+        topic = Topic.objects.create(name='/test')
+        acl = ACL.objects.create(topic=topic, acc=PROTO_MQTT_ACC_SUS, allow=True)
+        acl.set_password('1234')
+        acl.save()
+        self.assertTrue(acl.password.startswith('pbkdf2_sha256$'))
+        with override_settings(MQTT_ACL_PASSWORD_HASHERS=[fast]):
+            self.assertFalse(acl.check_password('1234'))
+        with override_settings(MQTT_ACL_PASSWORD_HASHERS=[fast, default]):
+            self.assertFalse(acl.check_password('4321'))
+            self.assertTrue(acl.password.startswith('pbkdf2_sha256$'))
+            self.assertTrue(acl.check_password('1234'))
+            self.assertTrue(acl.password.startswith('mqtt_pbkdf2_sha256$1000$'))
+            acl = ACL.objects.get(pk=acl.pk)
+            self.assertTrue(acl.password.startswith('mqtt_pbkdf2_sha256$'))
+            self.assertTrue(acl.check_password('1234'))
+            acl.set_password('4321')
+            self.assertTrue(acl.password.startswith('mqtt_pbkdf2_sha256$'))
+            self.assertTrue(acl.check_password('4321'))
+            acl.set_unusable_password()
+            self.assertFalse(acl.has_usable_password())
+
+    @override_settings(MQTT_ACL_ALLOW=False, MQTT_ACL_ALLOW_ANONIMOUS=False, MQTT_ACL_CACHE_SIZE=100)
+    def test_acl_get_default_cached(self):
+        ACL.get_default(PROTO_MQTT_ACC_SUS, self.user_login)
+        with self.assertNumQueries(0):
+            self.assertFalse(ACL.get_default(PROTO_MQTT_ACC_SUS, self.user_login))
+        topic = Topic.objects.create(name=WILDCARD_MULTI_LEVEL)
+        acl = ACL.objects.create(topic=topic, acc=PROTO_MQTT_ACC_SUS, allow=True)
+        ACL.get_default(PROTO_MQTT_ACC_SUS, self.user_login)
+        ACL.get_default(PROTO_MQTT_ACC_PUB, self.user_login)
+        with self.assertNumQueries(0):
+            self.assertTrue(ACL.get_default(PROTO_MQTT_ACC_SUS, self.user_login))
+            self.assertTrue(ACL.get_default(PROTO_MQTT_ACC_SUS, self.admin))
+            self.assertFalse(ACL.get_default(PROTO_MQTT_ACC_SUS))
+            self.assertFalse(ACL.get_default(PROTO_MQTT_ACC_PUB, self.user_login))
+        acl.users.add(self.user_login)
+        acl.groups.add(self.group)
+        ACL.get_default(PROTO_MQTT_ACC_SUS, self.user_login)
+        with self.assertNumQueries(0):
+            self.assertTrue(ACL.get_default(PROTO_MQTT_ACC_SUS, self.user_login))
+        with self.assertNumQueries(1):
+            self.assertTrue(ACL.get_default(PROTO_MQTT_ACC_SUS, self.user_group))
+        with self.assertNumQueries(1):
+            self.assertFalse(ACL.get_default(PROTO_MQTT_ACC_SUS, self.admin))
+        acl.delete()
+        self.assertFalse(ACL.get_default(PROTO_MQTT_ACC_SUS, self.user_login))
+
+    def test_get_acl_specificity(self):
+        for name in ['/a/#', '/a/+', '/+/b', '#', '+/+']:
+            topic = Topic.objects.create(name=name)
+            self.assertEqual(topic.specificity, topic_specificity(name))
+            ACL.objects.create(topic=topic, acc=PROTO_MQTT_ACC_SUS)
+        self.assertEqual(Topic.objects.get(name='/a/+').specificity, 1)
+        self.assertEqual(ACL.get_acl('/a/b', PROTO_MQTT_ACC_SUS).topic.name, '/a/+')  # Tie, the oldest ACL
+        self.assertEqual(ACL.get_acl('/c/b', PROTO_MQTT_ACC_SUS).topic.name, '/+/b')
+        self.assertEqual(ACL.get_acl('/a/c', PROTO_MQTT_ACC_SUS).topic.name, '/a/+')
+        self.assertEqual(ACL.get_acl('/a/c/d', PROTO_MQTT_ACC_SUS).topic.name, '/a/#')
+        self.assertEqual(ACL.get_acl('/c', PROTO_MQTT_ACC_SUS).topic.name, '+/+')
+        self.assertEqual(ACL.get_acl('/c/d/e', PROTO_MQTT_ACC_SUS).topic.name, '#')
+        topic = Topic.objects.get(name='/+/b')
+        topic.name = '/+/+'
+        topic.save(update_fields=['name'])
+        self.assertEqual(Topic.objects.get(pk=topic.pk).specificity, 2)
+        self.assertEqual(ACL.get_acl('/a/b', PROTO_MQTT_ACC_SUS).topic.name, '/a/+')
@@ -0,0 +1,328 @@
+from itertools import product
+
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import Group, User
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from django_mqtt import policy as policy_module
+from django_mqtt.models import (
+    ACL,
+    CHANGE_ACL,
+    CHANGE_ALL,
+    CHANGE_USER,
+    PROTO_MQTT_ACC_PUB,
+    PROTO_MQTT_ACC_SUS,
+    ACLChange,
+    ClientId,
+    PolicyVersion,
+    Topic
+)
+from django_mqtt.mosquitto.auth_plugin.auth import has_permission, is_clientid_allowed, resolve_permission
+from django_mqtt.policy import Policy, PolicyUser, get_policy
+
+
+class BasePolicyTestCase(TestCase):
+    TOPICS = ['/test', '/test/one', '/test/two', '/other', 'test', '$SYS/one', '#', '', None]
+
+    def setUp(self):
+        self.group = Group.objects.create(name='mqtt')
+        self.user = User.objects.create_user('user')
+        self.member = User.objects.create_user('member')
+        self.member.groups.add(self.group)
+        self.inactive = User.objects.create_user('inactive', is_active=False)
+        self.admin = User.objects.create_superuser('admin', 'admin@test.com', 'admin')
+
+        def create_acl(name, acc, allow=True, users=(), groups=(), password=None):
+            topic, is_new = Topic.objects.get_or_create_named(name)
+            acl = ACL.objects.create(topic=topic, acc=acc, allow=allow)
+            acl.users.add(*users)
+            acl.groups.add(*groups)
+            if password:
+                acl.set_password(password)
+                acl.save()
+
+        create_acl('/test', PROTO_MQTT_ACC_PUB, users=[self.user])
+        create_acl('/test/+', PROTO_MQTT_ACC_PUB, allow=False, groups=[self.group])
+        create_acl('/test/#', PROTO_MQTT_ACC_SUS)
+        create_acl('/test/one', PROTO_MQTT_ACC_SUS, allow=False)
+        create_acl('$SYS/#', PROTO_MQTT_ACC_SUS, users=[self.admin])
+        create_acl('#', PROTO_MQTT_ACC_PUB, password='1234')
+
+    def build_policy(self):
+        return Policy.build()
+
+    def build_wildcard_index(self):
+        # The wildcard index of each acc is built once by process, on the first check
+        for acc in [PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS]:
+            ACL.get_wildcard_index(acc)
+
+    def assertSameDecisions(self, policy=None):
+        policy = policy or self.build_policy()
+        users = [None, self.user, self.member, self.inactive, self.admin]
+        accs = [PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS, None, 3]
+        for user, topic, acc in product(users, self.TOPICS, accs):
+            snapshot_user = policy.get_user(user.username) if user else None
+            self.assertEqual(policy.has_permission(snapshot_user, topic, acc),
+                             resolve_permission(user, topic, acc), (user, topic, acc))
+
+
+class PolicyTestCase(BasePolicyTestCase):
+    def test_same_decisions(self):
+        for allow, anonymous in [(False, False), (True, False), (True, True)]:
+            with self.settings(MQTT_ACL_ALLOW=allow, MQTT_ACL_ALLOW_ANONIMOUS=anonymous):
+                self.assertSameDecisions()
+
+    def test_get_user(self):
+        policy = self.build_policy()
+        self.assertEqual(policy.get_user('member').groups, frozenset([self.group.pk]))
+        self.assertTrue(policy.get_user('admin').is_superuser)
+        self.assertIsNotNone(policy.get_user('inactive'))
+        self.assertIsNone(policy.get_user('inactive', active=True))
+        self.assertIsNone(policy.get_user('unknown'))
+
+    def test_specificity_tie(self):
+        # The equally specific filters are resolved by the oldest ACL, not by the collation of their names
+        older = ACL.objects.create(topic=Topic.objects.create(name='a/+'), acc=PROTO_MQTT_ACC_PUB, allow=True)
+        ACL.objects.create(topic=Topic.objects.create(name='+/x'), acc=PROTO_MQTT_ACC_PUB, allow=False)
+        policy = self.build_policy()
+        self.assertEqual(ACL.get_acl('a/x', PROTO_MQTT_ACC_PUB), older)
+        self.assertEqual(ACL.get_applicable('a/x', PROTO_MQTT_ACC_PUB)[0], older)
+        self.assertEqual(policy.get_acl('a/x', PROTO_MQTT_ACC_PUB).pk, older.pk)
+        self.assertTrue(resolve_permission(self.user, 'a/x', PROTO_MQTT_ACC_PUB))
+        self.assertTrue(policy.has_permission(policy.get_user('user'), 'a/x', PROTO_MQTT_ACC_PUB))
+
+    def test_clientids(self):
+        ClientId.objects.create(name='public')
+        ClientId.objects.create(name='bound').users.add(self.user)
+        ClientId.objects.create(name='group').groups.add(self.group)
+        policy = self.build_policy()
+        self.assertIsNone(policy.get_clientid('public'))
+        for user, name in product([None, self.user, self.member, self.admin],
+                                  ['public', 'bound', 'group', 'unknown', None]):
+            snapshot_user = policy.get_user(user.username) if user else None
+            self.assertEqual(policy.is_clientid_allowed(snapshot_user, name), is_clientid_allowed(user, name),
+                             (user, name))
+
+    def test_version(self):
+        version = PolicyVersion.get_version()
+        Topic.objects.create(name='/new')
+        self.assertEqual(PolicyVersion.get_version(), version + 1)
+        self.user.groups.add(self.group)
+        self.assertEqual(PolicyVersion.get_version(), version + 2)
+        self.user.last_login = self.user.date_joined
+        self.user.save(update_fields=['last_login'])
+        self.assertEqual(PolicyVersion.get_version(), version + 2)
+
+    @override_settings(MQTT_ACL_POLICY=True, MQTT_ACL_POLICY_POLL=3600)
+    def test_get_policy(self):
+        policy = get_policy()
+        self.assertEqual(policy.version, PolicyVersion.get_version())
+        with self.assertNumQueries(0):
+            self.assertIs(get_policy(), policy)
+            self.assertTrue(policy.has_permission(policy.get_user('user'), '/test', PROTO_MQTT_ACC_PUB))
+        ACL.objects.filter(topic__name='/test').get().groups.add(self.group)
+        self.user.delete()
+        swapped = get_policy()
+        self.assertIsNone(swapped.get_user('user'))
+        self.assertTrue(swapped.has_permission(swapped.get_user('member'), '/test', PROTO_MQTT_ACC_PUB))
+
+    @override_settings(MQTT_ACL_POLICY=True, MQTT_ACL_POLICY_POLL=0)
+    def test_other_process_change(self):
+        policy = get_policy()
+        self.assertTrue(policy.has_permission(policy.get_user('user'), '/test', PROTO_MQTT_ACC_PUB))
+        acl = ACL.objects.get(topic__name='/test', acc=PROTO_MQTT_ACC_PUB)
+        acl.allow = False
+        acl.save()
+        policy_module._stale = False
+        policy = get_policy()
+        self.assertFalse(policy.has_permission(policy.get_user('user'), '/test', PROTO_MQTT_ACC_PUB))
+
+    def test_disabled(self):
+        self.assertIsNone(get_policy())
+
+
+@override_settings(MQTT_ACL_POLICY=True, MQTT_ACL_POLICY_POLL=0)
+class PolicyChangesTestCase(BasePolicyTestCase):
+    def assertUpdated(self, policy):
+        """
+        :return: The copy of policy with the changes applied, policy is not modified
+        """
+        policy_module._stale = False
+        seq = policy.seq
+        with mock.patch.object(Policy, 'build', side_effect=AssertionError('Rebuilt')):
+            updated = get_policy()
+        self.assertIsNot(updated, policy)
+        self.assertEqual(policy.seq, seq)
+        self.assertEqual(updated.seq, ACLChange.get_last_seq())
+        for allow, anonymous in [(False, False), (True, True)]:
+            with self.settings(MQTT_ACL_ALLOW=allow, MQTT_ACL_ALLOW_ANONIMOUS=anonymous):
+                self.assertSameDecisions(updated)
+        return updated
+
+    def test_apply_changes(self):
+        policy = get_policy()
+        topic = Topic.objects.get(name='/test/+')
+        topic.name = '/test/+/+'
+        topic.save()
+        policy = self.assertUpdated(policy)
+        self.user.groups.add(self.group)
+        policy = self.assertUpdated(policy)
+        self.group.user_set.remove(self.member)
+        policy = self.assertUpdated(policy)
+        self.user.username = 'renamed'
+        self.user.save()
+        policy = self.assertUpdated(policy)
+        self.assertIsNone(policy.get_user('user'))
+        self.group.delete()
+        policy = self.assertUpdated(policy)
+        extra = User.objects.create_user('extra')
+        ACL.objects.get(topic__name='/test/#').users.add(extra)
+        policy = self.assertUpdated(policy)
+        extra.delete()
+        policy = self.assertUpdated(policy)
+        Topic.objects.get(name='/test').delete()
+        policy = self.assertUpdated(policy)
+        ACL.objects.create(topic=Topic.objects.create(name='/other'), acc=PROTO_MQTT_ACC_PUB).users.add(self.member)
+        policy = self.assertUpdated(policy)
+        self.member.acl_set.clear()
+        policy = self.assertUpdated(policy)
+        bound = ClientId.objects.create(name='bound')
+        bound.users.add(self.member)
+        policy = self.assertUpdated(policy)
+        self.assertTrue(policy.is_clientid_allowed(policy.get_user('member'), 'bound'))
+        self.assertFalse(policy.is_clientid_allowed(policy.get_user('renamed'), 'bound'))
+        bound.name = 'renamed'
+        bound.save()
+        policy = self.assertUpdated(policy)
+        self.assertIsNone(policy.get_clientid('bound'))
+        self.assertIsNotNone(policy.get_clientid('renamed'))
+        bound.delete()
+        policy = self.assertUpdated(policy)
+        self.assertIsNone(policy.get_clientid('renamed'))
+
+    def test_copy_on_write(self):
+        policy = get_policy()
+        acl = ACL.objects.get(topic__name='/test/#', acc=PROTO_MQTT_ACC_SUS)
+        acl.allow = False
+        acl.save()
+        updated = self.assertUpdated(policy)
+        self.assertTrue(policy.get_acl('/test/two', PROTO_MQTT_ACC_SUS).allow)
+        self.assertFalse(updated.get_acl('/test/two', PROTO_MQTT_ACC_SUS).allow)
+        self.assertIsNot(updated.wildcards[PROTO_MQTT_ACC_SUS], policy.wildcards[PROTO_MQTT_ACC_SUS])
+        policy_module._stale = False
+        self.assertIs(get_policy(), updated)
+
+    def test_change_log(self):
+        seq = ACLChange.get_last_seq()
+        acl = ACL.objects.get(topic__name='/test', acc=PROTO_MQTT_ACC_PUB)
+        acl.users.add(self.member)
+        self.group.user_set.add(self.user, self.inactive)
+        self.user.acl_set.clear()
+        self.assertEqual(sorted(ACLChange.objects.filter(seq__gt=seq).values_list('model', 'object_id')), [
+            (CHANGE_ACL, acl.pk), (CHANGE_USER, self.user.pk), (CHANGE_USER, self.user.pk),
+            (CHANGE_USER, self.inactive.pk)
+        ])
+
+    @override_settings(MQTT_ACL_POLICY_DELTA_LIMIT=1)
+    def test_delta_limit(self):
+        policy = get_policy()
+        Topic.objects.create(name='/new')
+        policy = self.assertUpdated(policy)
+        Topic.objects.create(name='/new/one')
+        Topic.objects.create(name='/new/two')
+        policy_module._stale = False
+        with mock.patch.object(Policy, 'build', wraps=Policy.build) as build:
+            self.assertIsNot(get_policy(), policy)
+        build.assert_called_once_with(with_users=True)
+
+    def test_log_reset(self):
+        policy = get_policy()
+        ACLChange.objects.all().delete()
+        Topic.objects.create(name='/new')
+        self.assertIsNot(get_policy(), policy)
+
+    def test_change_all(self):
+        policy = get_policy()
+        ACLChange.log(CHANGE_ALL)
+        self.assertIsNot(get_policy(), policy)
+        self.assertEqual(get_policy().seq, ACLChange.get_last_seq())
+
+    def test_gaps(self):
+        policy = get_policy()
+        seq = policy.seq
+        acl = ACL.objects.get(topic__name='/test', acc=PROTO_MQTT_ACC_PUB)
+        created = timezone.now()
+        self.assertTrue(policy.apply_changes([(seq + 3, CHANGE_ACL, acl.pk, created)]))
+        self.assertEqual((policy.seq, policy.created), (seq + 3, created))
+        self.assertEqual(set(policy.gaps), {seq + 1, seq + 2})
+        self.assertTrue(policy.apply_changes([(seq + 2, CHANGE_ACL, acl.pk, created)]))
+        self.assertEqual(policy.seq, seq + 3)
+        self.assertEqual(set(policy.gaps), {seq + 1})
+        self.assertTrue(policy.apply_changes([], gap_timeout=0))
+        self.assertEqual(policy.gaps, {})
+
+    def test_compact(self):
+        ACLChange.objects.all().delete()
+        acl = ACL.objects.get(topic__name='/test', acc=PROTO_MQTT_ACC_PUB)
+        for allow in [False, True, False]:
+            acl.allow = allow
+            acl.save()
+        self.user.groups.add(self.group)
+        self.assertEqual(ACLChange.compact(), 2)
+        self.assertEqual(list(ACLChange.objects.order_by('seq').values_list('model', 'object_id')),
+                         [(CHANGE_ACL, acl.pk), (CHANGE_USER, self.user.pk)])
+        out = StringIO()
+        call_command('mqtt_acl_compact', '--reset', stdout=out)
+        self.assertEqual(list(ACLChange.objects.values_list('model', 'object_id')), [(CHANGE_ALL, None)])
+        self.assertIn('2 changes deleted', out.getvalue())
+
+
+@override_settings(MQTT_USER_POLICY_CACHE_SIZE=100, MQTT_ACL_POLICY_POLL=3600)
+class UserPolicyTestCase(BasePolicyTestCase):
+    def setUp(self):
+        super(UserPolicyTestCase, self).setUp()
+        # The rollback of the previous test does not send acl_changed
+        policy_module.user_policies.clear()
+        policy_module._version = None
+        policy_module._rules_policy = None
+
+    def test_same_decisions(self):
+        accs = [PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS, None, 3]
+        for allow, anonymous in [(False, False), (True, False), (True, True)]:
+            with self.settings(MQTT_ACL_ALLOW=allow, MQTT_ACL_ALLOW_ANONIMOUS=anonymous):
+                policy = Policy.build(with_users=False)
+                self.assertEqual(policy.users, {})
+                for user in [self.user, self.member, self.inactive, self.admin]:
+                    policy_user = Policy.load_users(pks=[user.pk])[user.username]
+                    for topic, acc in product(self.TOPICS, accs):
+                        self.assertEqual(policy.has_permission(policy_user, topic, acc),
+                                         resolve_permission(user, topic, acc), (user, topic, acc))
+
+    def test_cached(self):
+        self.assertTrue(has_permission(self.user, '/test', PROTO_MQTT_ACC_PUB))
+        shared = policy_module._rules_policy
+        self.assertFalse(has_permission(self.member, '/test', PROTO_MQTT_ACC_PUB))
+        # The users share the same rules, only their PolicyUser is cached
+        self.assertIs(policy_module._rules_policy, shared)
+        self.assertIsInstance(policy_module.user_policies.get(self.member.pk), PolicyUser)
+        with self.assertNumQueries(0):
+            self.assertFalse(has_permission(self.user, '/test/one', PROTO_MQTT_ACC_SUS))
+            self.assertTrue(has_permission(self.user, '/test/two', PROTO_MQTT_ACC_SUS))
+        ACL.objects.filter(topic__name='/test/#').update(allow=False)
+        self.assertTrue(has_permission(self.user, '/test/two', PROTO_MQTT_ACC_SUS))
+        PolicyVersion.increase()
+        with self.settings(MQTT_ACL_POLICY_POLL=0):
+            self.assertFalse(has_permission(self.user, '/test/two', PROTO_MQTT_ACC_SUS))
+        self.assertFalse(has_permission(self.member, '/test/two', PROTO_MQTT_ACC_PUB))
+        self.member.groups.remove(self.group)
+        self.assertTrue(has_permission(self.member, '/test/two', PROTO_MQTT_ACC_PUB))
+        self.assertEqual(policy_module.user_policies.get(self.member.pk).groups, frozenset())
+
+    def test_anonymous(self):
+        with self.assertNumQueries(0):
+            self.assertFalse(has_permission(None, '/test', PROTO_MQTT_ACC_PUB))
+        self.assertEqual(len(policy_module.user_policies), 0)
@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+
+from django.test import override_settings
+
+from django_mqtt import policy as policy_module
+from django_mqtt.models import PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS, PolicyVersion
+from django_mqtt.policy import Policy, get_policy
+from django_mqtt.policy_file import MappedPolicy, PolicyFileError, load_policy, write_policy
+from django_mqtt.test import test_policy
+
+
+class MappedPolicyTestCase(test_policy.PolicyTestCase):
+    def setUp(self):
+        super(MappedPolicyTestCase, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'acl.policy')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super(MappedPolicyTestCase, self).tearDown()
+
+    def build_policy(self):
+        write_policy(Policy.build(), self.path)
+        return MappedPolicy(self.path)
+
+    def test_same_acl(self):
+        policy = Policy.build()
+        mapped = self.build_policy()
+        for topic in self.TOPICS + ['/test/one/two', '$SYS/one/two', 'other/$SYS']:
+            for acc in [PROTO_MQTT_ACC_PUB, PROTO_MQTT_ACC_SUS]:
+                rule = policy.get_acl(topic, acc)
+                mapped_rule = mapped.get_acl(topic, acc)
+                self.assertEqual(rule.pk if rule else None, mapped_rule.pk if mapped_rule else None, (topic, acc))
+
+    def test_invalid_file(self):
+        with open(self.path, 'wb') as policy_file:
+            policy_file.write(b'not a policy file')
+        self.assertRaises(PolicyFileError, MappedPolicy, self.path)
+        policy = load_policy(self.path, PolicyVersion.get_version())
+        self.assertEqual(policy.version, PolicyVersion.get_version())
+
+    def test_load_policy(self):
+        version = PolicyVersion.get_version()
+        policy = load_policy(self.path, version)
+        self.assertIsInstance(policy, MappedPolicy)
+        with self.assertNumQueries(0):
+            self.assertIs(load_policy(self.path, version, current=policy), policy)
+            other = load_policy(self.path, version)
+        self.assertIsNot(other, policy)
+        self.assertEqual(other.inode, policy.inode)
+        PolicyVersion.increase()
+        swapped = load_policy(self.path, version + 1, current=policy)
+        self.assertNotEqual(swapped.inode, policy.inode)
+        self.assertEqual(swapped.version, version + 1)
+        self.assertTrue(policy.has_permission(policy.get_user('user'), '/test', PROTO_MQTT_ACC_PUB))
+
+    def test_get_policy(self):
+        with self.settings(MQTT_ACL_POLICY_FILE=self.path):
+            super(MappedPolicyTestCase, self).test_get_policy()
+
+    def test_other_process_change(self):
+        with self.settings(MQTT_ACL_POLICY_FILE=self.path):
+            super(MappedPolicyTestCase, self).test_other_process_change()
+
+    @override_settings(MQTT_ACL_POLICY=True, MQTT_ACL_POLICY_POLL=0)
+    def test_shared_file(self):
+        with self.settings(MQTT_ACL_POLICY_FILE=self.path):
+            policy = get_policy()
+            self.assertIsInstance(policy, MappedPolicy)
+            policy_module._policy = None
+            with self.assertNumQueries(1):
+                other = get_policy()
+            self.assertEqual(other.inode, policy.inode)
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""
+Benchmark of the ACL password checks by second on one core with each hasher of MQTT_ACL_PASSWORD_HASHERS.
+
+Usage: python script/bench_acl_hashers.py [seconds]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'test_web.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from django.test.utils import override_settings  # noqa: E402
+
+from django_mqtt.hashers import check_password, make_password  # noqa: E402
+
+HASHERS = [
+    'django.contrib.auth.hashers.PBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.Argon2PasswordHasher',
+    'django.contrib.auth.hashers.BCryptSHA256PasswordHasher',
+    'django_mqtt.hashers.MQTTPBKDF2PasswordHasher',
+    'django.contrib.auth.hashers.SHA1PasswordHasher',
+]
+PASSWORD = 'K4sO2vYpR8m1'
+
+
+def bench(hasher, seconds):
+    with override_settings(MQTT_ACL_PASSWORD_HASHERS=[hasher]):
+        try:
+            encoded = make_password(PASSWORD)
+        except ValueError as error:  # Library not installed
+            print('%-56s %s' % (hasher, error))
+            return
+        checks = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            check_password(PASSWORD, encoded)
+            checks += 1
+        print('%-56s %12.1f checks/s' % (hasher, checks / (time.perf_counter() - start)))
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    for hasher in HASHERS:
+        bench(hasher, seconds)
+
+
+if __name__ == '__main__':
+    main()
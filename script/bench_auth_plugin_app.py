@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Benchmark of the acl requests by second on one core through the urls.py route, with all the middlewares of the
+project, against the minimal WSGI application of django_mqtt.mosquitto.auth_plugin.app, resolved with queries and
+with the policy snapshot.
+
+Usage: python script/bench_auth_plugin_app.py [seconds]
+"""
+import os
+import sys
+import time
+from io import BytesIO
+from urllib.parse import urlencode
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'test_web.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.core.handlers.wsgi import WSGIHandler  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import override_settings, setup_test_environment  # noqa: E402
+
+from django_mqtt.models import ACL, PROTO_MQTT_ACC_PUB, Topic  # noqa: E402
+from django_mqtt.mosquitto.auth_plugin.app import AuthPluginWSGIHandler  # noqa: E402
+
+PATH = '/mqtt/acl'
+BODY = urlencode({'username': 'user', 'topic': '/sensors/one', 'acc': PROTO_MQTT_ACC_PUB}).encode()
+
+
+def request(application):
+    environ = {
+        'REQUEST_METHOD': 'POST', 'PATH_INFO': PATH, 'SCRIPT_NAME': '', 'SERVER_NAME': 'testserver',
+        'SERVER_PORT': '80', 'wsgi.url_scheme': 'http', 'CONTENT_TYPE': 'application/x-www-form-urlencoded',
+        'CONTENT_LENGTH': str(len(BODY)), 'wsgi.input': BytesIO(BODY),
+    }
+    statuses = []
+    response = application(environ, lambda status, headers: statuses.append(status))
+    b''.join(response)
+    if hasattr(response, 'close'):
+        response.close()
+    assert statuses[0].startswith('200'), statuses[0]
+
+
+def bench(label, application, seconds):
+    requests = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        request(application)
+        requests += 1
+    print('%-32s %12.1f requests/s' % (label, requests / (time.perf_counter() - start)))
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+    user = User.objects.create_user('user')
+    ACL.objects.create(topic=Topic.objects.create(name='/sensors/+'), acc=PROTO_MQTT_ACC_PUB).users.add(user)
+
+    bench('urls.py route', WSGIHandler(), seconds)
+    bench('auth_plugin.app', AuthPluginWSGIHandler(), seconds)
+    # Without queries by request the difference is the cost of the urls and middlewares
+    with override_settings(MQTT_ACL_POLICY=True, MQTT_ACL_POLICY_POLL=3600):
+        bench('urls.py route (policy)', WSGIHandler(), seconds)
+        bench('auth_plugin.app (policy)', AuthPluginWSGIHandler(), seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+"""
+Benchmark of the overhead by request of the metrics of the auth plugin endpoints, calling a decision directly and
+through django_mqtt.metrics.measure without and with MQTT_METRICS.
+
+Usage: python script/bench_metrics.py [calls]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'test_web.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from django.test.utils import override_settings  # noqa: E402
+
+from django_mqtt.metrics import measure  # noqa: E402
+
+
+def decision(data):
+    return True
+
+
+def bench(label, function, calls):
+    data = {}
+    start = time.perf_counter()
+    for index in range(calls):
+        function(data)
+    elapsed = time.perf_counter() - start
+    print('%-24s %10.3f us/call' % (label, elapsed / calls * 1e6))
+    return elapsed / calls
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    direct = bench('direct', decision, calls)
+    disabled = bench('MQTT_METRICS = False', lambda data: measure('acl', decision, data), calls)
+    with override_settings(MQTT_METRICS=True):
+        enabled = bench('MQTT_METRICS = True', lambda data: measure('acl', decision, data), calls // 10)
+    print('overhead disabled %.3f us, enabled %.3f us' % ((disabled - direct) * 1e6, (enabled - direct) * 1e6))
+
+
+if __name__ == '__main__':
+    main()
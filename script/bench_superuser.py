@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+"""
+Benchmark of the superuser checks by second on one core with 100000 users and 10 superusers, querying the user
+model against the set of MQTT_SUPERUSER_CACHE.
+
+Usage: python script/bench_superuser.py [seconds] [users]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'test_web.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from django.contrib.auth.models import User  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test.utils import override_settings, setup_test_environment  # noqa: E402
+
+from django_mqtt.mosquitto.auth_plugin.auth import superuser_allowed  # noqa: E402
+
+SUPERUSERS = 10
+
+
+def bench(label, usernames, seconds):
+    checks = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        for username in usernames:
+            superuser_allowed({'username': username})
+        checks += len(usernames)
+    print('%-32s %12.1f checks/s' % (label, checks / (time.perf_counter() - start)))
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+    User.objects.bulk_create([User(username='user%d' % index, is_superuser=index < SUPERUSERS)
+                              for index in range(users)], batch_size=5000)
+    usernames = ['user%d' % index for index in range(0, users, users // 100)] + ['unknown']
+
+    bench('query', usernames, seconds)
+    with override_settings(MQTT_SUPERUSER_CACHE=True):
+        bench('MQTT_SUPERUSER_CACHE', usernames, seconds)
+
+
+if __name__ == '__main__':
+    main()
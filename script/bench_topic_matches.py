@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+"""
+Micro-benchmark of the topic filter matching: the baseline Topic.__contains__, that built a Topic of each name and
+split both names, against the current Topic.__contains__ and topic_matches.
+
+Usage: python script/bench_topic_matches.py [rounds]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'test_web.settings')
+
+import django  # noqa: E402
+django.setup()
+
+from django_mqtt.models import Topic  # noqa: E402
+from django_mqtt.protocol import (  # noqa: E402
+    TOPIC_BEGINNING_DOLLAR,
+    TOPIC_SEP,
+    WILDCARD_MULTI_LEVEL,
+    WILDCARD_SINGLE_LEVEL,
+    topic_matches
+)
+
+FILTERS = ['#', '/+', '/sensors/+/temp', '/sensors/#', '$SYS/#', '/sensors/one/temp', '+/+/+']
+NAMES = ['/sensors/one/temp', '/sensors/two/hum', '$SYS/broker/uptime', 'sensors/one/temp', '/a']
+
+
+def is_wildcard(topic):
+    return WILDCARD_MULTI_LEVEL in topic.name or WILDCARD_SINGLE_LEVEL in topic.name
+
+
+def is_dollar(topic):
+    return topic.name.startswith(TOPIC_BEGINNING_DOLLAR)
+
+
+def baseline_contains(topic, item):
+    """
+    Frozen copy of Topic.__contains__ before topic_matches, the reference of the benchmark
+    """
+    comp = None
+    if isinstance(item, Topic):
+        comp = item
+    elif isinstance(item, str):
+        comp = Topic(name=item)
+    elif isinstance(item, bytes):
+        comp = Topic(name=item.decode())
+    if not comp:
+        return False
+
+    if topic.name == comp.name:
+        return True
+    elif not is_wildcard(topic):
+        return False
+    elif (is_dollar(topic) and not is_dollar(comp)) or (is_dollar(comp) and not is_dollar(topic)):
+        return False
+
+    my_parts = topic.name.split(TOPIC_SEP)
+    comp_parts = comp.name.split(TOPIC_SEP)
+    if is_dollar(topic):
+        if my_parts[0] != comp_parts[0]:
+            return False
+
+    comp_size = len(comp_parts)
+    if comp_size < len(my_parts):
+        return False
+    if not topic.name.endswith(WILDCARD_MULTI_LEVEL) and comp_size > len(my_parts):
+        return False
+
+    iter_comp = iter(comp_parts)
+    for part in my_parts:
+        compare = next(iter_comp)
+        if part == WILDCARD_SINGLE_LEVEL:
+            if is_wildcard(comp) and compare == WILDCARD_MULTI_LEVEL:
+                return False
+        elif part == WILDCARD_MULTI_LEVEL:
+            return True
+        elif part != compare:
+            return False
+    return True
+
+
+def bench(label, check, rounds, baseline=None):
+    """
+    :return: matches by second
+    """
+    pairs = len(FILTERS) * len(NAMES)
+    rate = pairs * rounds / timeit.timeit(check, number=rounds)
+    speedup = '' if baseline is None else '%8.1fx' % (rate / baseline)
+    print('%-32s %12.0f matches/s%s' % (label, rate, speedup))
+    return rate
+
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    topics = [Topic(name=name) for name in FILTERS]
+    for topic in topics:
+        for name in NAMES:
+            assert baseline_contains(topic, name) == (name in topic) == topic_matches(topic.name, name), \
+                (topic.name, name)
+
+    def baseline_model_contains():
+        for topic in topics:
+            for name in NAMES:
+                baseline_contains(topic, name)
+
+    def model_contains():
+        for topic in topics:
+            for name in NAMES:
+                name in topic
+
+    def string_matches():
+        for topic_filter in FILTERS:
+            for name in NAMES:
+                topic_matches(topic_filter, name)
+
+    baseline = bench('baseline Topic.__contains__(str)', baseline_model_contains, rounds)
+    bench('Topic.__contains__(str)', model_contains, rounds, baseline)
+    bench('topic_matches(str, str)', string_matches, rounds, baseline)
+
+
+if __name__ == '__main__':
+    main()
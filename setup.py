@@ -12,6 +12,7 @@ setup(name='django-mqtt',
       url=meta.__homepage__,
       license=meta.__license__,
       keywords='django mqtt',
+      install_requires=['Django>=3.1'],
       classifiers=[
           "Framework :: Django",
           "Environment :: Web Environment",
@@ -21,6 +22,8 @@ setup(name='django-mqtt',
       ],
       packages=[
           'django_mqtt',
+          'django_mqtt.management',
+          'django_mqtt.management.commands',
           'django_mqtt.mosquitto',
           'django_mqtt.mosquitto.auth_plugin',
           'django_mqtt.publisher',